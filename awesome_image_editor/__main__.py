@@ -1,13 +1,39 @@
 import sys
 
-from awesome_image_editor.app import Application
+from awesome_image_editor.tracing import TraceSpan, recorder
+
+# Startup is profiled with trace spans, so recording starts before anything else is imported
+PROFILE_STARTUP_ARGUMENT = "--profile-startup"
+isProfilingStartup = PROFILE_STARTUP_ARGUMENT in sys.argv
+if isProfilingStartup:
+    sys.argv.remove(PROFILE_STARTUP_ARGUMENT)
+    recorder.start()
+
+with TraceSpan("awesome_image_editor.batch_render", "imports"):
+    from awesome_image_editor.batch_render import isBatchRender, runBatchRender
+
+# Headless mode renders composites from a manifest without creating windows
+if isBatchRender(sys.argv):
+    sys.exit(runBatchRender(sys.argv[1:]))
+
+with TraceSpan("awesome_image_editor.app", "imports"):
+    from awesome_image_editor.app import Application  # noqa
 
 # Create app before importing main window to ensure a QApplication is created before any pixmaps,
 # and before accessing palette through QApplication for example
-app = Application(sys.argv)
+with TraceSpan("Application", "window"):
+    app = Application(sys.argv)
+
+with TraceSpan("awesome_image_editor.main_window", "imports"):
+    from awesome_image_editor.main_window import MainWindow  # noqa
+
+with TraceSpan("MainWindow", "window"):
+    mainWindow = MainWindow()
+    mainWindow.showMaximized()
+
+if isProfilingStartup:
+    from awesome_image_editor.startup_profile import reportAfterFirstFrame
 
-from awesome_image_editor.main_window import MainWindow  # noqa
+    reportAfterFirstFrame(mainWindow)
 
-mainWindow = MainWindow()
-mainWindow.showMaximized()
 app.exec()
@@ -1,11 +1,17 @@
-import platform
+import sys
 from pathlib import Path
 
+from PyQt6.QtCore import QTimer
 from PyQt6.QtGui import QFontDatabase
 from PyQt6.QtWidgets import QApplication
 
 from awesome_image_editor.icons import getIcon
 from awesome_image_editor.palette import AIE_PALETTE
+from awesome_image_editor.tracing import TraceSpan
+
+FONTS_DIRECTORY = Path(__file__).parent / "fonts/cantarell"
+# Only the font used by the style sheet is needed for the first frame, other weights are loaded afterwards
+STARTUP_FONT = "Cantarell-Regular.otf"
 
 
 class Application(QApplication):
@@ -13,9 +19,11 @@ class Application(QApplication):
         super().__init__(argv)
 
         # Load and set fonts
-        for entry in (Path(__file__).parent / "fonts/cantarell").iterdir():
-            QFontDatabase.addApplicationFont(entry.as_posix())
+        with TraceSpan(STARTUP_FONT, "fonts"):
+            QFontDatabase.addApplicationFont((FONTS_DIRECTORY / STARTUP_FONT).as_posix())
         self.setStyleSheet('QWidget {font-family: "Cantarell Regular";}')
+        # Runs once the event loop starts, after the first window is shown
+        QTimer.singleShot(0, self.loadDeferredFonts)
 
         # Set meta data
         self.setOrganizationName("AwesomeImageEditor")
@@ -23,7 +31,7 @@ class Application(QApplication):
         self.setApplicationName("Awesome Image Editor")
 
         # Fixes app icon not displayed in Windows taskbar
-        if platform.system() == "Windows":
+        if sys.platform == "win32":
             import ctypes
             appID = "AwesomeImageEditor.AwesomeImageEditor.AwesomeImageEditor.3"
             ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(appID)  # noqa
@@ -34,3 +42,9 @@ class Application(QApplication):
         # Set style and palette
         self.setStyle("Fusion")
         self.setPalette(AIE_PALETTE)
+
+    def loadDeferredFonts(self):
+        for entry in FONTS_DIRECTORY.iterdir():
+            if entry.name != STARTUP_FONT:
+                with TraceSpan(entry.name, "fonts"):
+                    QFontDatabase.addApplicationFont(entry.as_posix())
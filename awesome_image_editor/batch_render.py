@@ -0,0 +1,165 @@
+"""Headless batch rendering of composites described by a JSON manifest, jobs run in a pool of processes.
+
+Manifest format (paths are relative to the manifest's directory):
+
+    {
+        "canvasSize": [1920, 1080],
+        "jobs": [
+            {
+                "output": "out/0001.png",
+                "canvasSize": [800, 600],
+                "background": "#ffffff",
+                "crop": [0, 0, 400, 300],
+                "layers": [
+                    {"path": "background.jpg"},
+                    {"path": "logo.png", "location": [10, 20], "opacity": 0.5, "blendMode": "Screen"}
+                ]
+            },
+            {"output": "out/0002.png", "project": "poster.aie"}
+        ]
+    }
+
+Job's canvasSize falls back to the manifest's canvasSize, background is transparent when omitted,
+"project" renders a project file instead of a list of layers (its crop is used unless the job has a crop),
+layers are listed back to front, crop is a canvas space rectangle [x, y, width, height]."""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from PyQt6.QtCore import QPoint, QRect, QSize, Qt
+from PyQt6.QtGui import QColor, QGuiApplication, QImage, QPainter
+
+from awesome_image_editor.layers import BlendMode, ImageLayer, Layer, drawLayers
+
+BATCH_ARGUMENT = "--batch"
+
+# Jobs are sent to worker processes in chunks, so thousands of small jobs don't cost a round trip each
+JOBS_PER_CHUNK = 8
+
+_application: Optional[QGuiApplication] = None
+
+
+def isBatchRender(argv: list[str]):
+    return BATCH_ARGUMENT in argv
+
+
+def initRenderProcess():
+    """Create the Qt application of a render process, without windows (offscreen platform)"""
+    global _application
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    if QGuiApplication.instance() is None:
+        _application = QGuiApplication([sys.argv[0]])
+
+
+def loadJobLayers(job: dict, baseDirectory: Path) -> tuple[QSize, list[Layer], Optional[QRect]]:
+    if "project" in job:
+        # Imported here, so the editor's startup (which imports this module to check for batch mode) doesn't load it
+        from awesome_image_editor.project_file import ProjectFile
+
+        canvasSize, layers, cropRect = ProjectFile(str(baseDirectory / job["project"])).load()
+        if "crop" in job:
+            cropRect = QRect(*job["crop"])
+        return canvasSize, layers, cropRect
+
+    layers = []
+    for record in job["layers"]:
+        image = QImage(str(baseDirectory / record["path"]))
+        if image.isNull():
+            raise ValueError(f"Failed to load image: {record['path']}")
+        layer = ImageLayer(image)
+        layer.location = QPoint(*record.get("location", (0, 0)))
+        layer.opacity = record.get("opacity", 1.0)
+        layer.blendMode = BlendMode(record.get("blendMode", BlendMode.NORMAL.value))
+        layer.isHidden = record.get("isHidden", False)
+        layers.append(layer)
+    return QSize(*job["canvasSize"]), layers, QRect(*job["crop"]) if "crop" in job else None
+
+
+def renderJob(job: dict, baseDirectory: Path) -> Optional[str]:
+    """Render a manifest job to its output file, returns an error message if it failed"""
+    try:
+        canvasSize, layers, cropRect = loadJobLayers(job, baseDirectory)
+        canvasRect = QRect(QPoint(0, 0), canvasSize)
+        if cropRect is not None:
+            canvasRect = canvasRect.intersected(cropRect)
+        if canvasRect.isEmpty():
+            return "Crop is outside the canvas"
+        # Only the cropped region is allocated and composited
+        image = QImage(canvasRect.size(), QImage.Format.Format_ARGB32_Premultiplied)
+        image.fill(QColor(job["background"]) if "background" in job else Qt.GlobalColor.transparent)
+
+        painter = QPainter()
+        painter.begin(image)
+        try:
+            painter.setRenderHint(QPainter.RenderHint.Antialiasing, True)
+            painter.translate(-canvasRect.topLeft())
+            drawLayers(painter, [layer for layer in layers if layer.boundingRect().intersects(canvasRect)])
+        finally:
+            painter.end()
+
+        output = baseDirectory / job["output"]
+        output.parent.mkdir(parents=True, exist_ok=True)
+        if not image.save(str(output)):
+            return f"Failed to save {output}"
+    except Exception as e:
+        # A broken job (e.g. a corrupted project file) is reported, the rest of the batch still renders
+        return f"{type(e).__name__}: {e}"
+    return None
+
+
+def renderJobs(jobs: list[dict], baseDirectory: Path) -> list[Optional[str]]:
+    """Runs in worker processes"""
+    return [renderJob(job, baseDirectory) for job in jobs]
+
+
+def loadManifest(path: Path) -> list[dict]:
+    with open(path, encoding="utf-8") as file:
+        manifest = json.load(file)
+    jobs = manifest["jobs"]
+    for job in jobs:
+        if "canvasSize" not in job and "canvasSize" in manifest:
+            job["canvasSize"] = manifest["canvasSize"]
+    return jobs
+
+
+def runBatchRender(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog="awesome_image_editor", description="Render composites without a window")
+    parser.add_argument(BATCH_ARGUMENT, required=True, type=Path, metavar="MANIFEST", help="JSON manifest of jobs")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="number of render processes")
+    args = parser.parse_args(argv)
+
+    jobs = loadManifest(args.batch)
+    baseDirectory = args.batch.resolve().parent
+    chunks = [jobs[i:i + JOBS_PER_CHUNK] for i in range(0, len(jobs), JOBS_PER_CHUNK)]
+
+    startTime = time.perf_counter()
+    if args.processes <= 1:
+        initRenderProcess()
+        results = [renderJobs(chunk, baseDirectory) for chunk in chunks]
+    else:
+        # Child processes are spawned instead of forked, forking a process that loaded Qt is not safe
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        with ProcessPoolExecutor(
+            max_workers=args.processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=initRenderProcess,
+        ) as executor:
+            results = list(executor.map(renderJobs, chunks, [baseDirectory] * len(chunks)))
+
+    failedCount = 0
+    for chunk, errors in zip(chunks, results):
+        for job, error in zip(chunk, errors):
+            if error is not None:
+                failedCount += 1
+                print(f"{job.get('output')}: {error}", file=sys.stderr)
+
+    elapsed = time.perf_counter() - startTime
+    print(f"Rendered {len(jobs) - failedCount}/{len(jobs)} composites in {elapsed:.2f}s", file=sys.stderr)
+    return 1 if failedCount > 0 else 0
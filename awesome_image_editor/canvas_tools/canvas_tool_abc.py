@@ -1,7 +1,10 @@
 from abc import ABC, abstractmethod
+from typing import Optional
 
-from PyQt6.QtGui import QTransform, QMouseEvent, QKeyEvent, QIcon
+from PyQt6.QtGui import QTransform, QMouseEvent, QKeyEvent, QIcon, QPainter
 
+from awesome_image_editor.icons import getIcon
+from awesome_image_editor.layers import Layer
 from awesome_image_editor.project_model import ProjectModel
 
 
@@ -21,9 +24,24 @@ class CanvasToolABC(ABC):
     @abstractmethod
     def keyRelease(self, event: QKeyEvent): ...
 
+    def drawOverlay(self, painter: QPainter, project: ProjectModel):
+        """Draw over the canvas while the tool is active, painter's transform is canvas space"""
+
+    @staticmethod
+    def pickLayer(event: QMouseEvent, canvasTransform: QTransform, project: ProjectModel,
+                  isAlphaAccurate: bool = True) -> Optional[Layer]:
+        """Frontmost layer under the mouse (see ProjectModel.layerAt)"""
+        canvasInverseTransform = canvasTransform.inverted()[0]
+        return project.layerAt(canvasInverseTransform.map(event.pos()), isAlphaAccurate)
+
     @property
     @abstractmethod
-    def icon(self) -> QIcon: ...
+    def iconPath(self) -> str:
+        """Path relative to the "icons" directory, the icon is only loaded when the toolbar is painted"""
+
+    @property
+    def icon(self) -> QIcon:
+        return getIcon(self.iconPath)
 
     @property
     @abstractmethod
@@ -1,18 +1,20 @@
 from typing import Optional
 
-from PyQt6.QtCore import QSize, QPoint, QEvent, QMargins, QRect, Qt
+from PyQt6.QtCore import QSize, QPoint, QEvent, QMargins, QRect, Qt, pyqtSignal
 from PyQt6.QtGui import QPainter, QPaintEvent, QMouseEvent
 from PyQt6.QtWidgets import QWidget
 
 from awesome_image_editor.canvas_tools.tools.crop import CropTool
 from awesome_image_editor.canvas_tools.tools.move import MoveTool
-from awesome_image_editor.pixmap_utils import getTintedPixmap
+from awesome_image_editor.icons import getIconPixmap
 
 PADDING = 3
 SPACING = 3
 
 
 class CanvasToolBar(QWidget):
+    currentToolChanged = pyqtSignal()
+
     def __init__(self, parent: QWidget):
         super().__init__(parent)
 
@@ -46,6 +48,7 @@ class CanvasToolBar(QWidget):
                 if not (self._currentTool is tool):
                     self._currentTool = tool
                     self.update()
+                    self.currentToolChanged.emit()
                 break
 
     def leaveEvent(self, event: QEvent) -> None:
@@ -75,11 +78,11 @@ class CanvasToolBar(QWidget):
                 if buttonRect.contains(self._currentMousePos):
                     self.drawButtonBackground(painter, buttonRect)
 
-            # TODO: cache icons
-            iconPixmap = tool.icon.pixmap(self._iconSize)
+            tint = None
             if tool is self._currentTool:
-                iconPixmap = getTintedPixmap(iconPixmap, self.palette().highlightedText())
+                tint = self.palette().highlightedText().color()
                 self.drawButtonBackground(painter, buttonRect)
+            iconPixmap = getIconPixmap(tool.icon, self._iconSize, self.devicePixelRatioF(), tint)
 
             painter.drawPixmap(buttonRect.x() + self._buttonSize.width() // 2 - self._iconSize.width() // 2,
                                buttonRect.y() + self._buttonSize.height() // 2 - self._iconSize.height() // 2,
@@ -1,16 +1,87 @@
-from PyQt6.QtGui import QMouseEvent, QTransform, QKeyEvent
+from typing import Optional
+
+from PyQt6.QtCore import QPoint, QRect, Qt
+from PyQt6.QtGui import QColor, QKeyEvent, QMouseEvent, QPainter, QPen, QTransform
 
 from awesome_image_editor.canvas_tools.canvas_tool_abc import CanvasToolABC
-from awesome_image_editor.icons import getIcon
 from awesome_image_editor.project_model import ProjectModel
 
+# Distance (in widget pixels) from a crop edge within which pressing drags that edge
+EDGE_GRAB_DISTANCE = 6
+
 
 class CropTool(CanvasToolABC):
-    icon = getIcon("tools/tool_crop.svg")
+    """Drag to crop to a new rectangle, or drag edges and corners of the current crop to adjust it,
+    cropping only changes the project's crop rectangle, layers keep all their pixels"""
+
+    iconPath = "tools/tool_crop.svg"
     title = "Crop"
 
+    def __init__(self):
+        self._pressMousePos: Optional[QPoint] = None
+        self._startCropRect = QRect()
+        # Edges being dragged when adjusting the current crop, empty when dragging a new rectangle
+        self._edges: set[Qt.Edge] = set()
+
+    def mousePress(self, event: QMouseEvent, canvasTransform: QTransform, project: ProjectModel):
+        # Pressing another button during a drag must not start a second drag, its history group would never end
+        if self._pressMousePos is not None or not (event.buttons() & Qt.MouseButton.LeftButton):
+            return
+        canvasInverseTransform = canvasTransform.inverted()[0]
+        self._pressMousePos = canvasInverseTransform.map(event.pos())
+        self._startCropRect = project.cropRect()
+        self._edges = self._edgesNear(self._pressMousePos, EDGE_GRAB_DISTANCE / canvasTransform.m11())
+        # All changes of a drag are undone as one step
+        project.history.beginGroup("Crop")
+
+    def _edgesNear(self, pos: QPoint, distance: float):
+        rect = self._startCropRect
+        left, top, right, bottom = rect.x(), rect.y(), rect.x() + rect.width(), rect.y() + rect.height()
+        if not (left - distance <= pos.x() <= right + distance and top - distance <= pos.y() <= bottom + distance):
+            return set()
+        edges = set()
+        if abs(pos.x() - left) <= distance:
+            edges.add(Qt.Edge.LeftEdge)
+        elif abs(pos.x() - right) <= distance:
+            edges.add(Qt.Edge.RightEdge)
+        if abs(pos.y() - top) <= distance:
+            edges.add(Qt.Edge.TopEdge)
+        elif abs(pos.y() - bottom) <= distance:
+            edges.add(Qt.Edge.BottomEdge)
+        return edges
+
+    def mouseMove(self, event: QMouseEvent, canvasTransform: QTransform, project: ProjectModel):
+        if self._pressMousePos is None:
+            return
+        canvasInverseTransform = canvasTransform.inverted()[0]
+        currentMousePos = canvasInverseTransform.map(event.pos())
+
+        if len(self._edges) > 0:
+            rect = self._startCropRect
+            left, top, right, bottom = rect.x(), rect.y(), rect.x() + rect.width(), rect.y() + rect.height()
+            delta = currentMousePos - self._pressMousePos
+            if Qt.Edge.LeftEdge in self._edges:
+                left += delta.x()
+            if Qt.Edge.RightEdge in self._edges:
+                right += delta.x()
+            if Qt.Edge.TopEdge in self._edges:
+                top += delta.y()
+            if Qt.Edge.BottomEdge in self._edges:
+                bottom += delta.y()
+        else:
+            left, top = self._pressMousePos.x(), self._pressMousePos.y()
+            right, bottom = currentMousePos.x(), currentMousePos.y()
+
+        # Edges may be dragged past each other
+        cropRect = QRect(min(left, right), min(top, bottom), abs(right - left), abs(bottom - top))
+        cropRect = cropRect.intersected(QRect(QPoint(0, 0), project.canvasSize))
+        if not cropRect.isEmpty():
+            project.setCropRect(cropRect)
+
     def mouseRelease(self, event: QMouseEvent, canvasTransform: QTransform, project: ProjectModel):
-        pass
+        if self._pressMousePos is not None and not (event.buttons() & Qt.MouseButton.LeftButton):
+            self._pressMousePos = None
+            project.history.endGroup()
 
     def keyPress(self, event: QKeyEvent):
         pass
@@ -18,8 +89,11 @@ class CropTool(CanvasToolABC):
     def keyRelease(self, event: QKeyEvent):
         pass
 
-    def mousePress(self, event: QMouseEvent, canvasTransform: QTransform, project: ProjectModel):
-        pass
-
-    def mouseMove(self, event: QMouseEvent, canvasTransform: QTransform, project: ProjectModel):
-        pass
+    def drawOverlay(self, painter: QPainter, project: ProjectModel):
+        painter.save()
+        # Cosmetic pen, so the outline stays one pixel wide at any zoom
+        pen = QPen(QColor(255, 255, 255), 0, Qt.PenStyle.DashLine)
+        painter.setPen(pen)
+        painter.setBrush(Qt.BrushStyle.NoBrush)
+        painter.drawRect(project.cropRect())
+        painter.restore()
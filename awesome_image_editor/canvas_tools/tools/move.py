@@ -3,22 +3,37 @@ from typing import Optional
 from PyQt6.QtCore import Qt, QPoint
 from PyQt6.QtGui import QMouseEvent, QTransform, QKeyEvent
 
-from awesome_image_editor.icons import getIcon
 from awesome_image_editor.project_model import ProjectModel
 from awesome_image_editor.canvas_tools.canvas_tool_abc import CanvasToolABC
 
 
 class MoveTool(CanvasToolABC):
-    icon = getIcon("tools/tool_move.svg")
+    iconPath = "tools/tool_move.svg"
     title = "Move"
 
     def __init__(self):
         self._lastMousePos: Optional[QPoint] = None
+        self._pressMousePos: Optional[QPoint] = None
 
     def mousePress(self, event: QMouseEvent, canvasTransform: QTransform, project: ProjectModel):
-        if event.buttons() & Qt.MouseButton.LeftButton:
+        # Pressing another button during a drag must not start a second drag, its history group would never end
+        if self._lastMousePos is None and event.buttons() & Qt.MouseButton.LeftButton:
             canvasInverseTransform = canvasTransform.inverted()[0]
             self._lastMousePos = canvasInverseTransform.map(event.pos())
+            self._pressMousePos = self._lastMousePos
+            if event.modifiers() & Qt.KeyboardModifier.ControlModifier:
+                # Ctrl+click moves the layer under the mouse instead of the selection
+                layer = self.pickLayer(event, canvasTransform, project)
+                if layer is not None:
+                    project.deselectAll()
+                    project.setLayersSelected([layer], True)
+                    project.activeLayer = layer
+            # Layers are only moved once on release when they can be dragged as a floating selection,
+            # otherwise all moves of a drag are undone as one step
+            if project.canFloatSelectedLayers():
+                project.startFloatingMove()
+            else:
+                project.history.beginGroup("Move")
 
     def mouseMove(self, event: QMouseEvent, canvasTransform: QTransform, project: ProjectModel):
         if self._lastMousePos is not None:
@@ -27,14 +42,19 @@ class MoveTool(CanvasToolABC):
             delta = currentMousePos - self._lastMousePos
             self._lastMousePos = currentMousePos
 
-            for layer in project.iterLayersBackToFront():
-                if layer.isSelected:
-                    layer.location += delta
-
-            project.layersVisibilityChanged.emit()
+            if project.isFloatingMove():
+                project.setFloatingOffset(currentMousePos - self._pressMousePos)
+            else:
+                project.moveSelectedLayers(delta)
 
     def mouseRelease(self, event: QMouseEvent, canvasTransform: QTransform, project: ProjectModel):
-        ...
+        if self._lastMousePos is not None and not (event.buttons() & Qt.MouseButton.LeftButton):
+            self._lastMousePos = None
+            self._pressMousePos = None
+            if project.isFloatingMove():
+                project.commitFloatingMove()
+            else:
+                project.history.endGroup()
 
     def keyPress(self, event: QKeyEvent):
         ...
@@ -1,13 +1,30 @@
+import time
 from _operator import sub
 from operator import sub
 from typing import Optional
 
-from PyQt6.QtCore import QPoint, QSize, Qt
-from PyQt6.QtGui import QKeyEvent, QMouseEvent, QPainter, QPaintEvent, QPixmap, QTransform, QWheelEvent
+from PyQt6.QtCore import QPoint, QRect, QSize, Qt
+from PyQt6.QtGui import (
+    QKeyEvent,
+    QMouseEvent,
+    QPainter,
+    QPaintEvent,
+    QPixmap,
+    QResizeEvent,
+    QTransform,
+    QWheelEvent,
+)
 from PyQt6.QtWidgets import QWidget
 
+from awesome_image_editor.change_set import ChangeSet
+from awesome_image_editor.floating_selection import FloatingSelection
+from awesome_image_editor.frame_stats import FrameStats, drawFrameStatsOverlay
+from awesome_image_editor.pixel_formats import hotPathConversions
 from awesome_image_editor.project_model import ProjectModel
 from awesome_image_editor.canvas_tools.canvas_toolbar import CanvasToolBar
+from awesome_image_editor.tiled_canvas import Compositor, TiledCanvas, levelForScale
+from awesome_image_editor.tracing import TraceSpan, traced
+from awesome_image_editor.update_scheduler import UpdateScheduler
 
 
 def createCheckerBoardTile(sideLength: int):
@@ -24,6 +41,26 @@ def createCheckerBoardTile(sideLength: int):
 
 CHECKERBOARD_PATTERN_PIXMAP = createCheckerBoardTile(16)
 
+# Margin (in canvas space) repainted around crop edges that moved, covers edge overlays drawn by tools
+CROP_EDGE_MARGIN = 2
+
+
+def cropEdgeStrips(oldCropRect: QRect, newCropRect: QRect):
+    """Rectangles covering what is inside one crop rectangle but not the other"""
+    unitedRect = oldCropRect.united(newCropRect)
+    commonRect = oldCropRect.intersected(newCropRect)
+    if commonRect.isEmpty():
+        return [oldCropRect, newCropRect]
+    unitedRight, unitedBottom = unitedRect.x() + unitedRect.width(), unitedRect.y() + unitedRect.height()
+    commonRight, commonBottom = commonRect.x() + commonRect.width(), commonRect.y() + commonRect.height()
+    strips = [
+        QRect(unitedRect.x(), unitedRect.y(), commonRect.x() - unitedRect.x(), unitedRect.height()),
+        QRect(commonRight, unitedRect.y(), unitedRight - commonRight, unitedRect.height()),
+        QRect(commonRect.x(), unitedRect.y(), commonRect.width(), commonRect.y() - unitedRect.y()),
+        QRect(commonRect.x(), commonBottom, commonRect.width(), unitedBottom - commonBottom),
+    ]
+    return [strip for strip in strips if not strip.isEmpty()]
+
 
 class CanvasView(QWidget):
     def __init__(self, parent: QWidget, project: ProjectModel, toolsToolBar: CanvasToolBar):
@@ -40,19 +77,33 @@ class CanvasView(QWidget):
         self._panStartPos = QPoint()
         self._panDelta = QPoint()
 
+        # Model changes and viewport changes are applied to the cached canvas at most once per display frame
+        self._updateScheduler = UpdateScheduler(self, self.flushUpdates)
+
         # Cached canvas
-        self._cachedCanvas = QPixmap(project.canvasSize)
-        self.repaintCache()
+        # Tiles are composited on worker threads, so heavy recomposites don't block input
+        self._tiledCanvas = TiledCanvas(self, project, isAsync=True)
+        self._tiledCanvas.tilesUpdated.connect(self.onTilesUpdated)
+        # Only composite the visible area of the canvas instead of the whole canvas
+        self._isViewportRendering = True
+        self.updateViewport()
+
+        # Pre-composited layers drawn instead of tiles while selected layers are dragged, they're kept after the drag
+        # (retiring) until tiles with the layers at their new location are composited
+        self._floatingSelection: Optional[FloatingSelection] = None
+        self._floatingOffset = QPoint(0, 0)
+        self._isFloatingSelectionRetiring = False
+
+        # Overlay with timings of the last frame
+        self._isFrameStatsVisible = False
+        self._frameStats = FrameStats()
 
         # Connect signals
-        def onLayersModify():
-            self.repaintCache()
-            self.update()
-
-        project.layersAdded.connect(onLayersModify)
-        project.layersDeleted.connect(onLayersModify)
-        project.layersOrderChanged.connect(onLayersModify)
-        project.layersVisibilityChanged.connect(onLayersModify)
+        project.layersChanged.connect(self.onLayersChanged)
+        project.canvasSizeChanged.connect(self.onCanvasSizeChanged)
+        project.cropRectChanged.connect(self.onCropRectChanged)
+        toolsToolBar.currentToolChanged.connect(self.update)
+        project.floatingMoveChanged.connect(self.onFloatingMoveChanged)
 
         self._lastMousePos: Optional[QPoint] = None
 
@@ -69,6 +120,7 @@ class CanvasView(QWidget):
         if self._isPanning:
             pos = event.pos()
             self._panDelta = sub(pos, self._panStartPos)
+            self.updateViewport()
             self.update()
             return True
         return False
@@ -77,6 +129,7 @@ class CanvasView(QWidget):
         if self._isPanning:
             self._transform *= QTransform.fromTranslate(self._panDelta.x(), self._panDelta.y())
             self._panDelta = QPoint()
+            self.updateViewport()
             self.update()
             self._isPanning = False
             return True
@@ -100,41 +153,188 @@ class CanvasView(QWidget):
     def canvasSize(self):
         return self._project.canvasSize
 
+    @traced("CanvasView.onLayersChanged")
+    def onLayersChanged(self, changes: ChangeSet):
+        damageRect = changes.damageRect()
+        if not damageRect.isEmpty():
+            self._updateScheduler.addDamage(damageRect)
+
+    def flushUpdates(self, damageRects: list[QRect]):
+        """Recomposite damaged and newly needed tiles, called by the update scheduler"""
+        for damageRect in damageRects:
+            self._tiledCanvas.invalidate(damageRect)
+        self.repaintCache()
+        for damageRect in damageRects:
+            self.updateCanvasRect(damageRect)
+        self._dropRetiredFloatingSelection()
+
+    def onTilesUpdated(self, rect: QRect):
+        self.updateCanvasRect(rect)
+        self._dropRetiredFloatingSelection()
+
+    @traced("CanvasView.onFloatingMoveChanged")
+    def onFloatingMoveChanged(self):
+        if self._project.isFloatingMove():
+            if self._floatingSelection is None or self._isFloatingSelectionRetiring:
+                with TraceSpan("FloatingSelection"):
+                    self._floatingSelection = FloatingSelection(
+                        self._project,
+                        self._tiledCanvas.regionOfInterest(),
+                        self._tiledCanvas.level,
+                        self._tiledCanvas.compositor,
+                    )
+                self._isFloatingSelectionRetiring = False
+            floatingRect = self._floatingSelection.floatingRect
+            oldRect = floatingRect.translated(self._floatingOffset)
+            self._floatingOffset = self._project.floatingOffset()
+            self.updateCanvasRect(oldRect.united(floatingRect.translated(self._floatingOffset)))
+        elif self._floatingSelection is not None:
+            # Move is committed, keep drawing the floating selection at the last offset until tiles catch up
+            self._isFloatingSelectionRetiring = True
+            self._dropRetiredFloatingSelection()
+
+    def _dropRetiredFloatingSelection(self):
+        # Changes waiting for the update scheduler haven't submitted their tiles yet
+        if (self._isFloatingSelectionRetiring and not self._updateScheduler.isPending()
+                and not self._tiledCanvas.hasPendingTiles()):
+            self._floatingSelection = None
+            self._floatingOffset = QPoint(0, 0)
+            self._isFloatingSelectionRetiring = False
+            self.update()
+
+    @traced("CanvasView.onCanvasSizeChanged")
+    def onCanvasSizeChanged(self, canvasSize: QSize):
+        self._tiledCanvas.invalidateAll()
+        self.fitView()
+        self.update()
+
+    @traced("CanvasView.onCropRectChanged")
+    def onCropRectChanged(self, oldCropRect: QRect, newCropRect: QRect):
+        # Tiles don't depend on the crop, only the strips between the old and new edges are repainted,
+        # tiles that became visible are composited
+        self._updateScheduler.schedule()
+        margin = CROP_EDGE_MARGIN
+        for rect in cropEdgeStrips(oldCropRect, newCropRect):
+            self.updateCanvasRect(rect.adjusted(-margin, -margin, margin, margin))
+
+    @traced("CanvasView.updateCanvasRect")
+    def updateCanvasRect(self, rect: QRect):
+        """Schedule a repaint of the widget area covering rect (in canvas space)"""
+        if self._isFrameStatsVisible:
+            # Overlay must be repainted with every frame
+            self.update()
+            return
+        self.update(self.viewTransform().mapRect(rect).adjusted(-1, -1, 1, 1))
+
+    def viewTransform(self):
+        """Transform from canvas space to widget space, including panning in progress"""
+        return self._transform * QTransform.fromTranslate(self._panDelta.x(), self._panDelta.y())
+
+    def canvasRect(self):
+        return QRect(QPoint(0, 0), self.canvasSize)
+
     def repaintCache(self) -> None:
-        self._cachedCanvas.fill(Qt.GlobalColor.transparent)
+        with TraceSpan("CanvasView.repaintCache"):
+            self._tiledCanvas.repaintDirtyTiles()
 
-        painter = QPainter()
-        painter.begin(self._cachedCanvas)
-        painter.setRenderHint(QPainter.RenderHint.Antialiasing, True)
+    def lastFrameStats(self):
+        return self._frameStats
 
-        for layer in self._project.iterLayersBackToFront():
-            if layer.isHidden:
-                continue
-            painter.save()
-            painter.translate(layer.location)
-            layer.draw(painter)
-            painter.restore()
+    def isFrameStatsVisible(self):
+        return self._isFrameStatsVisible
 
-        painter.end()
+    def setFrameStatsVisible(self, isFrameStatsVisible: bool):
+        self._isFrameStatsVisible = isFrameStatsVisible
+        self.update()
+
+    def isViewportRendering(self):
+        return self._isViewportRendering
+
+    def setViewportRendering(self, isViewportRendering: bool):
+        self._isViewportRendering = isViewportRendering
+        self.updateViewport()
+        self.update()
+
+    def setCompositor(self, compositor: Compositor):
+        self._tiledCanvas.setCompositor(compositor)
+        self._updateScheduler.schedule()
+        self.update()
+
+    def updateViewport(self):
+        """Composite canvas at the mipmap level matching current zoom, and only around visible area
+        when viewport rendering is enabled, newly exposed tiles are composited incrementally"""
+        self._tiledCanvas.setLevel(levelForScale(self._transform.m11()))
+        if self._isViewportRendering:
+            self._tiledCanvas.setViewport(self.viewTransform().inverted()[0].mapRect(self.rect()))
+        else:
+            self._tiledCanvas.setViewport(None)
+        self._updateScheduler.schedule()
+
+    def resizeEvent(self, event: QResizeEvent) -> None:
+        self.updateViewport()
+        super().resizeEvent(event)
 
     def paintEvent(self, event: QPaintEvent) -> None:
+        with TraceSpan("CanvasView.paintEvent"):
+            self._paint(event)
+
+    def _paint(self, event: QPaintEvent):
+        frameStartTime = time.perf_counter()
+        stats = FrameStats()
         painter = QPainter()
         painter.begin(self)
         painter.fillRect(event.rect(), self.palette().base())
 
-        if not self._cachedCanvas.isNull():
-            transform = self._transform * QTransform.fromTranslate(self._panDelta.x(), self._panDelta.y())
+        # Only the cropped region of the canvas is shown
+        canvasRect = self._project.cropRect()
+        if not canvasRect.isEmpty():
+            transform = self.viewTransform()
             painter.setTransform(transform)
             painter.save()
             # Transform is set before setClipRect to correctly represent the canvas rectangle when panning and zooming
-            painter.setClipRect(self._cachedCanvas.rect())
+            painter.setClipRect(canvasRect)
             # We reset transform so that checkerboard pattern scale doesn't change when user zooms in/out
             painter.resetTransform()
             translation = QPoint(int(transform.dx()), int(transform.dy()))
             # Pattern is moved by negative translation to align top left corner with canvas's top left corner
-            painter.drawTiledPixmap(self._cachedCanvas.rect(), CHECKERBOARD_PATTERN_PIXMAP, -1 * translation)
+            with TraceSpan("checkerboard"):
+                startTime = time.perf_counter()
+                painter.drawTiledPixmap(canvasRect, CHECKERBOARD_PATTERN_PIXMAP, -1 * translation)
+                stats.checkerboardTime = time.perf_counter() - startTime
+            painter.restore()
+            # Only draw tiles that intersect the exposed area of the widget
+            exposedRect = transform.inverted()[0].mapRect(event.rect()).adjusted(-1, -1, 1, 1)
+            painter.save()
+            painter.setClipRect(canvasRect)
+            if self._floatingSelection is not None:
+                with TraceSpan("drawFloatingSelection"):
+                    startTime = time.perf_counter()
+                    self._floatingSelection.draw(painter, self._floatingOffset)
+                    stats.tilesTime = time.perf_counter() - startTime
+                drawnKeys = []
+            else:
+                with TraceSpan("drawTiles"):
+                    startTime = time.perf_counter()
+                    drawnKeys = self._tiledCanvas.draw(painter, exposedRect)
+                    stats.tilesTime = time.perf_counter() - startTime
             painter.restore()
-            painter.drawPixmap(self._cachedCanvas.rect(), self._cachedCanvas)
+
+            self._toolsToolBar.getCurrentTool().drawOverlay(painter, self._project)
+
+            if self._isFrameStatsVisible:
+                stats.tilesDrawn = len(drawnKeys)
+                stats.layersDrawn = len({
+                    layer for key in drawnKeys for layer in self._tiledCanvas.tileLayers(key) if not layer.isHidden
+                })
+
+        stats.frameTime = time.perf_counter() - frameStartTime
+        stats.compositedTiles, stats.compositeTime = self._tiledCanvas.takeCompositeStats()
+        stats.formatConversions = sum(hotPathConversions.take().values())
+        stats.layerCount = self._project.layerCount()
+        self._frameStats = stats
+        if self._isFrameStatsVisible:
+            painter.resetTransform()
+            drawFrameStatsOverlay(painter, stats)
 
         painter.end()
 
@@ -160,6 +360,7 @@ class CanvasView(QWidget):
             self.size().width() / 2 - scaledSize.width() / 2, self.size().height() / 2 - scaledSize.height() / 2
         )
         self._transform.scale(scale, scale)
+        self.updateViewport()
 
         self.update()
 
@@ -196,6 +397,7 @@ class CanvasView(QWidget):
             deltaTransform.translate(-zoomingPoint.x(), -zoomingPoint.y())
 
             self._transform *= deltaTransform
+            self.updateViewport()
 
             self.update()
             event.accept()
@@ -0,0 +1,81 @@
+from dataclasses import dataclass, field
+from enum import Flag, auto
+from typing import Optional
+
+from PyQt6.QtCore import QRect
+
+from awesome_image_editor.layers import Layer
+
+
+class ChangeKind(Flag):
+    GEOMETRY = auto()
+    PIXELS = auto()
+    VISIBILITY = auto()
+    ORDER = auto()
+    SELECTION = auto()
+    ADDED = auto()
+    DELETED = auto()
+
+
+# Kinds of changes that affect how the canvas looks
+CANVAS_CHANGE_KINDS = (
+    ChangeKind.GEOMETRY
+    | ChangeKind.PIXELS
+    | ChangeKind.VISIBILITY
+    | ChangeKind.ORDER
+    | ChangeKind.ADDED
+    | ChangeKind.DELETED
+)
+
+# Kinds of changes that add, remove or move rows in views listing layers
+STRUCTURE_CHANGE_KINDS = ChangeKind.ORDER | ChangeKind.ADDED | ChangeKind.DELETED
+
+
+@dataclass
+class LayerChange:
+    layer: Layer
+    kind: ChangeKind
+    # Canvas space bounds before and after the change,
+    # old bounds are empty for added layers and new bounds are empty for deleted layers
+    oldBounds: QRect = field(default_factory=QRect)
+    newBounds: QRect = field(default_factory=QRect)
+
+    def damageRect(self):
+        if not (self.kind & CANVAS_CHANGE_KINDS):
+            return QRect()
+        return self.oldBounds.united(self.newBounds)
+
+
+class ChangeSet:
+    """A set of changes made to a project's layers, emitted by ProjectModel.layersChanged"""
+
+    def __init__(self, changes: Optional[list[LayerChange]] = None):
+        self.changes: list[LayerChange] = [] if changes is None else changes
+
+    def __len__(self):
+        return len(self.changes)
+
+    def __iter__(self):
+        return iter(self.changes)
+
+    def add(self, layer: Layer, kind: ChangeKind, oldBounds: QRect = QRect(), newBounds: QRect = QRect()):
+        self.changes.append(LayerChange(layer, kind, QRect(oldBounds), QRect(newBounds)))
+
+    def extend(self, other: "ChangeSet"):
+        self.changes.extend(other.changes)
+
+    def kinds(self):
+        kinds = ChangeKind(0)
+        for change in self.changes:
+            kinds |= change.kind
+        return kinds
+
+    def layers(self):
+        return {change.layer for change in self.changes}
+
+    def damageRect(self):
+        """Union of canvas space regions affected by changes"""
+        rect = QRect()
+        for change in self.changes:
+            rect = rect.united(change.damageRect())
+        return rect
@@ -0,0 +1,69 @@
+from typing import Optional
+
+from PyQt6.QtCore import QPoint, QRect, QSize
+from PyQt6.QtGui import QImage, QPainter
+
+from awesome_image_editor.layers import Layer
+from awesome_image_editor.project_model import ProjectModel
+from awesome_image_editor.tiled_canvas import Compositor, drawScaledImage
+from awesome_image_editor.workers import getThreadPool
+
+
+class FloatingSelection:
+    """Layers of a floating move composited into three images when the drag starts: layers below the floating layers,
+    the floating layers and layers above them, so the drag only draws the three images with the floating one offset.
+
+    This is only equivalent to compositing all layers when the floating layers are contiguous and they and the layers
+    above them use normal blending (see ProjectModel.canFloatSelectedLayers)."""
+
+    def __init__(self, project: ProjectModel, region: QRect, level: int, compositor: Compositor):
+        """region is the canvas space rectangle to composite (e.g. around the viewport) at mipmap level"""
+        self.region = QRect(region)
+        self.level = level
+
+        floatingLayers = set(project.floatingLayers())
+        firstIndex = min(project.layerIndex(layer) for layer in floatingLayers)
+        # Layers outside the region don't contribute to the below and above images
+        layers = list(project.iterLayersInRect(region))
+        belowLayers = [layer for layer in layers if project.layerIndex(layer) < firstIndex]
+        aboveLayers = [
+            layer for layer in layers if project.layerIndex(layer) > firstIndex and layer not in floatingLayers
+        ]
+
+        floatingRect = QRect()
+        for layer in floatingLayers:
+            floatingRect = floatingRect.united(layer.boundingRect())
+        # Keep room for dragging the floating layers a viewport away, without compositing all of a huge layer
+        width, height = region.width(), region.height()
+        self.floatingRect = floatingRect.intersected(region.adjusted(-width, -height, width, height))
+
+        pool = getThreadPool()
+        futures = [
+            self._submit(pool, compositor, self.region, belowLayers),
+            self._submit(pool, compositor, self.floatingRect, sorted(floatingLayers, key=project.layerIndex)),
+            self._submit(pool, compositor, self.region, aboveLayers),
+        ]
+        images: list[Optional[QImage]] = [None if future is None else future.result() for future in futures]
+        self._below, self._floating, self._above = images
+
+    def _submit(self, pool, compositor: Compositor, rect: QRect, layers: list[Layer]):
+        snapshot = [
+            (layer, QPoint(layer.location))
+            for layer in layers
+            if not layer.isHidden and layer.boundingRect().intersects(rect)
+        ]
+        if len(snapshot) == 0 or rect.isEmpty():
+            return None
+        scale = 1 << self.level
+        pixelSize = QSize(-(-rect.width() // scale), -(-rect.height() // scale))
+        return pool.submit(compositor, rect, pixelSize, self.level, snapshot)
+
+    def draw(self, painter: QPainter, offset: QPoint):
+        """Draw composited layers with floating layers moved by offset, painter's transform is canvas space"""
+        for rect, image in (
+            (self.region, self._below),
+            (self.floatingRect.translated(offset), self._floating),
+            (self.region, self._above),
+        ):
+            if image is not None:
+                drawScaledImage(painter, rect, image)
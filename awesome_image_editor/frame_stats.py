@@ -0,0 +1,51 @@
+from dataclasses import dataclass
+
+from PyQt6.QtCore import QMargins, QPoint, QRect, Qt
+from PyQt6.QtGui import QColor, QPainter
+
+OVERLAY_MARGIN = 8
+OVERLAY_PADDING = 6
+OVERLAY_BACKGROUND = QColor(0, 0, 0, 160)
+
+
+@dataclass
+class FrameStats:
+    """Timings (in seconds) and counts of the last painted canvas frame"""
+    frameTime: float = 0.0
+    checkerboardTime: float = 0.0
+    tilesTime: float = 0.0
+    # Tiles composited since the previous frame (on worker threads in asynchronous mode)
+    compositedTiles: int = 0
+    compositeTime: float = 0.0
+    tilesDrawn: int = 0
+    layersDrawn: int = 0
+    layerCount: int = 0
+    # Images converted to a native pixel format while compositing since the previous frame (see pixel_formats)
+    formatConversions: int = 0
+
+    def lines(self):
+        return [
+            f"Frame: {self.frameTime * 1000:.2f} ms",
+            f"  Checkerboard: {self.checkerboardTime * 1000:.2f} ms",
+            f"  Tiles: {self.tilesTime * 1000:.2f} ms",
+            f"Recomposite: {self.compositeTime * 1000:.2f} ms ({self.compositedTiles} tiles)",
+            f"Tiles drawn: {self.tilesDrawn}",
+            f"Layers drawn: {self.layersDrawn} / {self.layerCount}",
+            f"Format conversions: {self.formatConversions}",
+        ]
+
+
+def drawFrameStatsOverlay(painter: QPainter, stats: FrameStats):
+    """Draw stats in the top left corner of painter's device (painter's transform should be reset)"""
+    lines = stats.lines()
+    metrics = painter.fontMetrics()
+    width = max(metrics.horizontalAdvance(line) for line in lines)
+    height = metrics.height() * len(lines)
+    rect = QRect(QPoint(OVERLAY_MARGIN, OVERLAY_MARGIN), QPoint(OVERLAY_MARGIN + width, OVERLAY_MARGIN + height))
+
+    painter.save()
+    painter.fillRect(rect.marginsAdded(QMargins(OVERLAY_PADDING, OVERLAY_PADDING, OVERLAY_PADDING, OVERLAY_PADDING)),
+                     OVERLAY_BACKGROUND)
+    painter.setPen(Qt.GlobalColor.white)
+    painter.drawText(rect, Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop, "\n".join(lines))
+    painter.restore()
@@ -0,0 +1,357 @@
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Optional
+from weakref import WeakKeyDictionary
+
+from PyQt6.QtCore import QObject, QPoint, QRect, pyqtSignal
+from PyQt6.QtGui import QImage
+
+from awesome_image_editor.layers import Layer
+
+if TYPE_CHECKING:
+    from awesome_image_editor.project_model import ProjectModel
+
+# Pixel history is stored as tiles of this size, so an edit only stores the region it touched
+HISTORY_TILE_SIZE = 128
+
+DEFAULT_MEMORY_BUDGET = 512 * 1024 * 1024
+
+TileKey = tuple[int, int]
+
+
+def iterHistoryTileKeys(rect: QRect):
+    """Iterate keys of history tiles intersecting rect (in layer space)"""
+    if rect.isEmpty():
+        return
+    for row in range(rect.top() // HISTORY_TILE_SIZE, rect.bottom() // HISTORY_TILE_SIZE + 1):
+        for column in range(rect.left() // HISTORY_TILE_SIZE, rect.right() // HISTORY_TILE_SIZE + 1):
+            yield column, row
+
+
+def historyTileRect(key: TileKey):
+    column, row = key
+    return QRect(column * HISTORY_TILE_SIZE, row * HISTORY_TILE_SIZE, HISTORY_TILE_SIZE, HISTORY_TILE_SIZE)
+
+
+def copyHistoryTiles(image: QImage, rect: QRect, sharedTiles: Optional[dict[TileKey, QImage]] = None):
+    """Copy history tiles of image intersecting rect, tiles found in sharedTiles are reused instead"""
+    tiles = {}
+    for key in iterHistoryTileKeys(rect.intersected(image.rect())):
+        tile = None if sharedTiles is None else sharedTiles.get(key)
+        tiles[key] = tile if tile is not None else image.copy(historyTileRect(key).intersected(image.rect()))
+    return tiles
+
+
+def estimateLayerMemory(layer: Layer):
+    size = layer.size()
+    return size.width() * size.height() * 4
+
+
+class HistoryEntry(ABC):
+    title = ""
+
+    @abstractmethod
+    def undo(self, project: "ProjectModel"):
+        pass
+
+    @abstractmethod
+    def redo(self, project: "ProjectModel"):
+        pass
+
+    def memoryCost(self) -> int:
+        """Approximate number of bytes kept alive by this entry"""
+        return 0
+
+    def mergeWith(self, entry: "HistoryEntry") -> bool:
+        """Try to absorb entry that was recorded right after this one in the same group,
+        returns True on success"""
+        return False
+
+
+class GroupEntry(HistoryEntry):
+    """Several entries undone and redone as one step (e.g. all moves of a mouse drag)"""
+
+    def __init__(self, title: str):
+        self.title = title
+        self.entries: list[HistoryEntry] = []
+
+    def add(self, entry: HistoryEntry):
+        if len(self.entries) == 0 or not self.entries[-1].mergeWith(entry):
+            self.entries.append(entry)
+
+    def undo(self, project: "ProjectModel"):
+        for entry in reversed(self.entries):
+            entry.undo(project)
+
+    def redo(self, project: "ProjectModel"):
+        for entry in self.entries:
+            entry.redo(project)
+
+    def memoryCost(self):
+        return sum(entry.memoryCost() for entry in self.entries)
+
+
+class MoveEntry(HistoryEntry):
+    title = "Move"
+
+    def __init__(self, layers: list[Layer], delta: QPoint):
+        self.layers = layers
+        self.delta = QPoint(delta)
+
+    def undo(self, project: "ProjectModel"):
+        project.moveLayers(self.layers, -self.delta)
+
+    def redo(self, project: "ProjectModel"):
+        project.moveLayers(self.layers, self.delta)
+
+    def mergeWith(self, entry: HistoryEntry):
+        if not isinstance(entry, MoveEntry) or entry.layers != self.layers:
+            return False
+        self.delta += entry.delta
+        return True
+
+
+class ReorderEntry(HistoryEntry):
+    title = "Reorder"
+
+    def __init__(self, swaps: list[tuple[int, int]]):
+        # Swapped layer positions, in the order they were applied
+        self.swaps = swaps
+
+    def undo(self, project: "ProjectModel"):
+        project.swapLayers(reversed(self.swaps))
+
+    def redo(self, project: "ProjectModel"):
+        project.swapLayers(self.swaps)
+
+
+class InsertEntry(HistoryEntry):
+    """Layers added at positions (ascending), undoing deletes them"""
+    title = "Add"
+
+    def __init__(self, indexedLayers: list[tuple[int, Layer]]):
+        self.indexedLayers = indexedLayers
+
+    def undo(self, project: "ProjectModel"):
+        project.deleteLayers([layer for _, layer in self.indexedLayers])
+
+    def redo(self, project: "ProjectModel"):
+        project.insertLayers(self.indexedLayers)
+
+
+class DeleteEntry(InsertEntry):
+    title = "Delete"
+
+    def memoryCost(self):
+        # Deleted layers are only kept alive by history (added layers are owned by the project)
+        return sum(estimateLayerMemory(layer) for _, layer in self.indexedLayers)
+
+    def undo(self, project: "ProjectModel"):
+        super().redo(project)
+
+    def redo(self, project: "ProjectModel"):
+        super().undo(project)
+
+
+class LayerPropertyEntry(HistoryEntry):
+    """Change of a layer attribute that has a setter on the project (visibility, opacity, blend mode)"""
+
+    def __init__(self, title: str, layer: Layer, setterName: str, oldValue, newValue):
+        self.title = title
+        self.layer = layer
+        self.setterName = setterName
+        self.oldValue = oldValue
+        self.newValue = newValue
+
+    def undo(self, project: "ProjectModel"):
+        getattr(project, self.setterName)(self.layer, self.oldValue)
+
+    def redo(self, project: "ProjectModel"):
+        getattr(project, self.setterName)(self.layer, self.newValue)
+
+    def mergeWith(self, entry: HistoryEntry):
+        # Dragging a slider records many changes of the same property
+        if (not isinstance(entry, LayerPropertyEntry) or entry.layer is not self.layer
+                or entry.setterName != self.setterName):
+            return False
+        self.newValue = entry.newValue
+        return True
+
+
+class CropEntry(HistoryEntry):
+    """Change of the project's crop rectangle, None means not cropped"""
+    title = "Crop"
+
+    def __init__(self, oldRect: Optional[QRect], newRect: Optional[QRect]):
+        self.oldRect = oldRect
+        self.newRect = newRect
+
+    def undo(self, project: "ProjectModel"):
+        project.setCropRect(self.oldRect)
+
+    def redo(self, project: "ProjectModel"):
+        project.setCropRect(self.newRect)
+
+    def mergeWith(self, entry: HistoryEntry):
+        # Dragging a crop edge records many changes
+        if not isinstance(entry, CropEntry):
+            return False
+        self.newRect = entry.newRect
+        return True
+
+
+class PixelsEntry(HistoryEntry):
+    """Pixels of a layer before and after an edit, stored only for the history tiles the edit touched"""
+    title = "Edit Pixels"
+
+    def __init__(self, layer: Layer, oldTiles: dict[TileKey, QImage], newTiles: dict[TileKey, QImage]):
+        self.layer = layer
+        self.oldTiles = oldTiles
+        self.newTiles = newTiles
+
+    def undo(self, project: "ProjectModel"):
+        project.writeLayerTiles(self.layer, self.oldTiles)
+
+    def redo(self, project: "ProjectModel"):
+        project.writeLayerTiles(self.layer, self.newTiles)
+
+    def memoryCost(self):
+        # Tiles shared with a neighbouring entry are counted by both, so the budget errs on the side of evicting
+        return sum(tile.sizeInBytes() for tiles in (self.oldTiles, self.newTiles) for tile in tiles.values())
+
+
+class UndoHistory(QObject):
+    """Undo and redo stacks of project operations, the oldest entries are dropped when the stacks
+    take more memory than the budget.
+
+    Operations performed while an entry is being undone or redone are not recorded."""
+
+    # Emitted when entries are pushed, undone, redone or dropped
+    changed = pyqtSignal()
+
+    def __init__(self, parent: Optional[QObject], project: "ProjectModel"):
+        super().__init__(parent)
+        self._project = project
+        self._undoStack: list[HistoryEntry] = []
+        self._redoStack: list[HistoryEntry] = []
+        self._memoryBudget = DEFAULT_MEMORY_BUDGET
+        self._memoryUsage = 0
+        self._isReplaying = False
+        self._group: Optional[GroupEntry] = None
+        self._groupDepth = 0
+        # Tiles captured after the last pixel edit of each layer with the layer's pixels version at that time,
+        # while the version is unchanged they are still the layer's current pixels and are reused (copy on write)
+        # as the old tiles of the next edit instead of copying the same region again
+        self._latestTiles: WeakKeyDictionary[Layer, tuple[int, dict[TileKey, QImage]]] = WeakKeyDictionary()
+
+    @property
+    def memoryBudget(self):
+        return self._memoryBudget
+
+    def setMemoryBudget(self, memoryBudget: int):
+        self._memoryBudget = memoryBudget
+        self._evictOverBudget()
+
+    def memoryUsage(self):
+        return self._memoryUsage
+
+    def isRecording(self):
+        return not self._isReplaying
+
+    def canUndo(self):
+        return len(self._undoStack) > 0
+
+    def canRedo(self):
+        return len(self._redoStack) > 0
+
+    def undoTitle(self):
+        return self._undoStack[-1].title if self.canUndo() else ""
+
+    def redoTitle(self):
+        return self._redoStack[-1].title if self.canRedo() else ""
+
+    def clear(self):
+        self._undoStack.clear()
+        self._redoStack.clear()
+        self._latestTiles.clear()
+        self._memoryUsage = 0
+        self.changed.emit()
+
+    def beginGroup(self, title: str):
+        """Record entries pushed until the matching endGroup as a single entry, groups can nest"""
+        if self._groupDepth == 0:
+            self._group = GroupEntry(title)
+        self._groupDepth += 1
+
+    def endGroup(self):
+        self._groupDepth -= 1
+        if self._groupDepth > 0:
+            return
+        group = self._group
+        self._group = None
+        if len(group.entries) == 1:
+            self._pushEntry(group.entries[0])
+        elif len(group.entries) > 1:
+            self._pushEntry(group)
+
+    def push(self, entry: HistoryEntry):
+        if self._isReplaying:
+            return
+        if self._group is not None:
+            self._group.add(entry)
+        else:
+            self._pushEntry(entry)
+
+    def _pushEntry(self, entry: HistoryEntry):
+        for redoEntry in self._redoStack:
+            self._memoryUsage -= redoEntry.memoryCost()
+        self._redoStack.clear()
+
+        self._undoStack.append(entry)
+        self._memoryUsage += entry.memoryCost()
+        self._evictOverBudget()
+        self.changed.emit()
+
+    def _evictOverBudget(self):
+        # The newest entry is always kept, even when it alone is over budget
+        evictCount = 0
+        while self._memoryUsage > self._memoryBudget and len(self._undoStack) - evictCount > 1:
+            self._memoryUsage -= self._undoStack[evictCount].memoryCost()
+            evictCount += 1
+        if evictCount > 0:
+            del self._undoStack[:evictCount]
+            self.changed.emit()
+
+    def undo(self):
+        if not self.canUndo():
+            return
+        entry = self._undoStack.pop()
+        self._replay(entry.undo)
+        self._redoStack.append(entry)
+        self.changed.emit()
+
+    def redo(self):
+        if not self.canRedo():
+            return
+        entry = self._redoStack.pop()
+        self._replay(entry.redo)
+        self._undoStack.append(entry)
+        self.changed.emit()
+
+    def _replay(self, action):
+        self._isReplaying = True
+        try:
+            action(self._project)
+        finally:
+            self._isReplaying = False
+
+    def captureTiles(self, layer: Layer, rect: QRect):
+        """Copy history tiles of layer's image intersecting rect (in layer space),
+        tiles still current since the last recorded edit are shared instead of copied"""
+        latest = self._latestTiles.get(layer)
+        if latest is not None and latest[0] == layer.pixelsVersion:
+            return copyHistoryTiles(layer.image, rect, latest[1])
+        return copyHistoryTiles(layer.image, rect)
+
+    def setLatestTiles(self, layer: Layer, tiles: dict[TileKey, QImage]):
+        """Remember tiles that match layer's current pixels, see captureTiles"""
+        self._latestTiles[layer] = (layer.pixelsVersion, tiles)
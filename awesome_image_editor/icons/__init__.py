@@ -1,6 +1,18 @@
 from pathlib import Path
+from typing import Optional
 
-from PyQt6.QtGui import QIcon
+from PyQt6.QtCore import QSize
+from PyQt6.QtGui import QColor, QGuiApplication, QIcon, QPixmap
+
+from awesome_image_editor.pixmap_utils import getTintedPixmap
+from awesome_image_editor.tracing import TraceSpan
+
+# Icons are shared, so every widget showing an icon uses the same QIcon (and its cache key)
+_icons: dict[str, QIcon] = {}
+
+# Rasterized icons by (icon's cache key, width, height, tint's rgba or None, device pixel ratio)
+_iconPixmaps: dict[tuple[int, int, int, Optional[int], float], QPixmap] = {}
+_isWatchingScreens = False
 
 
 def getFullIconPath(path: str):
@@ -10,4 +22,46 @@ def getFullIconPath(path: str):
 
 def getIcon(path: str) -> QIcon:
     """Get an icon via its relative path to the "icons" directory"""
-    return QIcon(getFullIconPath(path))
+    icon = _icons.get(path)
+    if icon is None:
+        with TraceSpan(path, "icons"):
+            icon = _icons[path] = QIcon(getFullIconPath(path))
+    return icon
+
+
+def getIconPixmap(icon: QIcon, size: QSize, devicePixelRatio: float, tint: Optional[QColor] = None) -> QPixmap:
+    """Get icon rasterized at size (in device independent pixels) for a device pixel ratio,
+    optionally tinted (see getTintedPixmap), pixmaps are cached so painting doesn't rasterize SVGs every time"""
+    _watchScreens()
+    key = (icon.cacheKey(), size.width(), size.height(), None if tint is None else tint.rgba(), devicePixelRatio)
+    pixmap = _iconPixmaps.get(key)
+    if pixmap is None:
+        with TraceSpan("rasterizeIcon", "icons"):
+            pixmap = icon.pixmap(size, devicePixelRatio)
+            if tint is not None:
+                pixmap = getTintedPixmap(pixmap, tint)
+        _iconPixmaps[key] = pixmap
+    return pixmap
+
+
+def clearIconPixmapCache():
+    _iconPixmaps.clear()
+
+
+def _watchScreens():
+    """Drop cached pixmaps when screens (and so the device pixel ratios in use) change,
+    pixmaps for the new device pixel ratios are rasterized on the next paint"""
+    global _isWatchingScreens
+    application = QGuiApplication.instance()
+    if _isWatchingScreens or application is None:
+        return
+    _isWatchingScreens = True
+    application.screenAdded.connect(_onScreenAdded)
+    application.screenRemoved.connect(lambda screen: clearIconPixmapCache())
+    for screen in application.screens():
+        _onScreenAdded(screen)
+
+
+def _onScreenAdded(screen):
+    clearIconPixmapCache()
+    screen.logicalDotsPerInchChanged.connect(lambda dpi: clearIconPixmapCache())
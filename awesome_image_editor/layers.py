@@ -1,7 +1,32 @@
+import threading
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from enum import Enum
 
-from PyQt6.QtCore import QSize, QPoint
-from PyQt6.QtGui import QImage, QPainter
+from typing import Iterable, Optional
+
+from PyQt6.QtCore import QSize, QPoint, QRect, QRectF, Qt
+from PyQt6.QtGui import QImage, QImageReader, QPainter, QTransform
+
+from awesome_image_editor.pixel_formats import hotPathConversions, normalizeImage
+from awesome_image_editor.pixel_store import pixelStore
+
+
+class BlendMode(Enum):
+    NORMAL = "Normal"
+    MULTIPLY = "Multiply"
+    SCREEN = "Screen"
+    OVERLAY = "Overlay"
+    ADD = "Add"
+
+
+BLEND_MODE_COMPOSITION_MODES = {
+    BlendMode.NORMAL: QPainter.CompositionMode.CompositionMode_SourceOver,
+    BlendMode.MULTIPLY: QPainter.CompositionMode.CompositionMode_Multiply,
+    BlendMode.SCREEN: QPainter.CompositionMode.CompositionMode_Screen,
+    BlendMode.OVERLAY: QPainter.CompositionMode.CompositionMode_Overlay,
+    BlendMode.ADD: QPainter.CompositionMode.CompositionMode_Plus,
+}
 
 
 class Layer(ABC):
@@ -11,23 +36,447 @@ class Layer(ABC):
         self.isSelected = False
         self.name = ""
         self.location = QPoint(0, 0)
+        self.opacity = 1.0
+        self.blendMode = BlendMode.NORMAL
+        # Incremented whenever layer's pixels change, used to invalidate caches derived from pixels (e.g. thumbnails)
+        self.pixelsVersion = 0
+        # Group the layer is a child of, None for layers at the top of the project's tree
+        self.parentGroup: Optional["GroupLayer"] = None
 
     @abstractmethod
     def draw(self, painter: QPainter):
         pass
 
+    def drawLevel(self, painter: QPainter, level: int):
+        """Draw layer for a painter that is scaled down by 2^level,
+        layers may override this to draw cheaper lower resolution versions of themselves"""
+        self.draw(painter)
+
     @abstractmethod
     def size(self) -> QSize:
         pass
 
+    def boundingRect(self):
+        """Layer's bounding rectangle in canvas space"""
+        return QRect(self.location, self.size())
+
+    def isOpaque(self):
+        """Whether every pixel inside the bounding rectangle is opaque, so the layer hides what is behind it"""
+        return False
+
+    def hitTest(self, point: QPoint):
+        """Whether a canvas space point is over a pixel of the layer that isn't fully transparent,
+        layers that can't tell test against their bounding rectangle"""
+        return self.boundingRect().contains(point)
+
+    def markPixelsChanged(self):
+        self.pixelsVersion += 1
+
+    @abstractmethod
+    def duplicate(self) -> "Layer":
+        """Copy of the layer, layers sharing pixels with it until either of them is edited"""
+        pass
+
+    def _copyPropertiesTo(self, layer: "Layer"):
+        layer.name = self.name
+        layer.isHidden = self.isHidden
+        layer.location = QPoint(self.location)
+        layer.opacity = self.opacity
+        layer.blendMode = self.blendMode
+        return layer
+
+    def createThumbnail(self, size: QSize) -> QImage:
+        """Render layer scaled to fit size, may be called from worker threads"""
+        layerSize = self.size()
+        scaledSize = layerSize.scaled(size, Qt.AspectRatioMode.KeepAspectRatio)
+        thumbnail = QImage(scaledSize, QImage.Format.Format_ARGB32_Premultiplied)
+        thumbnail.fill(Qt.GlobalColor.transparent)
+        if scaledSize.isEmpty():
+            return thumbnail
+
+        painter = QPainter()
+        painter.begin(thumbnail)
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform, True)
+        scale = scaledSize.width() / layerSize.width()
+        painter.scale(scale, scale)
+        self.draw(painter)
+        painter.end()
+        return thumbnail
+
+
+def drawLayer(painter: QPainter, layer: Layer, location: QPoint, level: int = 0):
+    painter.save()
+    painter.translate(location)
+    painter.setOpacity(painter.opacity() * layer.opacity)
+    painter.setCompositionMode(BLEND_MODE_COMPOSITION_MODES[layer.blendMode])
+    if level == 0:
+        layer.draw(painter)
+    else:
+        layer.drawLevel(painter, level)
+    painter.restore()
+
+
+def drawLayers(painter: QPainter, layers: Iterable[Layer], level: int = 0):
+    """Draw layers back to front using painter's current transform as canvas space,
+    level is the mipmap level matching the painter's scale (see Layer.drawLevel)"""
+    for layer in layers:
+        if layer.isHidden:
+            continue
+        drawLayer(painter, layer, layer.location, level)
+
+
+def hitTestImage(image: QImage, point: QPoint, size: QSize):
+    """Whether the pixel under a layer space point isn't fully transparent, image covers size in layer space
+    (it may be a lower resolution version of the layer, e.g. a mipmap)"""
+    if image.isNull() or not QRect(QPoint(0, 0), size).contains(point):
+        return False
+    x = point.x() * image.width() // size.width()
+    y = point.y() * image.height() // size.height()
+    return image.pixelColor(x, y).alpha() > 0
+
+
+# Larger group composites (in pixels, at the mipmap level drawn) aren't cached, the part of the group that is drawn
+# is composited when drawing instead, in bands of at most this many pixels
+GROUP_COMPOSITE_MAX_PIXELS = 4096 * 4096
+# Memory used by cached composites of all groups, least recently used composites are dropped first
+GROUP_COMPOSITES_BUDGET = 256 * 1024 * 1024
+
+
+class GroupCompositeCache:
+    """Composites of groups (one per group, with the key it was made for) limited by a memory budget,
+    safe to use from worker threads"""
+
+    def __init__(self, budget: int):
+        self._budget = budget
+        self._usage = 0
+        self._composites: OrderedDict["GroupLayer", tuple[tuple, QImage]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, group: "GroupLayer", key: tuple) -> Optional[QImage]:
+        with self._lock:
+            entry = self._composites.get(group)
+            if entry is None or entry[0] != key:
+                return None
+            self._composites.move_to_end(group)
+            return entry[1]
+
+    def put(self, group: "GroupLayer", key: tuple, image: QImage):
+        with self._lock:
+            previous = self._composites.pop(group, None)
+            if previous is not None:
+                self._usage -= previous[1].sizeInBytes()
+            self._composites[group] = (key, image)
+            self._usage += image.sizeInBytes()
+            while self._usage > self._budget and len(self._composites) > 1:
+                _, (_, evicted) = self._composites.popitem(last=False)
+                self._usage -= evicted.sizeInBytes()
+
+
+_groupComposites = GroupCompositeCache(GROUP_COMPOSITES_BUDGET)
+
+
+class GroupLayer(Layer):
+    """Layer holding child layers (back to front). Children keep their canvas space locations, the group's location
+    and size are those of its children's bounding rectangle, so moving the group moves its children.
+
+    Children are flattened in isolation (over transparency) into a composite cached at the mipmap level last drawn,
+    so an unchanged group is drawn with a single image however many children it has, and the group's opacity and
+    blend mode apply to the flattened children. The composite is rebuilt once the group's pixels version changes,
+    which ProjectModel bumps whenever a descendant changes."""
+
+    def __init__(self, children: Iterable[Layer] = ()):
+        self.children: list[Layer] = []
+        super().__init__()
+        self.isExpanded = True
+        self.children = list(children)
+        for child in self.children:
+            child.parentGroup = self
+
+        # Tiles may be composited on several worker threads at once, the first one builds the composite
+        self._compositeLock = threading.Lock()
+
+    @property
+    def location(self):
+        return self.boundingRect().topLeft()
+
+    @location.setter
+    def location(self, location: QPoint):
+        delta = location - self.location
+        for child in self.children:
+            child.location += delta
+
+    def size(self):
+        return self.boundingRect().size()
+
+    def boundingRect(self):
+        rect = QRect()
+        for child in self.children:
+            rect = rect.united(child.boundingRect())
+        return rect
+
+    def duplicate(self):
+        group = GroupLayer(child.duplicate() for child in self.children)
+        group.isExpanded = self.isExpanded
+        return self._copyPropertiesTo(group)
+
+    def hitTest(self, point: QPoint):
+        return any(not child.isHidden and child.hitTest(point) for child in self.children)
+
+    def iterDescendants(self):
+        """Iterate children and their descendants, depth first and back to front"""
+        for child in self.children:
+            yield child
+            if isinstance(child, GroupLayer):
+                yield from child.iterDescendants()
+
+    def compositeRect(self, level: int) -> QRect:
+        """Canvas space rectangle the composite at a mipmap level covers,
+        the bounding rectangle grown to the pixels of that level (so composite pixels match tile pixels)"""
+        scale = 1 << level
+        bounds = self.boundingRect()
+        left, top = bounds.left() // scale * scale, bounds.top() // scale * scale
+        right, bottom = -(-(bounds.right() + 1) // scale) * scale, -(-(bounds.bottom() + 1) // scale) * scale
+        return QRect(left, top, right - left, bottom - top)
+
+    def composite(self, level: int) -> Optional[QImage]:
+        """Children composited at a mipmap level over compositeRect(level),
+        None if that is larger than GROUP_COMPOSITE_MAX_PIXELS"""
+        rect = self.compositeRect(level)
+        scale = 1 << level
+        size = rect.size() / scale
+        if size.isEmpty() or size.width() * size.height() > GROUP_COMPOSITE_MAX_PIXELS:
+            return None
+        # Moving the group by whole pixels of the level keeps the composite valid
+        offset = self.location - rect.topLeft()
+        key = (self.pixelsVersion, level, offset.x(), offset.y())
+        with self._compositeLock:
+            composite = _groupComposites.get(self, key)
+            if composite is None:
+                composite = QImage(size, QImage.Format.Format_ARGB32_Premultiplied)
+                composite.fill(Qt.GlobalColor.transparent)
+                painter = QPainter()
+                painter.begin(composite)
+                try:
+                    painter.setRenderHint(QPainter.RenderHint.Antialiasing, True)
+                    painter.scale(1 / scale, 1 / scale)
+                    painter.translate(-rect.topLeft())
+                    drawLayers(painter, self.children, level)
+                finally:
+                    painter.end()
+                _groupComposites.put(self, key, composite)
+            return composite
+
+    def draw(self, painter: QPainter):
+        self.drawLevel(painter, 0)
+
+    def drawLevel(self, painter: QPainter, level: int):
+        bounds = self.boundingRect()
+        composite = self.composite(level)
+        if composite is not None:
+            painter.drawImage(QRectF(self.compositeRect(level).translated(-bounds.topLeft())), composite)
+            return
+
+        # Too large to cache, children are composited over the device pixels of painter they cover, in isolation like
+        # the cached composite, and in bands so memory stays bounded when drawing into a large image
+        transform = painter.worldTransform()
+        device = painter.device()
+        deviceRect = transform.mapRect(QRectF(0, 0, bounds.width(), bounds.height())).toAlignedRect()
+        deviceRect = deviceRect.intersected(QRect(0, 0, device.width(), device.height()))
+        if deviceRect.isEmpty():
+            return
+        bandHeight = max(1, GROUP_COMPOSITE_MAX_PIXELS // deviceRect.width())
+        painter.save()
+        painter.resetTransform()
+        for top in range(deviceRect.top(), deviceRect.bottom() + 1, bandHeight):
+            band = QRect(deviceRect.left(), top, deviceRect.width(), min(bandHeight, deviceRect.bottom() + 1 - top))
+            image = QImage(band.size(), QImage.Format.Format_ARGB32_Premultiplied)
+            image.fill(Qt.GlobalColor.transparent)
+            bandPainter = QPainter()
+            bandPainter.begin(image)
+            try:
+                bandPainter.setRenderHint(QPainter.RenderHint.Antialiasing, True)
+                bandPainter.setWorldTransform(transform * QTransform.fromTranslate(-band.x(), -band.y()))
+                bandPainter.translate(-bounds.topLeft())
+                drawLayers(bandPainter, self.children, level)
+            finally:
+                bandPainter.end()
+            painter.drawImage(band.topLeft(), image)
+        painter.restore()
+
+    def createThumbnail(self, size: QSize) -> QImage:
+        # Children are drawn at the level of the thumbnail's scale rather than through the composite
+        bounds = self.boundingRect()
+        scaledSize = bounds.size().scaled(size, Qt.AspectRatioMode.KeepAspectRatio)
+        thumbnail = QImage(scaledSize, QImage.Format.Format_ARGB32_Premultiplied)
+        thumbnail.fill(Qt.GlobalColor.transparent)
+        if scaledSize.isEmpty():
+            return thumbnail
+
+        scale = scaledSize.width() / bounds.width()
+        level = 0
+        while scale * (2 << level) <= 1:
+            level += 1
+        painter = QPainter()
+        painter.begin(thumbnail)
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform, True)
+        painter.scale(scale, scale)
+        painter.translate(-bounds.topLeft())
+        drawLayers(painter, self.children, level)
+        painter.end()
+        return thumbnail
+
 
 class ImageLayer(Layer):
     def __init__(self, image: QImage):
         super().__init__()
-        self.image = image
+        # Converted once here instead of by QPainter every time the layer is drawn
+        self.image = normalizeImage(image)
+        # Mipmap pyramid, each level is half the size of the previous one, level 0 is the image itself,
+        # levels are built lazily and rebuilt when image changes (tracked via its cache key)
+        self._mipmaps: list[QImage] = []
+        self._mipmapsKey = None
+        # Tiles may be composited on several worker threads at once
+        self._mipmapsLock = threading.Lock()
 
     def draw(self, painter: QPainter):
-        painter.drawImage(self.image.rect(), self.image)
+        image = self.image
+        hotPathConversions.check(image)
+        painter.drawImage(image.rect(), image)
+
+    def drawLevel(self, painter: QPainter, level: int):
+        mipmap = self.mipmap(level)
+        hotPathConversions.check(mipmap)
+        # Target rect is in layer space, painter's scale maps it back to roughly the mipmap's size
+        painter.drawImage(QRectF(self.image.rect()), mipmap)
+
+    def mipmap(self, level: int) -> QImage:
+        """Get image scaled down by 2^level (clamped to the smallest level)"""
+        with self._mipmapsLock:
+            image = self.image
+            if self._mipmapsKey != image.cacheKey():
+                self._mipmaps = [image]
+                self._mipmapsKey = image.cacheKey()
+
+            while len(self._mipmaps) <= level:
+                previous = self._mipmaps[-1]
+                if previous.width() == 1 and previous.height() == 1:
+                    return previous
+                self._mipmaps.append(previous.scaled(
+                    max(1, previous.width() // 2),
+                    max(1, previous.height() // 2),
+                    Qt.AspectRatioMode.IgnoreAspectRatio,
+                    Qt.TransformationMode.SmoothTransformation,
+                ))
+
+            return self._mipmaps[level]
 
     def size(self):
         return self.image.size()
+
+    def duplicate(self):
+        # QImage copies share pixels, the first edit of either image copies them
+        return self._copyPropertiesTo(ImageLayer(QImage(self.image)))
+
+    def isImageLoaded(self):
+        """Whether image is in memory, subclasses may load it on first access"""
+        return True
+
+    def isOpaque(self):
+        # Images without an alpha channel are kept in an opaque format (see normalizeImage)
+        return self.isImageLoaded() and not self.image.hasAlphaChannel()
+
+    def hitTest(self, point: QPoint):
+        return hitTestImage(self.image, point - self.location, self.size())
+
+    def createThumbnail(self, size: QSize) -> QImage:
+        if size.isEmpty():
+            return QImage()
+
+        # Start from the smallest mipmap that is still larger than the thumbnail
+        level = 0
+        nextSize = self.image.size() / 2
+        while nextSize.width() >= size.width() and nextSize.height() >= size.height():
+            level += 1
+            nextSize /= 2
+        return self.mipmap(level).scaled(size, Qt.AspectRatioMode.KeepAspectRatio,
+                                         Qt.TransformationMode.SmoothTransformation)
+
+
+class ProxyImageLayer(ImageLayer):
+    """Image layer imported with a proxy, the image decoded at a lower resolution (see QImageReader.setScaledSize),
+    the proxy is drawn when zoomed out enough for it, the full resolution image is decoded from the file
+    on first access of image (e.g. when zooming in, exporting or editing pixels)"""
+
+    def __init__(self, fileName: str, proxy: QImage, fullSize: QSize):
+        self._proxy: Optional[QImage] = None
+        self._imageLock = threading.Lock()
+        super().__init__(QImage())
+        self.fileName = fileName
+        self._proxy = normalizeImage(proxy)
+        self._fullSize = QSize(fullSize)
+        # Smallest mipmap level that the proxy has enough pixels for
+        self.proxyLevel = 0
+        while (fullSize.width() >> self.proxyLevel) > proxy.width() or \
+                (fullSize.height() >> self.proxyLevel) > proxy.height():
+            self.proxyLevel += 1
+
+    @property
+    def image(self) -> QImage:
+        with self._imageLock:
+            if self._proxy is not None:
+                self._image = self._decodeFullResolution(self._proxy)
+                self._proxy = None
+            return self._image
+
+    @image.setter
+    def image(self, image: QImage):
+        with self._imageLock:
+            self._image = image
+            self._proxy = None
+
+    def _decodeFullResolution(self, proxy: QImage):
+        image = QImageReader(self.fileName).read()
+        if image.isNull() or image.size() != self._fullSize:
+            # File was moved or changed since it was imported, the proxy is all that is left
+            return proxy.scaled(self._fullSize, Qt.AspectRatioMode.IgnoreAspectRatio,
+                                Qt.TransformationMode.SmoothTransformation)
+        # Duplicated proxy layers decode the same file
+        return pixelStore.intern(normalizeImage(image))
+
+    def isImageLoaded(self):
+        return self._proxy is None
+
+    def hitTest(self, point: QPoint):
+        proxy = self._proxy
+        if proxy is None:
+            return super().hitTest(point)
+        return hitTestImage(proxy, point - self.location, self._fullSize)
+
+    def isOpaque(self):
+        proxy = self._proxy
+        return not (self._image if proxy is None else proxy).hasAlphaChannel()
+
+    def duplicate(self):
+        proxy = self._proxy
+        if proxy is None:
+            return super().duplicate()
+        return self._copyPropertiesTo(ProxyImageLayer(self.fileName, QImage(proxy), self._fullSize))
+
+    def size(self):
+        return self._image.size() if self._proxy is None else QSize(self._fullSize)
+
+    def drawLevel(self, painter: QPainter, level: int):
+        proxy = self._proxy
+        if proxy is not None and level >= self.proxyLevel:
+            hotPathConversions.check(proxy)
+            painter.drawImage(QRectF(QRect(QPoint(0, 0), self._fullSize)), proxy)
+        else:
+            super().drawLevel(painter, level)
+
+    def createThumbnail(self, size: QSize) -> QImage:
+        proxy = self._proxy
+        if proxy is None:
+            return super().createThumbnail(size)
+        if size.isEmpty():
+            return QImage()
+        return proxy.scaled(size, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
@@ -1,7 +1,8 @@
 from PyQt6.QtCore import QSize, Qt
+from PyQt6.QtGui import QIcon, QPainter, QPaintEvent
 from PyQt6.QtWidgets import QHBoxLayout, QLabel, QVBoxLayout, QWidget
 
-from awesome_image_editor.icons import getIcon
+from awesome_image_editor.icons import getIcon, getIconPixmap
 from awesome_image_editor.project_model import ProjectModel
 from awesome_image_editor.toolbar import ToolBar
 from awesome_image_editor.tree_view import TreeView
@@ -15,23 +16,47 @@ class LayerOperationsToolBar(ToolBar):
         ICON_DELETE = getIcon("layers/delete_btn.svg")
         ICON_LOWER = getIcon("layers/lower_layer_onestep.svg")
         ICON_RAISE = getIcon("layers/raise_layer_onestep.svg")
+        ICON_GROUP = getIcon("layers/create_group_btn.svg")
+        ICON_DUPLICATE = getIcon("layers/duplicate_layer_btn.svg")
 
         self.setLayoutDirection(Qt.LayoutDirection.RightToLeft)
         self.addAction(ICON_LOWER, "Lower", self.onIconLowerPress)
         self.addAction(ICON_RAISE, "Raise", self.onIconRaisePress)
         self.addAction(ICON_DELETE, "Delete", self.onIconDeletePress)
+        self.addAction(ICON_GROUP, "Group", self.onIconGroupPress)
+        self.addAction(ICON_DUPLICATE, "Duplicate", self.onIconDuplicatePress)
 
     def onIconDeletePress(self):
         self._project.deleteSelected()
-        self._project.layersDeleted.emit()
 
     def onIconRaisePress(self):
         self._project.raiseSelectedLayers()
-        self._project.layersOrderChanged.emit()
 
     def onIconLowerPress(self):
         self._project.lowerSelectedLayers()
-        self._project.layersOrderChanged.emit()
+
+    def onIconGroupPress(self):
+        self._project.groupSelectedLayers()
+
+    def onIconDuplicatePress(self):
+        self._project.duplicateSelectedLayers()
+
+
+class IconWidget(QWidget):
+    """Shows an icon, rasterized when painted so it stays sharp when moved to a screen with another device pixel
+    ratio"""
+
+    def __init__(self, parent: QWidget, icon: QIcon, iconSize: QSize):
+        super().__init__(parent)
+        self._icon = icon
+        self._iconSize = iconSize
+        self.setFixedSize(iconSize)
+
+    def paintEvent(self, event: QPaintEvent) -> None:
+        painter = QPainter()
+        painter.begin(self)
+        painter.drawPixmap(0, 0, getIconPixmap(self._icon, self._iconSize, self.devicePixelRatioF()))
+        painter.end()
 
 
 class LayersWidget(QWidget):
@@ -43,9 +68,7 @@ class LayersWidget(QWidget):
 
         titleLayout = QHBoxLayout()
         titleLayout.setAlignment(Qt.AlignmentFlag.AlignLeft)
-        titleIconLabel = QLabel(self)
-        titleIconLabel.setPixmap(getIcon("layers/layers_dialog.svg").pixmap(QSize(24, 24)))
-        titleLayout.addWidget(titleIconLabel)
+        titleLayout.addWidget(IconWidget(self, getIcon("layers/layers_dialog.svg"), QSize(24, 24)))
         titleLabel = QLabel("Layers", self)
         titleLayout.addWidget(titleLabel)
 
@@ -1,11 +1,21 @@
+import importlib.util
+from typing import TYPE_CHECKING, Optional
+
 from PyQt6.QtCore import QSize
-from PyQt6.QtWidgets import QMainWindow, QSplitter, QWidget, QHBoxLayout
+from PyQt6.QtGui import QKeySequence
+from PyQt6.QtWidgets import QFileDialog, QMainWindow, QMessageBox, QSplitter, QWidget, QHBoxLayout
 
 from awesome_image_editor.canvas_tools.canvas_toolbar import CanvasToolBar
 from awesome_image_editor.canvas_view import CanvasView
+from awesome_image_editor.layers import ImageLayer
 from awesome_image_editor.layers_widget import LayersWidget
-from awesome_image_editor.menubar.file.import_images import importImages
 from awesome_image_editor.project_model import ProjectModel
+from awesome_image_editor.tiled_canvas import compositeTile
+from awesome_image_editor.tracing import recorder
+
+# Modules only needed by menu actions are imported when the actions are first used, to speed up startup
+if TYPE_CHECKING:
+    from awesome_image_editor.project_file import ProjectFile
 
 
 class MainWindow(QMainWindow):
@@ -13,6 +23,8 @@ class MainWindow(QMainWindow):
         super().__init__()
 
         self.project = ProjectModel(self, QSize(1920, 1080))
+        # File the project was opened from or last saved to
+        self.projectFile: Optional["ProjectFile"] = None
 
         centralWidget = QWidget(self)
         centralWidgetLayout = QHBoxLayout()
@@ -31,6 +43,7 @@ class MainWindow(QMainWindow):
         centralWidgetLayout.addWidget(splitter)
 
         canvasWidget = CanvasView(self, self.project, canvasToolBar)
+        self.canvasView = canvasWidget
         layersWidget = LayersWidget(self, self.project)
 
         splitter.addWidget(canvasWidget)
@@ -41,4 +54,103 @@ class MainWindow(QMainWindow):
 
     def createMenus(self):
         fileMenu = self.menuBar().addMenu("&File")
-        fileMenu.addAction("Import Image/s", lambda: importImages(self, self.project))
+        fileMenu.addAction("Open Project...", QKeySequence.StandardKey.Open, self.openProject)
+        fileMenu.addAction("Save Project", QKeySequence.StandardKey.Save, self.saveProject)
+        fileMenu.addAction("Save Project As...", QKeySequence.StandardKey.SaveAs, lambda: self.saveProject(True))
+        fileMenu.addSeparator()
+        fileMenu.addAction("Import Image/s", self.importImages)
+        fileMenu.addAction("Import Image/s as Proxies", lambda: self.importImages(True))
+
+        editMenu = self.menuBar().addMenu("&Edit")
+        self.undoAction = editMenu.addAction("Undo", QKeySequence.StandardKey.Undo, self.project.history.undo)
+        self.redoAction = editMenu.addAction("Redo", QKeySequence.StandardKey.Redo, self.project.history.redo)
+        self.project.history.changed.connect(self.updateUndoActions)
+        editMenu.addSeparator()
+        # Crop only hides the canvas outside the crop rectangle, so it can be removed at any time
+        editMenu.addAction("Remove Crop", lambda: self.project.setCropRect(None))
+        editMenu.addSeparator()
+        editMenu.addAction("Duplicate Layers", QKeySequence("Ctrl+J"), self.project.duplicateSelectedLayers)
+        editMenu.addAction("Group Layers", QKeySequence("Ctrl+G"), self.project.groupSelectedLayers)
+        editMenu.addAction("Ungroup Layers", QKeySequence("Ctrl+Shift+G"), self.project.ungroupSelectedLayers)
+        self.updateUndoActions()
+
+        viewMenu = self.menuBar().addMenu("&View")
+        viewportRenderingAction = viewMenu.addAction("Render Visible Area Only", self.canvasView.setViewportRendering)
+        viewportRenderingAction.setCheckable(True)
+        viewportRenderingAction.setChecked(self.canvasView.isViewportRendering())
+
+        # NumPy is optional, the compositor is only offered when it is installed
+        numpyCompositorAction = viewMenu.addAction("NumPy Compositor", self.setNumpyCompositorEnabled)
+        numpyCompositorAction.setCheckable(True)
+        numpyCompositorAction.setEnabled(importlib.util.find_spec("numpy") is not None)
+
+        viewMenu.addSeparator()
+        frameStatsAction = viewMenu.addAction("Show Frame Stats", self.canvasView.setFrameStatsVisible)
+        frameStatsAction.setCheckable(True)
+        frameStatsAction.setShortcut("F3")
+        self.traceAction = viewMenu.addAction("Record Trace", self.setTraceRecording)
+        self.traceAction.setCheckable(True)
+        viewMenu.addAction("Memory Usage...", self.showMemoryUsage)
+
+    def importImages(self, useProxies: bool = False):
+        from awesome_image_editor.menubar.file.import_images import importImages
+
+        importImages(self, self.project, useProxies)
+
+    def openProject(self):
+        from awesome_image_editor.menubar.file.open_project import openProject
+
+        projectFile = openProject(self, self.project)
+        if projectFile is not None:
+            self.projectFile = projectFile
+
+    def saveProject(self, saveAs: bool = False):
+        from awesome_image_editor.menubar.file.save_project import saveProject
+
+        projectFile = saveProject(self, self.project, self.projectFile, saveAs)
+        if projectFile is not None:
+            self.projectFile = projectFile
+
+    def updateUndoActions(self):
+        history = self.project.history
+        self.undoAction.setEnabled(history.canUndo())
+        self.undoAction.setText(f"Undo {history.undoTitle()}".strip())
+        self.redoAction.setEnabled(history.canRedo())
+        self.redoAction.setText(f"Redo {history.redoTitle()}".strip())
+
+    def setTraceRecording(self, isRecording: bool):
+        if isRecording:
+            recorder.start()
+            return
+
+        recorder.stop()
+        fileName, selectedFilter = QFileDialog.getSaveFileName(
+            self, "Save Trace", "trace.json", "Chrome Trace Files (*.json)"
+        )
+        if fileName == "":
+            return
+        try:
+            recorder.save(fileName)
+        except OSError as e:
+            QMessageBox.warning(self, "Failed to save trace", f"Could not save {fileName}:\n{e}")
+
+    def showMemoryUsage(self):
+        from awesome_image_editor.pixel_store import pixelMemoryReport
+
+        # Images that aren't loaded yet (proxies, layers stored in a project file) aren't counted
+        images = [
+            layer.image
+            for layer, depth in self.project.iterLayerTreeFrontToBack()
+            if isinstance(layer, ImageLayer) and layer.isImageLoaded()
+        ]
+        lines = pixelMemoryReport(images).lines()
+        lines.append(f"Undo history: {self.project.history.memoryUsage() / (1024 * 1024):.1f} MB")
+        QMessageBox.information(self, "Memory Usage", "\n".join(lines))
+
+    def setNumpyCompositorEnabled(self, isEnabled: bool):
+        if isEnabled:
+            from awesome_image_editor.numpy_compositor import compositeTile as numpyCompositeTile
+
+            self.canvasView.setCompositor(numpyCompositeTile)
+        else:
+            self.canvasView.setCompositor(compositeTile)
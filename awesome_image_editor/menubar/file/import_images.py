@@ -1,15 +1,172 @@
 import os
+from collections import deque
+from concurrent.futures import Future
 from pathlib import Path
+from typing import Optional
 
-from PyQt6.QtCore import QStandardPaths, Qt, QTimer
-from PyQt6.QtGui import QImage
+from PyQt6.QtCore import QObject, QSize, QStandardPaths, Qt, pyqtSignal
+from PyQt6.QtGui import QImage, QImageReader
 from PyQt6.QtWidgets import QFileDialog, QMessageBox, QProgressDialog, QWidget
 
-from awesome_image_editor.layers import ImageLayer
+from awesome_image_editor.layers import ImageLayer, ProxyImageLayer
+from awesome_image_editor.pixel_formats import normalizeImage
+from awesome_image_editor.pixel_store import pixelStore
 from awesome_image_editor.project_model import ProjectModel
+from awesome_image_editor.tracing import TraceSpan, traced
+from awesome_image_editor.workers import getThreadPool, workerCount
 
+# Decoded images waiting to be added are kept in memory,
+# so limit how many images are decoded or waiting at the same time
+MAX_IN_FLIGHT_DECODES_PER_WORKER = 2
 
-def importImages(parent: QWidget, project: ProjectModel):
+
+def decodeImage(fileName: str):
+    # Runs on a worker thread, QImage (unlike QPixmap) is safe to use outside the GUI thread
+    with TraceSpan("decodeImage", "import"):
+        image = QImage(fileName)
+    with TraceSpan("normalizeImage", "import"):
+        # Converting here keeps the conversion off the GUI thread (see ImageLayer)
+        image = normalizeImage(image)
+    # The same asset imported again shares the pixels decoded before
+    with TraceSpan("internImage", "import"):
+        return pixelStore.intern(image)
+
+
+def decodeProxyImage(fileName: str, maxSize: QSize) -> tuple[QImage, QSize]:
+    """Decode image scaled down to fit maxSize (images that fit are decoded as they are),
+    returns the decoded image and the image's full size, runs on a worker thread"""
+    with TraceSpan("decodeProxyImage", "import"):
+        reader = QImageReader(fileName)
+        # Only the header is read here, decoders like JPEG's decode straight to the scaled size
+        fullSize = reader.size()
+        if fullSize.isValid() and (fullSize.width() > maxSize.width() or fullSize.height() > maxSize.height()):
+            reader.setScaledSize(fullSize.scaled(maxSize, Qt.AspectRatioMode.KeepAspectRatio))
+        image = reader.read()
+    with TraceSpan("normalizeImage", "import"):
+        image = normalizeImage(image)
+    with TraceSpan("internImage", "import"):
+        image = pixelStore.intern(image)
+    return image, fullSize if fullSize.isValid() else image.size()
+
+
+class ImageImporter(QObject):
+    """Decodes images on the shared thread pool and adds them to the project in file order as they finish,
+    when proxySize is set images larger than it are added as proxy layers (see ProxyImageLayer)"""
+
+    # Emitted from worker threads with the finished future, delivered to the GUI thread as a queued connection
+    decodeFinished = pyqtSignal(Future)
+
+    def __init__(self, parent: QWidget, project: ProjectModel, fileNames: list[str],
+                 proxySize: Optional[QSize] = None):
+        super().__init__(parent)
+        self._parent = parent
+        self._project = project
+        self._proxySize = proxySize
+        self._fileNamesIter = iter(fileNames)
+        # Decodes in file order, a decode stays here after it finishes until all decodes before it finished
+        self._pending: deque[tuple[str, Future]] = deque()
+        # Futures whose completion was not delivered to the GUI thread yet,
+        # we must not be deleted while any of them can still emit decodeFinished
+        self._undelivered: set[Future] = set()
+        self._maxInFlight = workerCount() * MAX_IN_FLIGHT_DECODES_PER_WORKER
+        self._progress = 0
+        self._failedFileNames = []
+        self._isCanceled = False
+        self._isFinished = False
+
+        self._progressDialog = QProgressDialog("Loading images...", "Cancel", 0, len(fileNames), parent)
+        # Disable window exit button https://forum.qt.io/post/423015
+        self._progressDialog.setWindowFlags(
+            Qt.WindowType.Window | Qt.WindowType.WindowTitleHint | Qt.WindowType.CustomizeWindowHint
+        )
+        self._progressDialog.canceled.connect(self.cancel)
+
+        self.decodeFinished.connect(self._onDecodeFinished)
+
+    def start(self):
+        self._progressDialog.show()
+        self._progressDialog.setWindowModality(Qt.WindowModality.NonModal)
+        self._submitDecodes()
+        self._finishIfDone()
+
+    def _submitDecodes(self):
+        pool = getThreadPool()
+        while len(self._pending) < self._maxInFlight:
+            fileName = next(self._fileNamesIter, None)
+            if fileName is None:
+                return
+            if self._proxySize is None:
+                future = pool.submit(decodeImage, fileName)
+            else:
+                future = pool.submit(decodeProxyImage, fileName, self._proxySize)
+            self._pending.append((fileName, future))
+            self._undelivered.add(future)
+            future.add_done_callback(self.decodeFinished.emit)
+
+    @traced("ImageImporter._onDecodeFinished")
+    def _onDecodeFinished(self, future: Future):
+        self._undelivered.discard(future)
+        if self._isCanceled:
+            self._finishIfDone()
+            return
+
+        # Only take images from the head of the queue, so layers are added in file order
+        importedLayers = []
+        while len(self._pending) > 0 and self._pending[0][1] not in self._undelivered:
+            fileName, future = self._pending.popleft()
+            self._progress += 1
+            if self._proxySize is None:
+                image, fullSize = future.result(), None
+            else:
+                image, fullSize = future.result()
+            if image.isNull():
+                self._failedFileNames.append(fileName)
+                continue  # Skip the image that failed to load
+
+            if fullSize is None or fullSize == image.size():
+                layer = ImageLayer(image)
+            else:
+                layer = ProxyImageLayer(fileName, image, fullSize)
+            layer.name = Path(fileName).stem
+            importedLayers.append(layer)
+
+        if len(importedLayers) > 0:
+            self._project.addLayersToFront(importedLayers)
+            self._progressDialog.setLabelText(f"Loaded image: {importedLayers[-1].name}")
+        self._progressDialog.setValue(self._progress)
+
+        self._submitDecodes()
+        self._finishIfDone()
+
+    def cancel(self):
+        if self._isCanceled or self._isFinished:
+            return
+        # Images already added to the project are kept, queued decodes are dropped
+        self._isCanceled = True
+        pending = self._pending
+        self._pending = deque()
+        for _, future in pending:
+            future.cancel()
+        self._finishIfDone()
+
+    def _finishIfDone(self):
+        if self._isFinished or len(self._pending) > 0 or len(self._undelivered) > 0:
+            return
+        self._isFinished = True
+        self._progressDialog.reset()
+        self._progressDialog.close()
+        if len(self._failedFileNames) > 0:
+            QMessageBox.warning(
+                self._parent,
+                "Failed to load images",
+                "Some images failed to load:\n" + "\n".join(self._failedFileNames),
+            )
+        self.deleteLater()
+
+
+def importImages(parent: QWidget, project: ProjectModel, useProxies: bool = False):
+    """Ask for images and import them, with useProxies images larger than the canvas are decoded
+    near canvas resolution and only decoded at full resolution when it is needed"""
     pictureLocations = QStandardPaths.standardLocations(QStandardPaths.StandardLocation.PicturesLocation)
     if len(pictureLocations) == 0:
         directory = os.path.expanduser("~")
@@ -22,54 +179,6 @@ def importImages(parent: QWidget, project: ProjectModel):
     if len(fileNames) == 0:
         return
 
-    # Import images in a non-blocking fashion using a timer and a progress bar dialog
-    failedFileNames = []
-    importedLayers = []
-    timer = QTimer(parent)
-    progress = 0
-    fileNamesIter = iter(fileNames)
-    progressDialog = QProgressDialog("Loading images...", None, 0, len(fileNames), parent)
-
-    # Disable window exit button https://forum.qt.io/post/423015
-    progressDialog.setWindowFlags(
-        Qt.WindowType.Window | Qt.WindowType.WindowTitleHint | Qt.WindowType.CustomizeWindowHint
-    )
-
-    progressDialog.show()
-    progressDialog.setWindowModality(Qt.WindowModality.NonModal)
-
-    def finish():
-        timer.stop()
-        progressDialog.setValue(len(fileNames))
-        project.addLayersToFront(importedLayers)
-        project.layersAdded.emit()
-        if len(failedFileNames) > 0:
-            QMessageBox.warning(
-                parent,
-                "Failed to load images",
-                "Some images failed to load:\n" + "\n".join(failedFileNames),
-            )
-
-    def importSingleImage():
-        nonlocal progress
-        progressDialog.setValue(progress)
-        progress += 1
-        fileName = next(fileNamesIter, None)
-        if fileName is None:
-            # No more images to load
-            finish()
-            return
-
-        progressDialog.setLabelText(f"Loading image: {fileName}")
-        image = QImage(fileName)
-        if image.isNull():
-            failedFileNames.append(fileName)
-            return  # Skip the image that failed to load
-
-        layer = ImageLayer(image)
-        layer.name = Path(fileName).stem
-        importedLayers.append(layer)
-
-    # progressDialog.canceled.connect(finish)  # In case we want to make it cancellable later
-    timer.timeout.connect(importSingleImage)
-    timer.start(0)
+    # Import images in a non-blocking fashion, decoding happens on worker threads
+    proxySize = QSize(project.canvasSize) if useProxies else None
+    ImageImporter(parent, project, fileNames, proxySize).start()
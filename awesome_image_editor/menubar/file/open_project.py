@@ -0,0 +1,37 @@
+import os
+from typing import Optional
+
+from PyQt6.QtCore import QStandardPaths
+from PyQt6.QtWidgets import QFileDialog, QMessageBox, QWidget
+
+from awesome_image_editor.project_file import FILE_EXTENSION, ProjectFile, ProjectFileError
+from awesome_image_editor.project_model import ProjectModel
+
+PROJECT_FILE_FILTER = f"Awesome Image Editor Projects (*{FILE_EXTENSION})"
+
+
+def projectsDirectory():
+    documentLocations = QStandardPaths.standardLocations(QStandardPaths.StandardLocation.DocumentsLocation)
+    if len(documentLocations) == 0:
+        return os.path.expanduser("~")
+    return documentLocations[0]
+
+
+def openProject(parent: QWidget, project: ProjectModel) -> Optional[ProjectFile]:
+    """Ask for a project file and load it into project, returns the opened file (None if nothing was opened)"""
+    fileName, selectedFilter = QFileDialog.getOpenFileName(
+        parent, "Open Project", projectsDirectory(), PROJECT_FILE_FILTER
+    )
+    if fileName == "":
+        return None
+
+    projectFile = ProjectFile(fileName)
+    try:
+        # Only the index is read here, pixels are read when they are drawn
+        canvasSize, layers, cropRect = projectFile.load()
+    except (OSError, ProjectFileError, KeyError, TypeError, ValueError) as e:
+        QMessageBox.warning(parent, "Failed to open project", f"Could not open {fileName}:\n{e}")
+        return None
+
+    project.reset(canvasSize, layers, cropRect)
+    return projectFile
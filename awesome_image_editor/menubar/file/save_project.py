@@ -0,0 +1,50 @@
+import os
+from typing import Optional
+
+from PyQt6.QtCore import Qt
+from PyQt6.QtWidgets import QApplication, QFileDialog, QMessageBox, QWidget
+
+from awesome_image_editor.menubar.file.open_project import PROJECT_FILE_FILTER, projectsDirectory
+from awesome_image_editor.project_file import FILE_EXTENSION, ProjectFile, ProjectFileError
+from awesome_image_editor.project_model import ProjectModel
+
+
+def isSameFile(first: str, second: str):
+    try:
+        return os.path.samefile(first, second)
+    except OSError:
+        return False
+
+
+def saveProject(parent: QWidget, project: ProjectModel, projectFile: Optional[ProjectFile],
+                saveAs: bool = False) -> Optional[ProjectFile]:
+    """Save project to projectFile (asking for a file name if there is none or saveAs is set),
+    returns the file the project was saved to (None if it wasn't saved)"""
+    previousFile = projectFile
+    if projectFile is None or saveAs:
+        fileName, selectedFilter = QFileDialog.getSaveFileName(
+            parent, "Save Project", projectsDirectory(), PROJECT_FILE_FILTER
+        )
+        if fileName == "":
+            return None
+        if not fileName.endswith(FILE_EXTENSION):
+            fileName += FILE_EXTENSION
+        if previousFile is None or not isSameFile(fileName, previousFile.path):
+            # Saving to a different file writes it from scratch,
+            # pixels that are already compressed in the previous file are copied over as they are
+            projectFile = ProjectFile(fileName)
+
+    QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+    try:
+        projectFile.save(
+            project.canvasSize,
+            list(project.iterLayersBackToFront()),
+            previousFile,
+            cropRect=project.cropRect() if project.isCropped() else None,
+        )
+    except (OSError, ProjectFileError) as e:
+        QMessageBox.warning(parent, "Failed to save project", f"Could not save {projectFile.path}:\n{e}")
+        return None
+    finally:
+        QApplication.restoreOverrideCursor()
+    return projectFile
@@ -0,0 +1,45 @@
+"""Pixel formats of layer images, images are converted once when a layer is created so compositing blits them
+into tiles (ARGB32 premultiplied) without converting pixels on every draw"""
+
+import threading
+from collections import Counter
+
+from PyQt6.QtGui import QImage
+
+# Tiles are composited in this format
+COMPOSITE_FORMAT = QImage.Format.Format_ARGB32_Premultiplied
+# Images without an alpha channel, blitting them is a copy (alpha of RGB32 is always 0xFF)
+OPAQUE_FORMAT = QImage.Format.Format_RGB32
+NATIVE_FORMATS = (COMPOSITE_FORMAT, OPAQUE_FORMAT)
+
+
+def normalizeImage(image: QImage) -> QImage:
+    """Convert image to a native format, images without an alpha channel (e.g. JPEGs, grayscale or indexed images
+    without transparent colors) to the opaque format, others to the composite format"""
+    if image.isNull() or image.format() in NATIVE_FORMATS:
+        return image
+    return image.convertToFormat(COMPOSITE_FORMAT if image.hasAlphaChannel() else OPAQUE_FORMAT)
+
+
+class ConversionCounter:
+    """Counts images drawn or blended in a non-native format, each of which QPainter (or the NumPy compositor)
+    converts while compositing, counted from worker threads"""
+
+    def __init__(self):
+        self._counts: Counter[QImage.Format] = Counter()
+        self._lock = threading.Lock()
+
+    def check(self, image: QImage):
+        """Count image if drawing it needs a conversion"""
+        if image.format() not in NATIVE_FORMATS:
+            with self._lock:
+                self._counts[image.format()] += 1
+
+    def take(self) -> Counter[QImage.Format]:
+        """Conversions by source format since the last call"""
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+        return counts
+
+
+hotPathConversions = ConversionCounter()
@@ -0,0 +1,91 @@
+"""Content addressed store of decoded images, so identical pixels (e.g. the same file imported twice) are kept once.
+
+Sharing relies on QImage's implicit sharing: layers get separate QImage objects referring to the same pixels,
+and a QImage copies its pixels (detaches) the first time it is painted into, so editing one layer splits the
+shared buffer and leaves the other layers untouched."""
+
+import threading
+import weakref
+import zlib
+from dataclasses import dataclass
+from typing import Iterable
+
+from PyQt6.QtGui import QImage
+
+# (format, width, height, bytes per line, CRC-32 of the pixels)
+ContentKey = tuple[QImage.Format, int, int, int, int]
+
+
+def contentKey(image: QImage) -> ContentKey:
+    bits = image.constBits()
+    bits.setsize(image.sizeInBytes())
+    # CRC-32 is cheap next to decoding, colliding images are told apart by comparing pixels
+    return image.format(), image.width(), image.height(), image.bytesPerLine(), zlib.crc32(bits)
+
+
+class PixelStore:
+    """Remembers images by content until they are no longer used or their pixels change, safe to use from
+    worker threads (images are interned right after they are decoded)"""
+
+    def __init__(self):
+        # Images are held weakly, with the cache key they had when they were interned
+        self._images: dict[ContentKey, tuple[weakref.ref, int]] = {}
+        # Reentrant, as a weak reference callback may run while the lock is held
+        self._lock = threading.RLock()
+
+    def intern(self, image: QImage) -> QImage:
+        """Get an image sharing pixels with an identical image interned before, or image itself if there is none"""
+        if image.isNull():
+            return image
+        key = contentKey(image)
+        with self._lock:
+            entry = self._images.get(key)
+            if entry is not None:
+                storedImage = entry[0]()
+                # Painting into an image changes its cache key, its pixels may not match the key anymore
+                if storedImage is not None and storedImage.cacheKey() == entry[1] and storedImage == image:
+                    return QImage(storedImage)
+            self._images[key] = (weakref.ref(image, lambda ref: self._discard(key, ref)), image.cacheKey())
+            return image
+
+    def _discard(self, key: ContentKey, ref: weakref.ref):
+        with self._lock:
+            entry = self._images.get(key)
+            if entry is not None and entry[0] is ref:
+                del self._images[key]
+
+
+pixelStore = PixelStore()
+
+
+@dataclass
+class PixelMemoryReport:
+    imageCount: int = 0
+    # Bytes the images would take if none shared pixels
+    totalBytes: int = 0
+    # Bytes actually allocated, shared pixels are counted once
+    storedBytes: int = 0
+
+    def savedBytes(self):
+        return self.totalBytes - self.storedBytes
+
+    def lines(self):
+        megabyte = 1024 * 1024
+        return [
+            f"Images in memory: {self.imageCount}",
+            f"Pixels: {self.storedBytes / megabyte:.1f} MB",
+            f"Saved by sharing pixels: {self.savedBytes() / megabyte:.1f} MB",
+        ]
+
+
+def pixelMemoryReport(images: Iterable[QImage]) -> PixelMemoryReport:
+    """Memory used by pixels of images, QImages sharing pixels have the same cache key"""
+    report = PixelMemoryReport()
+    cacheKeys = set()
+    for image in images:
+        report.imageCount += 1
+        report.totalBytes += image.sizeInBytes()
+        if image.cacheKey() not in cacheKeys:
+            cacheKeys.add(image.cacheKey())
+            report.storedBytes += image.sizeInBytes()
+    return report
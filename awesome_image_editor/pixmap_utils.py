@@ -1,9 +1,9 @@
-from typing import Optional
+from typing import Optional, Union
 
-from PyQt6.QtGui import QPixmap, QBrush, QPainter
+from PyQt6.QtGui import QPixmap, QBrush, QColor, QPainter
 
 
-def getTintedPixmap(pixmap: QPixmap, tint: Optional[QBrush]):
+def getTintedPixmap(pixmap: QPixmap, tint: Optional[Union[QBrush, QColor]]):
     tintedPixmap = pixmap.copy()
     painter = QPainter()
     painter.begin(tintedPixmap)
@@ -0,0 +1,515 @@
+"""Native project file format.
+
+A project file starts with a header, followed by chunks appended one after another, and ends with a footer.
+The footer points at the index chunk of the last save, a JSON document with the canvas size and the layers
+(back to front) with their metadata and the offsets of their pixel chunks.
+
+Groups are stored as records holding their children's records, only image layers have pixel chunks.
+
+A layer's pixels are stored as FILE_TILE_SIZE square tiles (row major), each one compressed independently,
+plus a small preview (a mipmap level of the layer) used for thumbnails and zoomed out views.
+Opening a project memory maps the file and only reads the index, tiles are decompressed when they are drawn.
+
+Saving to the file a project was opened from appends chunks of layers whose pixels changed, then a new index
+and footer, layers whose pixels didn't change keep pointing at their existing chunks. Saving to another file
+writes it next to the destination and moves it into place, so the file being replaced stays readable."""
+
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+from weakref import WeakKeyDictionary
+
+from PyQt6.QtCore import QPoint, QRect, QRectF, QSize, Qt
+from PyQt6.QtGui import QImage, QPainter
+
+from awesome_image_editor.layers import BlendMode, GroupLayer, ImageLayer, Layer, hitTestImage
+from awesome_image_editor.workers import getThreadPool
+
+FILE_EXTENSION = ".aie"
+FILE_VERSION = 1
+
+HEADER = struct.Struct("<8sI")
+HEADER_MAGIC = b"AIEPROJ\x00"
+FOOTER = struct.Struct("<QQ8s")
+FOOTER_MAGIC = b"AIEINDEX"
+
+FILE_TILE_SIZE = 256
+# Favor fast saving over file size
+COMPRESSION_LEVEL = 1
+PIXEL_FORMAT = QImage.Format.Format_ARGB32_Premultiplied
+
+# Previews are the first mipmap level of the layer that fits in this size
+PREVIEW_SIZE = 256
+
+# Memory used by decompressed tiles of all open project files, least recently used tiles are dropped first
+DECODED_TILES_BUDGET = 256 * 1024 * 1024
+
+Chunk = tuple[int, int]
+
+
+class ProjectFileError(Exception):
+    pass
+
+
+def encodeImage(image: QImage) -> bytes:
+    image = image.convertToFormat(PIXEL_FORMAT)
+    # 32-bit scan lines are always 4 byte aligned, so pixels are contiguous
+    return zlib.compress(image.constBits().asstring(image.sizeInBytes()), COMPRESSION_LEVEL)
+
+
+def decodeImage(data: bytes, size: QSize) -> QImage:
+    pixels = zlib.decompress(data)
+    if len(pixels) != size.width() * size.height() * 4:
+        raise ProjectFileError("Corrupted pixel data")
+    # Copy so the image owns its pixels instead of referencing the decompressed bytes
+    return QImage(pixels, size.width(), size.height(), size.width() * 4, PIXEL_FORMAT).copy()
+
+
+def layerImage(layer: Layer) -> QImage:
+    if isinstance(layer, ImageLayer):
+        return layer.image
+    image = QImage(layer.size(), PIXEL_FORMAT)
+    image.fill(Qt.GlobalColor.transparent)
+    painter = QPainter()
+    painter.begin(image)
+    try:
+        layer.draw(painter)
+    finally:
+        painter.end()
+    return image
+
+
+def previewLevel(size: QSize):
+    level = 0
+    while (size.width() >> level) > PREVIEW_SIZE or (size.height() >> level) > PREVIEW_SIZE:
+        level += 1
+    return level
+
+
+class ChunkReader:
+    """Reads chunks of a project file through a memory map, the map grows when the file is appended to"""
+
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        self._map: Optional[mmap.mmap] = None
+        self._lock = threading.Lock()
+
+    def read(self, chunk: Chunk) -> bytes:
+        offset, length = chunk
+        with self._lock:
+            # Checked against the file rather than the map, reading mapped pages past the end of a file that shrank
+            # since it was mapped kills the process (SIGBUS)
+            if offset < 0 or length < 0 or offset + length > self.size():
+                raise ProjectFileError("Chunk is out of file bounds")
+            if self._map is None or offset + length > len(self._map):
+                if self._map is not None:
+                    self._map.close()
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            return self._map[offset:offset + length]
+
+    def size(self):
+        return os.fstat(self._file.fileno()).st_size
+
+
+class TileCache:
+    """Decompressed tiles shared by all stored layers, limited by DECODED_TILES_BUDGET"""
+
+    def __init__(self, budget: int):
+        self._budget = budget
+        self._usage = 0
+        self._tiles: OrderedDict[tuple["StoredLayer", int], QImage] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple["StoredLayer", int]) -> Optional[QImage]:
+        with self._lock:
+            image = self._tiles.get(key)
+            if image is not None:
+                self._tiles.move_to_end(key)
+            return image
+
+    def put(self, key: tuple["StoredLayer", int], image: QImage):
+        with self._lock:
+            if key in self._tiles:
+                return
+            self._tiles[key] = image
+            self._usage += image.sizeInBytes()
+            while self._usage > self._budget and len(self._tiles) > 1:
+                _, evicted = self._tiles.popitem(last=False)
+                self._usage -= evicted.sizeInBytes()
+
+
+_tileCache = TileCache(DECODED_TILES_BUDGET)
+
+
+@dataclass(eq=False)
+class StoredLayer:
+    """Pixels of a layer as stored in a project file"""
+    # None while the file is being saved
+    reader: Optional[ChunkReader]
+    size: QSize
+    tiles: list[Chunk]
+    preview: Chunk
+    previewLevel: int
+
+    def columnCount(self):
+        return -(-self.size.width() // FILE_TILE_SIZE)
+
+    def tileRect(self, index: int):
+        row, column = divmod(index, self.columnCount())
+        rect = QRect(column * FILE_TILE_SIZE, row * FILE_TILE_SIZE, FILE_TILE_SIZE, FILE_TILE_SIZE)
+        return rect.intersected(QRect(QPoint(0, 0), self.size))
+
+    def iterTileIndices(self, rect: QRect):
+        """Iterate indices of tiles intersecting rect (in layer space)"""
+        rect = rect.intersected(QRect(QPoint(0, 0), self.size))
+        if rect.isEmpty():
+            return
+        columnCount = self.columnCount()
+        for row in range(rect.top() // FILE_TILE_SIZE, rect.bottom() // FILE_TILE_SIZE + 1):
+            for column in range(rect.left() // FILE_TILE_SIZE, rect.right() // FILE_TILE_SIZE + 1):
+                yield row * columnCount + column
+
+    def tile(self, index: int) -> QImage:
+        """Decompress a tile (or get it from the cache), may be called from worker threads,
+        a corrupted tile is replaced by the matching part of the preview"""
+        image = _tileCache.get((self, index))
+        if image is None:
+            try:
+                image = decodeImage(self.reader.read(self.tiles[index]), self.tileRect(index).size())
+            except (ProjectFileError, zlib.error):
+                image = self._previewTile(index)
+            _tileCache.put((self, index), image)
+        return image
+
+    def _previewTile(self, index: int) -> QImage:
+        rect = self.tileRect(index)
+        image = QImage(rect.size(), PIXEL_FORMAT)
+        image.fill(Qt.GlobalColor.transparent)
+        scale = 1 << self.previewLevel
+        sourceRect = QRectF(rect.x() / scale, rect.y() / scale, rect.width() / scale, rect.height() / scale)
+        painter = QPainter()
+        painter.begin(image)
+        try:
+            painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform, True)
+            painter.drawImage(QRectF(image.rect()), self.previewImage(), sourceRect)
+        finally:
+            painter.end()
+        return image
+
+    def previewImage(self) -> QImage:
+        """Decompress the preview, a corrupted preview is transparent"""
+        size = QSize(max(1, self.size.width() >> self.previewLevel), max(1, self.size.height() >> self.previewLevel))
+        try:
+            return decodeImage(self.reader.read(self.preview), size)
+        except (ProjectFileError, zlib.error):
+            image = QImage(size, PIXEL_FORMAT)
+            image.fill(Qt.GlobalColor.transparent)
+            return image
+
+    def decodeAll(self) -> QImage:
+        image = QImage(self.size, PIXEL_FORMAT)
+        painter = QPainter()
+        painter.begin(image)
+        try:
+            painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Source)
+            for index in range(len(self.tiles)):
+                painter.drawImage(self.tileRect(index).topLeft(), self.tile(index))
+        finally:
+            painter.end()
+        return image
+
+
+class StoredImageLayer(ImageLayer):
+    """Image layer whose pixels stay in the project file until they are needed,
+    drawing only decompresses the tiles that are drawn, accessing image decompresses the whole image"""
+
+    def __init__(self, stored: StoredLayer):
+        self._stored: Optional[StoredLayer] = None
+        self._imageLock = threading.Lock()
+        super().__init__(QImage())
+        self._stored = stored
+        # Preview doubles as the mipmap level it was made from
+        self._preview: Optional[QImage] = None
+
+    @property
+    def image(self) -> QImage:
+        with self._imageLock:
+            if self._stored is not None:
+                self._image = self._stored.decodeAll()
+                self._stored = None
+                self._preview = None
+            return self._image
+
+    @image.setter
+    def image(self, image: QImage):
+        with self._imageLock:
+            self._image = image
+            self._stored = None
+
+    @property
+    def stored(self):
+        return self._stored
+
+    def rebind(self, stored: StoredLayer):
+        """Read pixels from stored (a copy of the same chunks in another file) if they were not decompressed yet"""
+        with self._imageLock:
+            if self._stored is not None:
+                self._stored = stored
+
+    def isImageLoaded(self):
+        return self._stored is None
+
+    def size(self):
+        stored = self._stored
+        return self._image.size() if stored is None else QSize(stored.size)
+
+    def _storedPreview(self, stored: StoredLayer) -> QImage:
+        with self._imageLock:
+            if self._preview is None:
+                self._preview = stored.previewImage()
+            return self._preview
+
+    def draw(self, painter: QPainter):
+        stored = self._stored
+        if stored is None:
+            super().draw(painter)
+        else:
+            self._drawStored(painter, stored, 0)
+
+    def drawLevel(self, painter: QPainter, level: int):
+        stored = self._stored
+        if stored is None:
+            super().drawLevel(painter, level)
+        else:
+            self._drawStored(painter, stored, level)
+
+    def _drawStored(self, painter: QPainter, stored: StoredLayer, level: int):
+        rect = QRectF(QPoint(0, 0).toPointF(), QSize(stored.size).toSizeF())
+        if level >= stored.previewLevel:
+            painter.drawImage(rect, self._storedPreview(stored))
+            return
+
+        # Only decompress tiles that cover painter's device
+        device = painter.device()
+        deviceRect = QRectF(0, 0, device.width(), device.height())
+        visibleRect = painter.worldTransform().inverted()[0].mapRect(deviceRect).toAlignedRect()
+        for index in stored.iterTileIndices(visibleRect):
+            painter.drawImage(QRectF(stored.tileRect(index)), stored.tile(index))
+
+    def hitTest(self, point: QPoint):
+        stored = self._stored
+        if stored is None:
+            return super().hitTest(point)
+        # The preview is enough to tell, picking shouldn't decompress tiles
+        return hitTestImage(self._storedPreview(stored), point - self.location, stored.size)
+
+    def createThumbnail(self, size: QSize) -> QImage:
+        stored = self._stored
+        if stored is None:
+            return super().createThumbnail(size)
+        if size.isEmpty():
+            return QImage()
+        return self._storedPreview(stored).scaled(size, Qt.AspectRatioMode.KeepAspectRatio,
+                                                  Qt.TransformationMode.SmoothTransformation)
+
+
+class ProjectFile:
+    """A project file on disk, remembers which layers it stores so saving again only writes changed layers"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._reader: Optional[ChunkReader] = None
+        # Layers stored in this file with their pixels version at the time they were stored
+        self._storedLayers: WeakKeyDictionary[Layer, tuple[int, StoredLayer]] = WeakKeyDictionary()
+
+    def _getReader(self):
+        if self._reader is None:
+            self._reader = ChunkReader(self.path)
+        return self._reader
+
+    def load(self) -> tuple[QSize, list[Layer], Optional[QRect]]:
+        """Read project's canvas size, layers (back to front) and crop rectangle, pixels are read lazily"""
+        reader = self._getReader()
+        fileSize = reader.size()
+        if fileSize < HEADER.size + FOOTER.size:
+            raise ProjectFileError("Not a project file")
+        magic, version = HEADER.unpack(reader.read((0, HEADER.size)))
+        if magic != HEADER_MAGIC:
+            raise ProjectFileError("Not a project file")
+        if version > FILE_VERSION:
+            raise ProjectFileError("Project file was saved by a newer version")
+        indexOffset, indexLength, footerMagic = FOOTER.unpack(reader.read((fileSize - FOOTER.size, FOOTER.size)))
+        if footerMagic != FOOTER_MAGIC:
+            raise ProjectFileError("Project file is incomplete or corrupted")
+        try:
+            index = json.loads(reader.read((indexOffset, indexLength)))
+        except ValueError as e:
+            raise ProjectFileError("Project file index is corrupted") from e
+
+        layers = [self._loadLayer(reader, record) for record in index["layers"]]
+        cropRect = QRect(*index["cropRect"]) if index.get("cropRect") is not None else None
+        return QSize(*index["canvasSize"]), layers, cropRect
+
+    def _loadLayer(self, reader: ChunkReader, record: dict) -> Layer:
+        if record.get("type") == "group":
+            layer = GroupLayer(self._loadLayer(reader, childRecord) for childRecord in record["children"])
+            layer.isExpanded = record["isExpanded"]
+        else:
+            stored = StoredLayer(
+                reader,
+                QSize(*record["size"]),
+                [tuple(chunk) for chunk in record["tiles"]],
+                tuple(record["preview"]),
+                record["previewLevel"],
+            )
+            layer = StoredImageLayer(stored)
+            layer.location = QPoint(*record["location"])
+            self._storedLayers[layer] = (layer.pixelsVersion, stored)
+        layer.name = record["name"]
+        layer.isHidden = record["isHidden"]
+        layer.opacity = record["opacity"]
+        layer.blendMode = BlendMode(record["blendMode"])
+        return layer
+
+    def storedLayer(self, layer: Layer) -> Optional[StoredLayer]:
+        """Layer's pixels as stored in this file, None if they are not stored or changed since"""
+        entry = self._storedLayers.get(layer)
+        if entry is None or entry[0] != layer.pixelsVersion:
+            return None
+        return entry[1]
+
+    def save(
+        self,
+        canvasSize: QSize,
+        layers: list[Layer],
+        previousFile: Optional["ProjectFile"] = None,
+        cropRect: Optional[QRect] = None,
+    ):
+        """Save canvas size, layers (back to front) and crop rectangle,
+        pixels already stored in this file are kept in place and pixels stored in previousFile are copied
+        without recompressing them, other layers are compressed on worker threads"""
+        isNewFile = not os.path.exists(self.path) or (self._reader is None and len(self._storedLayers) == 0)
+        if isNewFile:
+            # Write next to the destination and move the file over it once complete, layers loaded from the file
+            # being replaced keep reading its pixels (open files and memory maps outlive the rename)
+            self._reader = None
+            self._storedLayers = WeakKeyDictionary()
+            writePath = self.path + ".tmp"
+            try:
+                with open(writePath, "wb") as file:
+                    file.write(HEADER.pack(HEADER_MAGIC, FILE_VERSION))
+                    newStoredLayers = self._writeSave(file, canvasSize, layers, previousFile, cropRect)
+                os.replace(writePath, self.path)
+            except BaseException:
+                try:
+                    os.remove(writePath)
+                except OSError:
+                    pass
+                raise
+        else:
+            with open(self.path, "r+b") as file:
+                file.seek(0, os.SEEK_END)
+                startOffset = file.tell()
+                try:
+                    newStoredLayers = self._writeSave(file, canvasSize, layers, previousFile, cropRect)
+                except BaseException:
+                    # Drop the partially written save, the previous footer is at the end of the file again
+                    file.truncate(startOffset)
+                    raise
+
+        reader = self._getReader()
+        for layer, stored in newStoredLayers:
+            stored.reader = reader
+            self._storedLayers[layer] = (layer.pixelsVersion, stored)
+            if isinstance(layer, StoredImageLayer):
+                # Read from this file from now on, so the file the layer was loaded from can be released
+                layer.rebind(stored)
+
+    def _writeSave(self, file, canvasSize: QSize, layers: list[Layer], previousFile: Optional["ProjectFile"],
+                   cropRect: Optional[QRect]) -> list[tuple[Layer, StoredLayer]]:
+        newStoredLayers = []
+        records = [self._layerRecord(file, layer, previousFile, newStoredLayers) for layer in layers]
+
+        index = json.dumps({
+            "canvasSize": [canvasSize.width(), canvasSize.height()],
+            "cropRect": None if cropRect is None else [
+                cropRect.x(), cropRect.y(), cropRect.width(), cropRect.height()
+            ],
+            "layers": records,
+        }).encode()
+        indexOffset = file.tell()
+        file.write(index)
+        file.write(FOOTER.pack(indexOffset, len(index), FOOTER_MAGIC))
+        file.flush()
+        os.fsync(file.fileno())
+        return newStoredLayers
+
+    def _layerRecord(self, file, layer: Layer, previousFile: Optional["ProjectFile"],
+                     newStoredLayers: list[tuple[Layer, StoredLayer]]) -> dict:
+        record = {
+            "name": layer.name,
+            "isHidden": layer.isHidden,
+            "opacity": layer.opacity,
+            "blendMode": layer.blendMode.value,
+        }
+        if isinstance(layer, GroupLayer):
+            record["type"] = "group"
+            record["isExpanded"] = layer.isExpanded
+            record["children"] = [
+                self._layerRecord(file, child, previousFile, newStoredLayers) for child in layer.children
+            ]
+            return record
+
+        stored = self.storedLayer(layer)
+        if stored is None:
+            stored = self._writeLayer(file, layer, previousFile)
+            newStoredLayers.append((layer, stored))
+        record.update({
+            "location": [layer.location.x(), layer.location.y()],
+            "size": [stored.size.width(), stored.size.height()],
+            "tiles": stored.tiles,
+            "preview": stored.preview,
+            "previewLevel": stored.previewLevel,
+        })
+        return record
+
+    def _writeChunk(self, file, data: bytes) -> Chunk:
+        offset = file.tell()
+        file.write(data)
+        return offset, len(data)
+
+    def _writeLayer(self, file, layer: Layer, previousFile: Optional["ProjectFile"]):
+        previous = None if previousFile is None else previousFile.storedLayer(layer)
+        if previous is None and isinstance(layer, StoredImageLayer):
+            # Pixels that were never decompressed are still the ones in the file the layer was loaded from
+            previous = layer.stored
+        if previous is not None:
+            # Copy compressed chunks as they are
+            tiles = [self._writeChunk(file, previous.reader.read(chunk)) for chunk in previous.tiles]
+            preview = self._writeChunk(file, previous.reader.read(previous.preview))
+            return StoredLayer(None, QSize(previous.size), tiles, preview, previous.previewLevel)
+
+        image = layerImage(layer)
+        stored = StoredLayer(None, image.size(), [], (0, 0), previewLevel(image.size()))
+        tileImages = (image.copy(stored.tileRect(index)) for index in stored.iterTileIndices(image.rect()))
+        # zlib releases the GIL, so tiles are compressed in parallel
+        for data in getThreadPool().map(encodeImage, tileImages):
+            stored.tiles.append(self._writeChunk(file, data))
+
+        if isinstance(layer, ImageLayer):
+            preview = layer.mipmap(stored.previewLevel)
+        else:
+            size = stored.size
+            preview = image.scaled(
+                QSize(max(1, size.width() >> stored.previewLevel), max(1, size.height() >> stored.previewLevel)),
+                Qt.AspectRatioMode.IgnoreAspectRatio,
+                Qt.TransformationMode.SmoothTransformation,
+            )
+        stored.preview = self._writeChunk(file, encodeImage(preview))
+        return stored
@@ -1,60 +1,511 @@
-from typing import Iterable, Optional
+from typing import Callable, Iterable, Optional
 
-from PyQt6.QtCore import QObject, QSize, pyqtSignal
+from PyQt6.QtCore import QObject, QPoint, QRect, QSize, pyqtSignal
+from PyQt6.QtGui import QImage, QPainter
 
-from awesome_image_editor.layers import Layer
+from awesome_image_editor.change_set import CANVAS_CHANGE_KINDS, ChangeKind, ChangeSet
+from awesome_image_editor.history import (
+    CropEntry,
+    DeleteEntry,
+    InsertEntry,
+    LayerPropertyEntry,
+    MoveEntry,
+    PixelsEntry,
+    ReorderEntry,
+    TileKey,
+    UndoHistory,
+    copyHistoryTiles,
+    historyTileRect,
+)
+from awesome_image_editor.layers import BlendMode, GroupLayer, ImageLayer, Layer
+from awesome_image_editor.spatial_index import SpatialIndex
 
 
 class ProjectModel(QObject):
-    # These signals are meant to be emitted and connected to by views and users of the model,
-    # to notify other views about changes
-    layersDeleted = pyqtSignal()
-    layersOrderChanged = pyqtSignal()
-    layersAdded = pyqtSignal()
-    layersVisibilityChanged = pyqtSignal()
-    layersSelectionChanged = pyqtSignal()
-
-    def __init__(self, parent: QObject, canvasSize: QSize):
+    # Emitted with a ChangeSet describing which layers changed, how they changed and their old and new bounds,
+    # so views can update only what is affected
+    layersChanged = pyqtSignal(ChangeSet)
+    canvasSizeChanged = pyqtSignal(QSize)
+    # Emitted with the old and new crop rectangles (see cropRect)
+    cropRectChanged = pyqtSignal(QRect, QRect)
+    # Emitted when a floating move starts, its offset changes or it ends
+    floatingMoveChanged = pyqtSignal()
+
+    def __init__(self, parent: Optional[QObject], canvasSize: QSize):
         super().__init__(parent)
+        # Layers at the top of the tree, children of groups are only held by their group
         self._layers: list[Layer] = []
         self._canvasSize = canvasSize
+        # Region of the canvas that is shown and exported, None shows the whole canvas,
+        # layers keep all their pixels so the crop can be changed or removed later
+        self._cropRect: Optional[QRect] = None
         self.activeLayer: Optional[Layer] = None
 
+        # Selection index, so selection operations cost in proportion to the selection, not the project size,
+        # a dict is used as an insertion ordered set
+        self._selectedLayers: dict[Layer, None] = {}
+        # Position of each layer in self._layers, positions from self._layerIndicesDirtyFrom onwards are outdated
+        self._layerIndices: dict[Layer, int] = {}
+        self._layerIndicesDirtyFrom: Optional[int] = None
+        # Canvas space bounds of layers at the top of the tree, for finding layers in a region or under a point
+        self._spatialIndex = SpatialIndex()
+
+        # Layers being dragged in a floating move, they are only moved when the move is committed
+        self._floatingLayers: list[Layer] = []
+        self._floatingOffset = QPoint(0, 0)
+
+        # Operations are recorded here as they happen, undoing and redoing them calls back into this model
+        self.history = UndoHistory(self, self)
+
+    def _emitChanges(self, changes: ChangeSet):
+        if len(changes) > 0:
+            self._invalidateGroupComposites(changes)
+            self._updateSpatialIndex(changes)
+            self.layersChanged.emit(changes)
+
+    def _updateSpatialIndex(self, changes: ChangeSet):
+        movedLayers = {}
+        for change in changes:
+            if change.kind & ChangeKind.DELETED:
+                self._spatialIndex.remove(change.layer)
+                movedLayers.pop(change.layer, None)
+            elif change.kind & (ChangeKind.ADDED | ChangeKind.GEOMETRY | ChangeKind.PIXELS):
+                # A change inside a group may change the bounds of the group at the top of the tree
+                layer = change.layer
+                while layer.parentGroup is not None:
+                    layer = layer.parentGroup
+                if change.kind & ChangeKind.ADDED or layer in self._spatialIndex:
+                    movedLayers[layer] = None
+        for layer in movedLayers:
+            self._spatialIndex.insert(layer, layer.boundingRect())
+
+    @staticmethod
+    def _invalidateGroupComposites(changes: ChangeSet):
+        # A group looks different when any descendant does, changes to the group itself (e.g. moving it as a whole)
+        # keep its composite valid
+        groups = set()
+        for change in changes:
+            if change.kind & CANVAS_CHANGE_KINDS:
+                group = change.layer.parentGroup
+                while group is not None and group not in groups:
+                    groups.add(group)
+                    group = group.parentGroup
+        for group in groups:
+            group.markPixelsChanged()
+
     def addLayerToFront(self, layer: Layer):
-        self._layers.append(layer)
+        self.addLayersToFront([layer])
 
     def addLayersToFront(self, layers: Iterable[Layer]):
-        self._layers.extend(layers)
+        indexedLayers = []
+        changes = ChangeSet()
+        for layer in layers:
+            indexedLayers.append((len(self._layers), layer))
+            self._addLayer(len(self._layers), layer, changes)
+        if len(indexedLayers) > 0:
+            self.history.push(InsertEntry(indexedLayers))
+        self._emitChanges(changes)
+
+    def reset(self, canvasSize: QSize, layers: Iterable[Layer], cropRect: Optional[QRect] = None):
+        """Replace all layers, the canvas size and the crop (e.g. when opening a project), history is cleared"""
+        changes = ChangeSet()
+        for layer in self._layers:
+            changes.add(layer, ChangeKind.DELETED, oldBounds=layer.boundingRect())
+        self._layers = []
+        self._layerIndices.clear()
+        self._layerIndicesDirtyFrom = None
+        self._selectedLayers.clear()
+        self.activeLayer = None
+        for layer in layers:
+            self._addLayer(len(self._layers), layer, changes)
+        self.history.clear()
+
+        oldCropRect = self.cropRect()
+        self._cropRect = None if cropRect is None else QRect(cropRect)
+        if canvasSize != self._canvasSize:
+            self._canvasSize = QSize(canvasSize)
+            self.canvasSizeChanged.emit(self._canvasSize)
+        if self.cropRect() != oldCropRect:
+            self.cropRectChanged.emit(oldCropRect, self.cropRect())
+        self._emitChanges(changes)
+
+    def insertLayers(self, indexedLayers: list[tuple[int, Layer]]):
+        """Insert layers at positions, positions are in ascending order and refer to the list after insertion"""
+        if len(indexedLayers) == 0:
+            return
+        changes = ChangeSet()
+        for index, layer in indexedLayers:
+            self._addLayer(index, layer, changes)
+        self._markLayerIndicesDirty(indexedLayers[0][0])
+        self.history.push(InsertEntry(indexedLayers))
+        self._emitChanges(changes)
+
+    def _addLayer(self, index: int, layer: Layer, changes: ChangeSet):
+        if index == len(self._layers):
+            self._layerIndices[layer] = index
+            self._layers.append(layer)
+        else:
+            self._layers.insert(index, layer)
+        layer.parentGroup = None
+        for treeLayer in self._iterSubtree(layer):
+            if isinstance(treeLayer, GroupLayer):
+                # Children may have been at the top of the tree since the group was last in the project
+                for child in treeLayer.children:
+                    child.parentGroup = treeLayer
+            if treeLayer.isSelected:
+                self._selectedLayers[treeLayer] = None
+        changes.add(layer, ChangeKind.ADDED, newBounds=layer.boundingRect())
+
+    @staticmethod
+    def _iterSubtree(layer: Layer):
+        yield layer
+        if isinstance(layer, GroupLayer):
+            yield from layer.iterDescendants()
 
     def iterLayersBackToFront(self):
+        """Iterate layers at the top of the tree, groups draw their own children"""
         return iter(self._layers)
 
     def iterLayersFrontToBack(self):
-        return iter(self._layers[::-1])
+        return reversed(self._layers)
+
+    def iterLayersInRect(self, rect: QRect):
+        """Iterate layers at the top of the tree whose bounds intersect a canvas space rectangle, back to front"""
+        return iter(sorted(self._spatialIndex.intersecting(rect), key=self.layerIndex))
+
+    def layerAt(self, point: QPoint, isAlphaAccurate: bool = False) -> Optional[Layer]:
+        """Frontmost visible layer at the top of the tree under a canvas space point, with isAlphaAccurate
+        layers' transparent pixels are clicked through (see Layer.hitTest)"""
+        for layer in sorted(self._spatialIndex.containing(point), key=self.layerIndex, reverse=True):
+            if not layer.isHidden and (not isAlphaAccurate or layer.hitTest(point)):
+                return layer
+        return None
+
+    def iterLayerTreeFrontToBack(self, skipCollapsed: bool = False):
+        """Iterate all layers with their depth in the tree (0 at the top), groups come before their children,
+        children of collapsed groups are skipped if skipCollapsed is set"""
+        stack = [(layer, 0) for layer in self._layers]
+        while len(stack) > 0:
+            layer, depth = stack.pop()
+            yield layer, depth
+            if isinstance(layer, GroupLayer) and (layer.isExpanded or not skipCollapsed):
+                stack.extend((child, depth + 1) for child in layer.children)
+
+    def layerCount(self):
+        return len(self._layers)
+
+    def layerIndex(self, layer: Layer):
+        """Position of layer from back (0) to front"""
+        self._repairLayerIndices()
+        return self._layerIndices[layer]
+
+    def _repairLayerIndices(self):
+        if self._layerIndicesDirtyFrom is not None:
+            for i in range(self._layerIndicesDirtyFrom, len(self._layers)):
+                self._layerIndices[self._layers[i]] = i
+            self._layerIndicesDirtyFrom = None
+
+    def iterSelectedLayers(self):
+        """Iterate selected layers in the order they were selected"""
+        return iter(self._selectedLayers)
+
+    def selectedCount(self):
+        return len(self._selectedLayers)
 
     @property
     def canvasSize(self):
         return self._canvasSize
 
+    def cropRect(self):
+        """Canvas space region that is shown and exported, the whole canvas when not cropped"""
+        canvasRect = QRect(QPoint(0, 0), self._canvasSize)
+        if self._cropRect is None:
+            return canvasRect
+        return self._cropRect.intersected(canvasRect)
+
+    def isCropped(self):
+        return self._cropRect is not None
+
+    def setCropRect(self, cropRect: Optional[QRect]):
+        """Crop to a canvas space rectangle without touching pixels, None removes the crop"""
+        if cropRect is not None:
+            cropRect = cropRect.normalized()
+        if cropRect == self._cropRect:
+            return
+        oldCropRect = self.cropRect()
+        self.history.push(CropEntry(self._cropRect, cropRect))
+        self._cropRect = None if cropRect is None else QRect(cropRect)
+        self.cropRectChanged.emit(oldCropRect, self.cropRect())
+
+    def _selectedTopLevelLayers(self):
+        # Operations on positions only apply to layers at the top of the tree
+        return [layer for layer in self._selectedLayers if layer.parentGroup is None]
+
     def deleteSelected(self):
-        # TODO: improve memory usage? a copy of list is made and filtered,
-        #       so it uses more memory for a moment,
-        #       also it is done anyway even if there are no selected layers
-        #       but it is very fast, very usable and very interactive anyways for hundreds of layers.
-        new_layers = [layer for layer in self._layers if not layer.isSelected]
-        self._layers.clear()
-        self._layers.extend(new_layers)
+        self.deleteLayers(self._selectedTopLevelLayers())
+
+    def deleteLayers(self, layers: Iterable[Layer]):
+        indices = sorted(self.layerIndex(layer) for layer in layers)
+        if len(indices) == 0:
+            return
+
+        changes = ChangeSet()
+        indexedLayers = [(i, self._layers[i]) for i in indices]
+        # Delete from front to back so remaining indices stay valid
+        for i in reversed(indices):
+            layer = self._layers.pop(i)
+            del self._layerIndices[layer]
+            for treeLayer in self._iterSubtree(layer):
+                self._selectedLayers.pop(treeLayer, None)
+                if treeLayer is self.activeLayer:
+                    self.activeLayer = None
+            changes.add(layer, ChangeKind.DELETED, oldBounds=layer.boundingRect())
+        self._markLayerIndicesDirty(indices[0])
+
+        self.history.push(DeleteEntry(indexedLayers))
+        self._emitChanges(changes)
+
+    def _markLayerIndicesDirty(self, fromIndex: int):
+        if self._layerIndicesDirtyFrom is None:
+            self._layerIndicesDirtyFrom = fromIndex
+        else:
+            self._layerIndicesDirtyFrom = min(self._layerIndicesDirtyFrom, fromIndex)
+
+    def _swapLayers(self, i: int, j: int, changes: ChangeSet):
+        self._layers[i], self._layers[j] = self._layers[j], self._layers[i]
+        for index in (i, j):
+            layer = self._layers[index]
+            self._layerIndices[layer] = index
+            bounds = layer.boundingRect()
+            changes.add(layer, ChangeKind.ORDER, bounds, bounds)
+
+    def _finishReorder(self, swaps: list[tuple[int, int]], changes: ChangeSet):
+        if len(swaps) > 0:
+            self.history.push(ReorderEntry(swaps))
+        self._emitChanges(changes)
+
+    def swapLayers(self, swaps: Iterable[tuple[int, int]]):
+        """Swap layers at pairs of positions, in order"""
+        # Swaps keep the indices of swapped layers up to date, so outdated indices must be repaired first
+        self._repairLayerIndices()
+        swaps = list(swaps)
+        changes = ChangeSet()
+        for i, j in swaps:
+            self._swapLayers(i, j, changes)
+        self._finishReorder(swaps, changes)
 
     def raiseSelectedLayers(self):
-        for i in range(len(self._layers) - 1)[::-1]:
-            if self._layers[i].isSelected and (not self._layers[i + 1].isSelected):
-                self._layers[i], self._layers[i + 1] = self._layers[i + 1], self._layers[i]
+        swaps = []
+        changes = ChangeSet()
+        # Going from front to back moves a block of selected layers up by one
+        for i in sorted((self.layerIndex(layer) for layer in self._selectedTopLevelLayers()), reverse=True):
+            if i + 1 < len(self._layers) and (not self._layers[i + 1].isSelected):
+                self._swapLayers(i, i + 1, changes)
+                swaps.append((i, i + 1))
+        self._finishReorder(swaps, changes)
 
     def lowerSelectedLayers(self):
-        for i in range(len(self._layers) - 1):
-            if self._layers[i + 1].isSelected and (not self._layers[i].isSelected):
-                self._layers[i], self._layers[i + 1] = self._layers[i + 1], self._layers[i]
+        swaps = []
+        changes = ChangeSet()
+        # Going from back to front moves a block of selected layers down by one
+        for i in sorted(self.layerIndex(layer) for layer in self._selectedTopLevelLayers()):
+            if i > 0 and (not self._layers[i - 1].isSelected):
+                self._swapLayers(i - 1, i, changes)
+                swaps.append((i - 1, i))
+        self._finishReorder(swaps, changes)
+
+    def moveLayers(self, layers: Iterable[Layer], delta: QPoint):
+        layers = list(layers)
+        if len(layers) == 0 or delta.isNull():
+            return
+        changes = ChangeSet()
+        for layer in layers:
+            oldBounds = layer.boundingRect()
+            layer.location += delta
+            changes.add(layer, ChangeKind.GEOMETRY, oldBounds, layer.boundingRect())
+        self.history.push(MoveEntry(layers, delta))
+        self._emitChanges(changes)
+
+    def moveSelectedLayers(self, delta: QPoint):
+        self.moveLayers(self._selectedWithoutDescendants(), delta)
+
+    def _selectedWithoutDescendants(self):
+        # Moving a group moves its children, so selected descendants of selected groups must not move again
+        def hasSelectedAncestor(layer: Layer):
+            group = layer.parentGroup
+            while group is not None:
+                if group.isSelected:
+                    return True
+                group = group.parentGroup
+            return False
+
+        return [layer for layer in self._selectedLayers if not hasSelectedAncestor(layer)]
+
+    def duplicateSelectedLayers(self):
+        """Add a copy of each selected layer at the top of the tree in front of it, copies share pixels with
+        the originals until either is edited, the copies become the selection"""
+        layers = sorted(self._selectedTopLevelLayers(), key=self.layerIndex)
+        if len(layers) == 0:
+            return
+        duplicates = [layer.duplicate() for layer in layers]
+        self.deselectAll()
+        # Each copy is one position further in front for every copy inserted behind it
+        self.insertLayers([(self.layerIndex(layer) + i + 1, duplicate)
+                           for i, (layer, duplicate) in enumerate(zip(layers, duplicates))])
+        self.setLayersSelected(duplicates, True)
+        self.activeLayer = duplicates[-1]
+
+    def groupSelectedLayers(self):
+        """Put selected layers at the top of the tree into a new group, in place of the frontmost of them"""
+        layers = sorted(self._selectedTopLevelLayers(), key=self.layerIndex)
+        if len(layers) == 0:
+            return
+        index = self.layerIndex(layers[-1]) - (len(layers) - 1)
+        self.deselectAll()
+        group = GroupLayer(layers)
+        group.name = "Group"
+        self.history.beginGroup("Group Layers")
+        self.deleteLayers(layers)
+        self.insertLayers([(index, group)])
+        self.history.endGroup()
+        self.setLayersSelected([group], True)
+        self.activeLayer = group
+
+    def ungroupSelectedLayers(self):
+        """Replace selected groups at the top of the tree with their children"""
+        groups = sorted(
+            (layer for layer in self._selectedTopLevelLayers() if isinstance(layer, GroupLayer)), key=self.layerIndex
+        )
+        if len(groups) == 0:
+            return
+        self.history.beginGroup("Ungroup Layers")
+        indexedChildren = []
+        for i, group in enumerate(groups):
+            # Position of the group once groups behind it are removed
+            index = self.layerIndex(group) - i + len(indexedChildren)
+            indexedChildren.extend((index + j, child) for j, child in enumerate(group.children))
+        self.deleteLayers(groups)
+        self.insertLayers(indexedChildren)
+        self.history.endGroup()
+
+    def canFloatSelectedLayers(self):
+        """Whether selected layers can be moved as a floating selection, that is composited separately from
+        layers below and above them (see FloatingSelection), which is only equivalent to compositing all layers
+        when the selected layers are contiguous and they and layers above them use normal blending"""
+        if len(self._selectedLayers) == 0 or any(layer.parentGroup is not None for layer in self._selectedLayers):
+            return False
+        indices = sorted(self.layerIndex(layer) for layer in self._selectedLayers)
+        for layer in self._layers[indices[0]:indices[-1] + 1]:
+            if not layer.isSelected and not layer.isHidden:
+                return False
+        return all(layer.blendMode == BlendMode.NORMAL for layer in self._layers[indices[0]:] if not layer.isHidden)
+
+    def startFloatingMove(self):
+        """Start moving selected layers without changing their location until commitFloatingMove,
+        so views can draw a preview instead of recompositing on every change of the offset"""
+        self._floatingLayers = list(self._selectedLayers)
+        self._floatingOffset = QPoint(0, 0)
+        self.floatingMoveChanged.emit()
+
+    def isFloatingMove(self):
+        return len(self._floatingLayers) > 0
+
+    def floatingLayers(self):
+        return self._floatingLayers
+
+    def floatingOffset(self):
+        return QPoint(self._floatingOffset)
+
+    def setFloatingOffset(self, offset: QPoint):
+        if not self.isFloatingMove() or offset == self._floatingOffset:
+            return
+        self._floatingOffset = QPoint(offset)
+        self.floatingMoveChanged.emit()
+
+    def commitFloatingMove(self):
+        """Move floating layers by the floating offset and end the floating move"""
+        layers, offset = self._floatingLayers, self._floatingOffset
+        self._floatingLayers = []
+        self._floatingOffset = QPoint(0, 0)
+        self.moveLayers(layers, offset)
+        self.floatingMoveChanged.emit()
+
+    def setLayerHidden(self, layer: Layer, isHidden: bool):
+        if layer.isHidden == isHidden:
+            return
+        self.history.push(LayerPropertyEntry(
+            "Show Layer" if layer.isHidden else "Hide Layer", layer, "setLayerHidden", layer.isHidden, isHidden
+        ))
+        layer.isHidden = isHidden
+        self._emitChanges(self._singleChange(layer, ChangeKind.VISIBILITY, layer.boundingRect()))
+
+    def setLayerOpacity(self, layer: Layer, opacity: float):
+        if layer.opacity == opacity:
+            return
+        self.history.push(LayerPropertyEntry("Change Opacity", layer, "setLayerOpacity", layer.opacity, opacity))
+        layer.opacity = opacity
+        # Opacity and blend mode change how a layer looks without changing its pixels
+        self._emitChanges(self._singleChange(layer, ChangeKind.VISIBILITY, layer.boundingRect()))
+
+    def setLayerBlendMode(self, layer: Layer, blendMode: BlendMode):
+        if layer.blendMode == blendMode:
+            return
+        self.history.push(
+            LayerPropertyEntry("Change Blend Mode", layer, "setLayerBlendMode", layer.blendMode, blendMode)
+        )
+        layer.blendMode = blendMode
+        self._emitChanges(self._singleChange(layer, ChangeKind.VISIBILITY, layer.boundingRect()))
+
+    def notifyPixelsChanged(self, layer: Layer):
+        """Notify views that layer's pixels were modified in place (not recorded in history)"""
+        self._pixelsChanged(layer, QRect(QPoint(0, 0), layer.size()))
+
+    def editLayerPixels(self, layer: ImageLayer, rect: QRect, edit: Callable[[QImage], None]):
+        """Modify layer's pixels in place, edit is called with layer's image and must only change pixels
+        inside rect (in layer space), only that region is recorded in history"""
+        oldTiles = self.history.captureTiles(layer, rect)
+        edit(layer.image)
+        newTiles = copyHistoryTiles(layer.image, rect)
+        self.history.push(PixelsEntry(layer, oldTiles, newTiles))
+        self._pixelsChanged(layer, rect)
+        self.history.setLatestTiles(layer, newTiles)
+
+    def writeLayerTiles(self, layer: ImageLayer, tiles: dict[TileKey, QImage]):
+        """Copy history tiles (see history.captureTiles) back into layer's image"""
+        rect = QRect()
+        painter = QPainter()
+        painter.begin(layer.image)
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Source)
+        for key, tile in tiles.items():
+            tileRect = historyTileRect(key)
+            painter.drawImage(tileRect.topLeft(), tile)
+            rect = rect.united(tileRect)
+        painter.end()
+        self._pixelsChanged(layer, rect.intersected(layer.image.rect()))
+        self.history.setLatestTiles(layer, tiles)
+
+    def _pixelsChanged(self, layer: Layer, rect: QRect):
+        layer.markPixelsChanged()
+        damageRect = rect.translated(layer.location)
+        self._emitChanges(self._singleChange(layer, ChangeKind.PIXELS, damageRect))
+
+    @staticmethod
+    def _singleChange(layer: Layer, kind: ChangeKind, bounds: QRect):
+        changes = ChangeSet()
+        changes.add(layer, kind, bounds, bounds)
+        return changes
+
+    def setLayersSelected(self, layers: Iterable[Layer], isSelected: bool):
+        changes = ChangeSet()
+        for layer in layers:
+            if layer.isSelected != isSelected:
+                layer.isSelected = isSelected
+                if isSelected:
+                    self._selectedLayers[layer] = None
+                else:
+                    del self._selectedLayers[layer]
+                changes.add(layer, ChangeKind.SELECTION)
+        self._emitChanges(changes)
 
     def deselectAll(self):
-        for layer in self._layers:
-            layer.isSelected = False
+        self.setLayersSelected(list(self._selectedLayers), False)
@@ -0,0 +1,87 @@
+from collections import defaultdict
+from typing import Hashable, Iterator
+
+from PyQt6.QtCore import QPoint, QRect
+
+# Side length of grid cells in canvas space, a few times a typical layer, so most layers cover a few cells
+GRID_CELL_SIZE = 512
+
+Cell = tuple[int, int]
+
+
+class SpatialIndex:
+    """Uniform grid of rectangles (e.g. layers' canvas space bounds), finding items intersecting a rectangle or
+    containing a point only looks at items sharing grid cells with it instead of every item.
+
+    A grid rather than a tree, as layers are similarly sized and updating an item after a move is cheap"""
+
+    def __init__(self, cellSize: int = GRID_CELL_SIZE):
+        self._cellSize = cellSize
+        self._cells: defaultdict[Cell, set[Hashable]] = defaultdict(set)
+        self._rects: dict[Hashable, QRect] = {}
+
+    def __len__(self):
+        return len(self._rects)
+
+    def __contains__(self, item: Hashable):
+        return item in self._rects
+
+    def _iterCells(self, rect: QRect) -> Iterator[Cell]:
+        size = self._cellSize
+        for row in range(rect.top() // size, rect.bottom() // size + 1):
+            for column in range(rect.left() // size, rect.right() // size + 1):
+                yield column, row
+
+    def insert(self, item: Hashable, rect: QRect):
+        """Add item with its rectangle, or move it to rect if it was added before"""
+        if item in self._rects:
+            self.remove(item)
+        rect = QRect(rect)
+        self._rects[item] = rect
+        if rect.isEmpty():
+            return
+        for cell in self._iterCells(rect):
+            self._cells[cell].add(item)
+
+    def remove(self, item: Hashable):
+        rect = self._rects.pop(item, None)
+        if rect is None or rect.isEmpty():
+            return
+        for cell in self._iterCells(rect):
+            items = self._cells[cell]
+            items.discard(item)
+            if len(items) == 0:
+                del self._cells[cell]
+
+    def clear(self):
+        self._cells.clear()
+        self._rects.clear()
+
+    def rect(self, item: Hashable) -> QRect:
+        return QRect(self._rects[item])
+
+    def intersecting(self, rect: QRect) -> set[Hashable]:
+        """Items whose rectangles intersect rect"""
+        if rect.isEmpty():
+            return set()
+        candidates = set()
+        # Walk the smaller of the cells covered by rect and the occupied cells
+        cellCount = (rect.width() // self._cellSize + 2) * (rect.height() // self._cellSize + 2)
+        if cellCount > len(self._cells):
+            size = self._cellSize
+            left, top = rect.left() // size, rect.top() // size
+            right, bottom = rect.right() // size, rect.bottom() // size
+            for (column, row), items in self._cells.items():
+                if left <= column <= right and top <= row <= bottom:
+                    candidates |= items
+        else:
+            for cell in self._iterCells(rect):
+                items = self._cells.get(cell)
+                if items is not None:
+                    candidates |= items
+        return {item for item in candidates if self._rects[item].intersects(rect)}
+
+    def containing(self, point: QPoint) -> set[Hashable]:
+        """Items whose rectangles contain point"""
+        items = self._cells.get((point.x() // self._cellSize, point.y() // self._cellSize), ())
+        return {item for item in items if self._rects[item].contains(point)}
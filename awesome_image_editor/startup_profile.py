@@ -0,0 +1,71 @@
+"""Startup profile printed with --profile-startup: where the time until the main window's first frame is spent
+(imports, fonts, icons and window construction), measured with trace spans (see tracing)"""
+
+import sys
+from typing import Callable, Optional, TextIO
+
+from PyQt6.QtCore import QEvent, QObject, QTimer
+from PyQt6.QtWidgets import QWidget
+
+from awesome_image_editor.tracing import recorder
+
+STARTUP_CATEGORIES = ("imports", "fonts", "icons", "window")
+
+
+def selfTimes(events: list[dict]) -> list[tuple[dict, float]]:
+    """Pair spans with their duration excluding nested spans (e.g. fonts loaded while constructing the
+    application), so times of different categories add up"""
+    spans = sorted((event for event in events if event["ph"] == "X"), key=lambda event: (event["ts"], -event["dur"]))
+    selfDurations = {id(event): event["dur"] for event in spans}
+    stacks: dict[int, list[dict]] = {}
+    for event in spans:
+        stack = stacks.setdefault(event["tid"], [])
+        while len(stack) > 0 and stack[-1]["ts"] + stack[-1]["dur"] <= event["ts"]:
+            stack.pop()
+        if len(stack) > 0:
+            selfDurations[id(stack[-1])] -= event["dur"]
+        stack.append(event)
+    return [(event, selfDurations[id(event)]) for event in spans]
+
+
+def printStartupProfile(firstFrameTime: float, file: Optional[TextIO] = None):
+    """Print recorded startup spans by category, firstFrameTime is in microseconds since recording started"""
+    file = sys.stderr if file is None else file
+    totals = {category: 0.0 for category in STARTUP_CATEGORIES}
+    lines = []
+    for event, duration in selfTimes(recorder.events()):
+        if event["cat"] not in totals:
+            continue
+        totals[event["cat"]] += duration
+        lines.append(f"  {event['cat']:8} {event['name']:40} {duration / 1000:8.2f}ms")
+
+    print("Startup profile (time excluding nested spans):", file=file)
+    for line in lines:
+        print(line, file=file)
+    for category, total in totals.items():
+        print(f"{category:10} {total / 1000:8.2f}ms", file=file)
+    print(f"{'first frame':10} {firstFrameTime / 1000:8.2f}ms", file=file)
+
+
+class FirstFrameWatcher(QObject):
+    """Calls callback once widget has painted its first frame"""
+
+    def __init__(self, widget: QWidget, callback: Callable[[], None]):
+        super().__init__(widget)
+        self._callback = callback
+        widget.installEventFilter(self)
+
+    def eventFilter(self, watched: QObject, event: QEvent) -> bool:
+        if event.type() == QEvent.Type.Paint:
+            watched.removeEventFilter(self)
+            # Let the paint finish first
+            QTimer.singleShot(0, self._callback)
+        return False
+
+
+def reportAfterFirstFrame(widget: QWidget):
+    def report():
+        printStartupProfile(recorder.elapsed())
+        recorder.stop()
+
+    FirstFrameWatcher(widget, report)
@@ -0,0 +1,91 @@
+from concurrent.futures import Future
+from typing import Optional
+from weakref import WeakKeyDictionary
+
+from PyQt6.QtCore import QObject, QSize, pyqtSignal
+from PyQt6.QtGui import QPixmap
+
+from awesome_image_editor.layers import Layer
+from awesome_image_editor.tracing import traced
+from awesome_image_editor.workers import getThreadPool
+
+
+class ThumbnailCache(QObject):
+    """Layer thumbnails keyed by layer and its pixels version, generated in the background on first request"""
+
+    # Emitted in the GUI thread when a requested thumbnail becomes available
+    thumbnailReady = pyqtSignal(Layer)
+
+    # Emitted from worker threads, delivered to the GUI thread as a queued connection
+    _thumbnailFinished = pyqtSignal(Future)
+
+    def __init__(self, parent: QObject, size: QSize):
+        super().__init__(parent)
+        self._size = size
+        self._devicePixelRatio = 1.0
+        # Layers are weakly referenced so that deleted layers free their thumbnails
+        self._thumbnails: WeakKeyDictionary[Layer, tuple[int, QPixmap]] = WeakKeyDictionary()
+        # Pending requests with the pixels version and device pixel ratio they were made for
+        self._requests: WeakKeyDictionary[Layer, tuple[int, float, Future]] = WeakKeyDictionary()
+        self._requestsLayers: dict[Future, Layer] = {}
+
+        self._thumbnailFinished.connect(self._onThumbnailFinished)
+
+    def setDevicePixelRatio(self, devicePixelRatio: float):
+        if devicePixelRatio != self._devicePixelRatio:
+            self._devicePixelRatio = devicePixelRatio
+            self.clear()
+
+    def clear(self):
+        self._thumbnails.clear()
+
+    def hasPendingRequests(self):
+        return len(self._requests) > 0
+
+    def thumbnail(self, layer: Layer) -> Optional[QPixmap]:
+        """Get layer's thumbnail, if it is missing or outdated it is requested and the last available
+        thumbnail is returned (None if there is none), thumbnailReady is emitted when request finishes"""
+        entry = self._thumbnails.get(layer)
+        if entry is not None:
+            version, pixmap = entry
+            if version == layer.pixelsVersion:
+                return pixmap
+            self._request(layer)
+            return pixmap
+
+        self._request(layer)
+        return None
+
+    def _request(self, layer: Layer):
+        request = self._requests.get(layer)
+        if request is not None and request[:2] == (layer.pixelsVersion, self._devicePixelRatio):
+            # Already being generated
+            return
+
+        size = self._size * self._devicePixelRatio
+        future = getThreadPool().submit(layer.createThumbnail, size)
+        self._requests[layer] = (layer.pixelsVersion, self._devicePixelRatio, future)
+        self._requestsLayers[future] = layer
+        future.add_done_callback(self._thumbnailFinished.emit)
+
+    @traced("ThumbnailCache._onThumbnailFinished")
+    def _onThumbnailFinished(self, future: Future):
+        layer = self._requestsLayers.pop(future)
+        request = self._requests.get(layer)
+        if request is None or request[2] is not future:
+            # A newer request replaced this one
+            return
+        del self._requests[layer]
+        if request[1] != self._devicePixelRatio:
+            # Made for a screen the view has left, the next paint requests it again at the current ratio
+            return
+
+        try:
+            image = future.result()
+        except Exception:
+            # An exception escaping a slot aborts the application, the layer keeps its last thumbnail
+            return
+        pixmap = QPixmap.fromImage(image)
+        pixmap.setDevicePixelRatio(self._devicePixelRatio)
+        self._thumbnails[layer] = (request[0], pixmap)
+        self.thumbnailReady.emit(layer)
@@ -0,0 +1,343 @@
+import math
+import time
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+from PyQt6.QtCore import QObject, QPoint, QRect, QRectF, QSize, Qt, pyqtSignal
+from PyQt6.QtGui import QImage, QPainter
+
+from awesome_image_editor.layers import BlendMode, Layer, drawLayer
+from awesome_image_editor.project_model import ProjectModel
+from awesome_image_editor.tracing import TraceSpan, traced
+from awesome_image_editor.workers import getThreadPool
+
+TILE_SIZE = 256
+
+TileKey = tuple[int, int]
+
+# Composites layers (with their locations) into an image of a tile, arguments are
+# tile's canvas space rectangle, tile's size in pixels, mipmap level and layers back to front
+Compositor = Callable[[QRect, QSize, int, list[tuple[Layer, QPoint]]], QImage]
+
+
+def compositeTile(rect: QRect, pixelSize: QSize, level: int, layers: list[tuple[Layer, QPoint]]):
+    """Composite layers (with their locations at the time the tile was requested) into a tile image,
+    rect is tile's rectangle in canvas space, this is safe to call from worker threads"""
+    image = QImage(pixelSize, QImage.Format.Format_ARGB32_Premultiplied)
+    image.fill(Qt.GlobalColor.transparent)
+
+    painter = QPainter()
+    painter.begin(image)
+    try:
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing, True)
+        scale = 1 / (1 << level)
+        painter.scale(scale, scale)
+        painter.translate(-rect.topLeft())
+        for layer, location in layers:
+            drawLayer(painter, layer, location, level)
+    finally:
+        # A painter left active on a worker thread's image crashes Qt
+        painter.end()
+    return image
+
+
+def drawScaledImage(painter: QPainter, rect: QRect, image: QImage):
+    """Draw image (e.g. composited at a mipmap level) stretched over rect"""
+    if image.size() == rect.size():
+        painter.drawImage(rect.topLeft(), image)
+    else:
+        painter.drawImage(QRectF(rect), image, QRectF(image.rect()))
+
+
+def levelForScale(scale: float):
+    """Get the coarsest mipmap level whose resolution is still at least the given display scale"""
+    if scale <= 0:
+        return 0
+    return max(0, math.floor(math.log2(1 / scale)))
+
+
+class TiledCanvas(QObject):
+    """Canvas cache split into fixed-size tiles,
+    only tiles touched by a damage rectangle are recomposited.
+
+    Tiles are composited at a mipmap level, at level L every tile pixel covers 2^L canvas pixels,
+    so a zoomed out view composites and draws a fraction of the canvas pixels.
+
+    When a viewport is set only tiles around it are composited and kept,
+    tiles exposed by panning are composited the next time dirty tiles are repainted.
+
+    In asynchronous mode tiles are composited on worker threads, outdated tiles (and tiles of the previous
+    mipmap level) keep being drawn until their replacement arrives, and tilesUpdated is emitted when it does."""
+
+    # Emitted with canvas space rectangle of tiles that finished compositing in the background
+    tilesUpdated = pyqtSignal(QRect)
+
+    # Emitted from worker threads, delivered to the GUI thread as a queued connection
+    _tileFinished = pyqtSignal(Future)
+
+    def __init__(self, parent: Optional[QObject], project: ProjectModel, isAsync: bool = False):
+        super().__init__(parent)
+        self._project = project
+        self._isAsync = isAsync
+        self._compositor: Compositor = compositeTile
+        self._level = 0
+        self._viewport: Optional[QRect] = None
+        self._tiles: dict[TileKey, QImage] = {}
+        # Layers covering each tile, back to front, updated when a tile is recomposited
+        self._tileLayers: dict[TileKey, list[Layer]] = {}
+        # Tiles whose cached image is up to date (a valid tile without an image is empty)
+        self._validTiles: set[TileKey] = set()
+        # Tiles being composited in the background
+        self._pendingTiles: dict[TileKey, Future] = {}
+        self._futureKeys: dict[Future, TileKey] = {}
+        # Tiles of the previous mipmap level, drawn as a preview until tiles of current level arrive
+        self._fallbackTiles: dict[TileKey, QImage] = {}
+        self._fallbackLevel = 0
+        # Number of tiles composited and time spent compositing them (summed over threads) since last taken
+        self._compositedCount = 0
+        self._compositeTime = 0.0
+
+        self._tileFinished.connect(self._onTileFinished)
+
+    def canvasRect(self):
+        return QRect(QPoint(0, 0), self._project.canvasSize)
+
+    @property
+    def isAsync(self):
+        return self._isAsync
+
+    @property
+    def compositor(self):
+        return self._compositor
+
+    def setCompositor(self, compositor: Compositor):
+        """Set the function used to composite tiles (see compositeTile)"""
+        if compositor is not self._compositor:
+            self._compositor = compositor
+            self.invalidateAll()
+
+    @property
+    def level(self):
+        return self._level
+
+    def setLevel(self, level: int):
+        if level == self._level:
+            return
+        if self._isAsync and len(self._tiles) > 0:
+            self._fallbackTiles = self._tiles
+            self._fallbackLevel = self._level
+            self._tiles = {}
+        self._level = level
+        self.invalidateAll()
+
+    @property
+    def viewport(self):
+        return self._viewport
+
+    def setViewport(self, viewport: Optional[QRect]):
+        """Limit compositing to tiles around viewport (in canvas space), None composites the whole canvas"""
+        self._viewport = None if viewport is None else QRect(viewport)
+
+    def regionOfInterest(self):
+        """Canvas space rectangle that should have up to date tiles, tiles outside the crop aren't composited"""
+        cropRect = self._project.cropRect()
+        if self._viewport is None:
+            return cropRect
+        # Keep a margin of one tile around viewport, so panning doesn't immediately expose missing tiles
+        span = self.tileSpan()
+        return self._viewport.adjusted(-span, -span, span, span).intersected(cropRect)
+
+    def tileSpan(self, level: Optional[int] = None):
+        """Side length of a tile in canvas space"""
+        return TILE_SIZE << (self._level if level is None else level)
+
+    def tileRect(self, key: TileKey, level: Optional[int] = None):
+        """Tile's rectangle in canvas space"""
+        column, row = key
+        span = self.tileSpan(level)
+        return QRect(column * span, row * span, span, span).intersected(self.canvasRect())
+
+    def tilePixelSize(self, key: TileKey):
+        rect = self.tileRect(key)
+        scale = 1 << self._level
+        return QSize(-(-rect.width() // scale), -(-rect.height() // scale))
+
+    def iterTileKeys(self, rect: QRect, level: Optional[int] = None):
+        """Iterate keys of tiles intersecting rect (in canvas space)"""
+        rect = rect.intersected(self.canvasRect())
+        if rect.isEmpty():
+            return
+        span = self.tileSpan(level)
+        for row in range(rect.top() // span, rect.bottom() // span + 1):
+            for column in range(rect.left() // span, rect.right() // span + 1):
+                yield column, row
+
+    def tileLayers(self, key: TileKey) -> list[Layer]:
+        return self._tileLayers.get(key, [])
+
+    def _cancelPending(self, key: TileKey):
+        future = self._pendingTiles.pop(key, None)
+        if future is not None:
+            future.cancel()
+
+    def invalidate(self, damageRect: QRect):
+        # Outdated images are kept until they are recomposited
+        for key in self.iterTileKeys(damageRect):
+            self._validTiles.discard(key)
+            # A newer change arrived, a render that started before it is stale
+            self._cancelPending(key)
+
+    def invalidateAll(self):
+        for key in list(self._pendingTiles.keys()):
+            self._cancelPending(key)
+        self._tiles.clear()
+        self._tileLayers.clear()
+        self._validTiles.clear()
+
+    def dirtyTiles(self):
+        """Keys of outdated or missing tiles in region of interest that are not being composited"""
+        return {
+            key
+            for key in self.iterTileKeys(self.regionOfInterest())
+            if key not in self._validTiles and key not in self._pendingTiles
+        }
+
+    def _boundingRect(self, keys: set[TileKey]):
+        rect = QRect()
+        for key in keys:
+            rect = rect.united(self.tileRect(key))
+        return rect
+
+    def _updateTilesLayers(self, keys: set[TileKey]):
+        for key in keys:
+            self._tileLayers[key] = []
+
+        dirtyRect = self._boundingRect(keys)
+        # Layers outside the dirty region (e.g. off the canvas or far from the viewport) aren't visited
+        for layer in self._project.iterLayersInRect(dirtyRect):
+            # Only walk tiles in the dirty region, so large layers don't cost proportional to their size
+            for key in self.iterTileKeys(layer.boundingRect().intersected(dirtyRect)):
+                if key in keys:
+                    self._tileLayers[key].append(layer)
+
+    def _evictTilesOutsideViewport(self):
+        if self._viewport is None:
+            return
+        span = self.tileSpan()
+        keepRect = self._viewport.adjusted(-2 * span, -2 * span, 2 * span, 2 * span)
+        keepKeys = set(self.iterTileKeys(keepRect))
+        for key in list(self._tiles.keys()):
+            if key not in keepKeys:
+                del self._tiles[key]
+                self._tileLayers.pop(key, None)
+        for key in list(self._pendingTiles.keys()):
+            if key not in keepKeys:
+                self._cancelPending(key)
+        self._validTiles.intersection_update(keepKeys)
+
+    def _tileSnapshot(self, key: TileKey):
+        """Everything needed to composite a tile, so it can be composited away from the GUI thread"""
+        rect = self.tileRect(key)
+        layers = [(layer, QPoint(layer.location)) for layer in self._tileLayers[key] if not layer.isHidden]
+        # Layers behind an opaque layer covering the whole tile don't show through it
+        for i in range(len(layers) - 1, 0, -1):
+            layer, location = layers[i]
+            if layer.opacity == 1 and layer.blendMode == BlendMode.NORMAL and layer.isOpaque() \
+                    and QRect(location, layer.size()).contains(rect):
+                layers = layers[i:]
+                break
+        return rect, self.tilePixelSize(key), self._level, layers
+
+    def _compositeTile(self, rect: QRect, pixelSize: QSize, level: int, layers: list[tuple[Layer, QPoint]]):
+        """Composite a tile and measure how long it took, runs on worker threads in asynchronous mode"""
+        startTime = time.perf_counter()
+        with TraceSpan("compositeTile", "composite", {"layers": len(layers)}):
+            image = self._compositor(rect, pixelSize, level, layers)
+        return image, time.perf_counter() - startTime
+
+    def _addCompositeStats(self, duration: float):
+        self._compositedCount += 1
+        self._compositeTime += duration
+
+    def takeCompositeStats(self) -> tuple[int, float]:
+        """Number of tiles composited and seconds spent compositing them since the last call"""
+        stats = self._compositedCount, self._compositeTime
+        self._compositedCount = 0
+        self._compositeTime = 0.0
+        return stats
+
+    def _setTileImage(self, key: TileKey, image: Optional[QImage]):
+        if image is None:
+            # Nothing to draw, don't waste memory on an empty tile
+            self._tiles.pop(key, None)
+        else:
+            self._tiles[key] = image
+        self._validTiles.add(key)
+
+    def repaintDirtyTiles(self) -> int:
+        """Recomposite dirty tiles (or start compositing them in asynchronous mode),
+        returns number of tiles recomposited"""
+        self._evictTilesOutsideViewport()
+
+        dirtyTiles = self.dirtyTiles()
+        if len(dirtyTiles) == 0:
+            return 0
+
+        self._updateTilesLayers(dirtyTiles)
+        for key in dirtyTiles:
+            rect, pixelSize, level, layers = self._tileSnapshot(key)
+            if len(layers) == 0:
+                self._setTileImage(key, None)
+            elif self._isAsync:
+                future = getThreadPool().submit(self._compositeTile, rect, pixelSize, level, layers)
+                self._pendingTiles[key] = future
+                self._futureKeys[future] = key
+                future.add_done_callback(self._tileFinished.emit)
+            else:
+                image, duration = self._compositeTile(rect, pixelSize, level, layers)
+                self._addCompositeStats(duration)
+                self._setTileImage(key, image)
+
+        self._dropFallbackIfComplete()
+        return len(dirtyTiles)
+
+    @traced("TiledCanvas._onTileFinished")
+    def _onTileFinished(self, future: Future):
+        key = self._futureKeys.pop(future)
+        if future.cancelled() or self._pendingTiles.get(key) is not future:
+            # Stale render, tile was invalidated or level changed after it started
+            return
+        del self._pendingTiles[key]
+        image, duration = future.result()
+        self._addCompositeStats(duration)
+        self._setTileImage(key, image)
+        self._dropFallbackIfComplete()
+        self.tilesUpdated.emit(self.tileRect(key))
+
+    def hasPendingTiles(self):
+        return len(self._pendingTiles) > 0
+
+    def _dropFallbackIfComplete(self):
+        if len(self._fallbackTiles) > 0 and len(self._pendingTiles) == 0:
+            self._fallbackTiles.clear()
+
+    def _drawFallback(self, painter: QPainter, rect: QRect):
+        painter.save()
+        painter.setClipRect(rect)
+        for key in self.iterTileKeys(rect, self._fallbackLevel):
+            image = self._fallbackTiles.get(key)
+            if image is not None:
+                drawScaledImage(painter, self.tileRect(key, self._fallbackLevel), image)
+        painter.restore()
+
+    def draw(self, painter: QPainter, exposedRect: QRect) -> list[TileKey]:
+        """Draw cached tiles intersecting exposedRect (in canvas space), returns keys of drawn tiles"""
+        drawnKeys = []
+        for key in self.iterTileKeys(exposedRect):
+            image = self._tiles.get(key)
+            if image is not None:
+                drawScaledImage(painter, self.tileRect(key), image)
+                drawnKeys.append(key)
+            elif key not in self._validTiles and len(self._fallbackTiles) > 0:
+                self._drawFallback(painter, self.tileRect(key))
+        return drawnKeys
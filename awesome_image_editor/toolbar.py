@@ -6,9 +6,10 @@ from PyQt6.QtWidgets import QToolBar, QWidget, QProxyStyle, QStyle, QStyleOption
 
 from awesome_image_editor.icons import getIcon, getFullIconPath
 
-ICON_TOOLBAR_EXTENSION_HORIZONTAL_RTL = getIcon("toolbar/extension_horizontal_rtl.svg")
-ICON_TOOLBAR_EXTENSION_HORIZONTAL = getIcon("toolbar/extension_horizontal.svg")
-ICON_TOOLBAR_EXTENSION_VERTICAL = getIcon("toolbar/extension_vertical.svg")
+# Icons are loaded when an extension button is first shown
+ICON_TOOLBAR_EXTENSION_HORIZONTAL_RTL_PATH = "toolbar/extension_horizontal_rtl.svg"
+ICON_TOOLBAR_EXTENSION_HORIZONTAL_PATH = "toolbar/extension_horizontal.svg"
+ICON_TOOLBAR_EXTENSION_VERTICAL_PATH = "toolbar/extension_vertical.svg"
 
 
 class ToolBarStyle(QProxyStyle):
@@ -18,12 +19,12 @@ class ToolBarStyle(QProxyStyle):
         # based on: https://forum.qt.io/post/622513
         if standardIcon == QStyle.StandardPixmap.SP_ToolBarHorizontalExtensionButton:
             if option.direction == Qt.LayoutDirection.RightToLeft:
-                return ICON_TOOLBAR_EXTENSION_HORIZONTAL_RTL
+                return getIcon(ICON_TOOLBAR_EXTENSION_HORIZONTAL_RTL_PATH)
             else:
-                return ICON_TOOLBAR_EXTENSION_HORIZONTAL
+                return getIcon(ICON_TOOLBAR_EXTENSION_HORIZONTAL_PATH)
 
         elif standardIcon == QStyle.StandardPixmap.SP_ToolBarVerticalExtensionButton:
-            return ICON_TOOLBAR_EXTENSION_VERTICAL
+            return getIcon(ICON_TOOLBAR_EXTENSION_VERTICAL_PATH)
 
         return super().standardIcon(standardIcon, option, widget)
 
@@ -0,0 +1,115 @@
+"""Opt-in recorder of Chrome trace events, saved traces can be opened in chrome://tracing or https://ui.perfetto.dev
+
+Spans are only recorded while the recorder is recording, otherwise they cost a flag check."""
+
+import json
+import os
+import threading
+import time
+from functools import wraps
+from typing import Optional
+
+
+class TraceRecorder:
+    def __init__(self):
+        self._isRecording = False
+        self._startTime = 0
+        self._events: list[dict] = []
+        self._threadNames: dict[int, str] = {}
+        # Spans are added from the GUI thread and worker threads
+        self._lock = threading.Lock()
+
+    def isRecording(self):
+        return self._isRecording
+
+    def start(self):
+        with self._lock:
+            self._events = []
+            self._threadNames = {}
+            self._startTime = time.perf_counter_ns()
+            self._isRecording = True
+
+    def stop(self):
+        self._isRecording = False
+
+    def eventCount(self):
+        return len(self._events)
+
+    def events(self) -> list[dict]:
+        with self._lock:
+            return list(self._events)
+
+    def elapsed(self):
+        """Microseconds since recording started, in the same time base as events"""
+        return (time.perf_counter_ns() - self._startTime) / 1000
+
+    def addSpan(self, name: str, category: str, startTime: int, endTime: int, args: Optional[dict] = None):
+        """Add a complete event, times are time.perf_counter_ns() values"""
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": (startTime - self._startTime) / 1000,
+            "dur": (endTime - startTime) / 1000,
+            "pid": os.getpid(),
+            "tid": thread.ident,
+        }
+        if args is not None:
+            event["args"] = args
+        with self._lock:
+            self._events.append(event)
+            self._threadNames[thread.ident] = thread.name
+
+    def save(self, path: str):
+        with self._lock:
+            events = list(self._events)
+            events.extend(
+                {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": ident, "args": {"name": name}}
+                for ident, name in self._threadNames.items()
+            )
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+
+recorder = TraceRecorder()
+
+
+class TraceSpan:
+    """Context manager recording its duration as a span"""
+
+    __slots__ = ("name", "category", "args", "_startTime")
+
+    def __init__(self, name: str, category: str = "render", args: Optional[dict] = None):
+        self.name = name
+        self.category = category
+        self.args = args
+        self._startTime = None
+
+    def __enter__(self):
+        if recorder.isRecording():
+            self._startTime = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if self._startTime is not None:
+            recorder.addSpan(self.name, self.category, self._startTime, time.perf_counter_ns(), self.args)
+            self._startTime = None
+
+
+def traced(name: str, category: str = "signal"):
+    """Decorator recording each call of a function (e.g. a signal handler) as a span"""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not recorder.isRecording():
+                return function(*args, **kwargs)
+            startTime = time.perf_counter_ns()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                recorder.addSpan(name, category, startTime, time.perf_counter_ns())
+
+        return wrapper
+
+    return decorator
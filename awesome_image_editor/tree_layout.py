@@ -0,0 +1,59 @@
+from bisect import bisect_right
+from dataclasses import dataclass
+from itertools import accumulate
+from typing import Iterable, Optional
+
+from awesome_image_editor.layers import Layer
+
+
+@dataclass
+class TreeRow:
+    layer: Layer
+    depth: int
+    height: int
+
+
+class TreeLayout:
+    """Rows of a tree view (top to bottom) indexed by prefix sums of their heights,
+    so finding the row at a position, the visible rows and the total height don't iterate all rows"""
+
+    def __init__(self):
+        self._rows: list[TreeRow] = []
+        # offsets[i] is the y position of row i, last item is the total height
+        self._offsets: list[int] = [0]
+        self._rowIndices: dict[Layer, int] = {}
+
+    def rebuild(self, rows: Iterable[TreeRow]):
+        self._rows = list(rows)
+        self._offsets = [0]
+        self._offsets.extend(accumulate(row.height for row in self._rows))
+        self._rowIndices = {row.layer: i for i, row in enumerate(self._rows)}
+
+    def __len__(self):
+        return len(self._rows)
+
+    def totalHeight(self):
+        return self._offsets[-1]
+
+    def row(self, index: int):
+        return self._rows[index]
+
+    def rowY(self, index: int):
+        return self._offsets[index]
+
+    def rowIndex(self, layer: Layer) -> Optional[int]:
+        return self._rowIndices.get(layer)
+
+    def rowAt(self, y: float) -> Optional[int]:
+        """Index of row containing content space position y"""
+        if y < 0 or y >= self.totalHeight():
+            return None
+        return bisect_right(self._offsets, y) - 1
+
+    def rowsInRange(self, top: float, bottom: float):
+        """Range of indices of rows intersecting [top, bottom] (in content space)"""
+        top = max(top, 0)
+        bottom = min(bottom, self.totalHeight() - 1)
+        if top > bottom:
+            return range(0)
+        return range(bisect_right(self._offsets, top) - 1, bisect_right(self._offsets, bottom))
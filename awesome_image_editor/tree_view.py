@@ -1,29 +1,32 @@
-from typing import Union
+from typing import Optional, Union
 
 from PyQt6.QtCore import QPoint, QRect, QSize, Qt, QMargins
 from PyQt6.QtGui import QMouseEvent, QPainter, QPaintEvent, QResizeEvent, QWheelEvent, QPalette, QPen
 from PyQt6.QtWidgets import QWidget
 
-from awesome_image_editor.icons import getIcon
-from awesome_image_editor.layers import Layer
+from awesome_image_editor.change_set import STRUCTURE_CHANGE_KINDS, ChangeKind, ChangeSet
+from awesome_image_editor.icons import getIcon, getIconPixmap
+from awesome_image_editor.layers import GroupLayer, Layer
 from awesome_image_editor.palette import AIE_PALETTE
-from awesome_image_editor.pixmap_utils import getTintedPixmap
 from awesome_image_editor.project_model import ProjectModel
+from awesome_image_editor.thumbnail_cache import ThumbnailCache
+from awesome_image_editor.tracing import traced
+from awesome_image_editor.tree_layout import TreeLayout, TreeRow
+from awesome_image_editor.update_scheduler import UpdateScheduler
 
 THUMBNAIL_SIZE = QSize(64, 64)
 THUMBNAIL_PADDING = 3
 EYE_ICON_WIDTH = EYE_ICON_HEIGHT = 20
 MARGIN = 5
+INDENT_WIDTH = 16
 
 # Pen width of 0 means "cosmetic pen" or a very thin pen
 ACTIVE_LAYER_BOX_PEN = QPen(AIE_PALETTE.highlightedText().color(), 0, Qt.PenStyle.SolidLine, Qt.PenCapStyle.FlatCap,
                             Qt.PenJoinStyle.MiterJoin)
 
-ICON_HIDDEN_PIXMAP = getIcon("layers/hidden.svg").pixmap(QSize(EYE_ICON_WIDTH, EYE_ICON_HEIGHT))
-ICON_HIDDEN_HIGHLIGHT_PIXMAP = getTintedPixmap(ICON_HIDDEN_PIXMAP, AIE_PALETTE.highlightedText())
-
-ICON_VISIBLE_PIXMAP = getIcon("layers/visible.svg").pixmap(QSize(EYE_ICON_WIDTH, EYE_ICON_HEIGHT))
-ICON_VISIBLE_HIGHLIGHT_PIXMAP = getTintedPixmap(ICON_VISIBLE_PIXMAP, AIE_PALETTE.highlightedText())
+ICON_HIDDEN_PATH = "layers/hidden.svg"
+ICON_VISIBLE_PATH = "layers/visible.svg"
+ICON_GROUP_PATH = "layers/group_layer.svg"
 
 
 def clamp(value, lower, upper):
@@ -37,13 +40,15 @@ def clamp(value, lower, upper):
 
 
 class TreeViewItem:
-    def __init__(self, x: int, y: int, layer: Layer, width: int, height: int, palette: QPalette):
+    def __init__(self, x: int, y: int, layer: Layer, width: int, height: int, palette: QPalette,
+                 thumbnailCache: ThumbnailCache):
         self.x = x
         self.y = y
         self.layer = layer
         self.width = width
         self.height = height
         self.palette = palette
+        self.thumbnailCache = thumbnailCache
 
     def containsYPos(self, y: float):
         return self.y < y < (self.y + self.height)
@@ -80,14 +85,33 @@ class TreeViewItem:
             painter.fillRect(self.rect(), self.palette.highlight())
 
     def drawEyeIcon(self, painter: QPainter):
-        if self.layer.isSelected:
-            eyeIconPixmap = ICON_HIDDEN_HIGHLIGHT_PIXMAP if self.layer.isHidden else ICON_VISIBLE_HIGHLIGHT_PIXMAP
-        else:
-            eyeIconPixmap = ICON_HIDDEN_PIXMAP if self.layer.isHidden else ICON_VISIBLE_PIXMAP
-
+        eyeIconPixmap = getIconPixmap(
+            getIcon(ICON_HIDDEN_PATH if self.layer.isHidden else ICON_VISIBLE_PATH),
+            QSize(EYE_ICON_WIDTH, EYE_ICON_HEIGHT),
+            painter.device().devicePixelRatioF(),
+            self.palette.highlightedText().color() if self.layer.isSelected else None,
+        )
         painter.drawPixmap(self.eyeIconRect(), eyeIconPixmap)
 
+    def drawGroupIcon(self, painter: QPainter):
+        thumbnailRect = self.thumbnailRect()
+        side = min(thumbnailRect.width(), thumbnailRect.height()) // 2
+        iconRect = QRect(0, 0, side, side)
+        iconRect.moveCenter(thumbnailRect.center())
+        groupIconPixmap = getIconPixmap(
+            getIcon(ICON_GROUP_PATH),
+            iconRect.size(),
+            painter.device().devicePixelRatioF(),
+            self.palette.highlightedText().color() if self.layer.isSelected else None,
+        )
+        painter.drawPixmap(iconRect, groupIconPixmap)
+
     def drawThumbnail(self, painter: QPainter):
+        if isinstance(self.layer, GroupLayer):
+            # Groups show an icon, clicking it expands or collapses the group
+            self.drawGroupIcon(painter)
+            return
+
         layerSize = self.layer.size()
 
         if layerSize.width() == 0:
@@ -95,15 +119,19 @@ class TreeViewItem:
 
         thumbnailRect = self.thumbnailRect()
         scaledSize = layerSize.scaled(thumbnailRect.size(), Qt.AspectRatioMode.KeepAspectRatio)
-        painter.save()
-        painter.translate(
+        targetRect = QRect(
             thumbnailRect.x() + thumbnailRect.width() // 2 - scaledSize.width() // 2,
             thumbnailRect.y() + thumbnailRect.height() // 2 - scaledSize.height() // 2,
+            scaledSize.width(),
+            scaledSize.height(),
         )
-        scale = scaledSize.width() / layerSize.width()
-        painter.scale(scale, scale)
-        self.layer.draw(painter)
-        painter.restore()
+
+        thumbnail = self.thumbnailCache.thumbnail(self.layer)
+        if thumbnail is None:
+            # Placeholder until thumbnail is generated in the background
+            painter.fillRect(targetRect, self.palette.alternateBase())
+        else:
+            painter.drawPixmap(targetRect, thumbnail)
 
     def drawName(self, painter: QPainter):
         painter.save()
@@ -126,34 +154,60 @@ class TreeView(QWidget):
 
         self._scrollPos = 0
 
+        # Rows are laid out once per structural change instead of on every event
+        self._layout = TreeLayout()
+        self._isLayoutDirty = True
+
+        self._thumbnailCache = ThumbnailCache(self, THUMBNAIL_SIZE.shrunkBy(
+            QMargins(THUMBNAIL_PADDING, THUMBNAIL_PADDING, THUMBNAIL_PADDING, THUMBNAIL_PADDING)))
+        self._thumbnailCache.thumbnailReady.connect(lambda: self.update())
+
+        # Scroll position is clamped once per display frame, instead of relaying out rows for every added
+        # or deleted batch of layers
+        self._updateScheduler = UpdateScheduler(self, lambda damageRects: self.updateScrollPos(0))
+
         # Needed to get mouse move events without user clicking left mouse button
         # (for example, it is needed for setting mouse pointer based on location in widget)
         self.setMouseTracking(True)
 
         # Connect signals
-        project.layersAdded.connect(lambda: self.updateScrollPos(0))
-        project.layersDeleted.connect(lambda: self.updateScrollPos(0))
-        project.layersOrderChanged.connect(lambda: self.update())
-        project.layersVisibilityChanged.connect(lambda: self.update())
-        project.layersSelectionChanged.connect(lambda: self.update())
-
-    def iterItems(self):
-        x = 0
-        y = -1 * self._scrollPos
-        # TODO: recursively return items (when layer groups or child layers are implemented)
-        for layer in self.project.iterLayersFrontToBack():
-            item = TreeViewItem(x, y, layer, self.width(), THUMBNAIL_SIZE.height(), self.palette())
-            yield item
-            y += item.height
+        project.layersChanged.connect(self.onLayersChanged)
+
+    @traced("TreeView.onLayersChanged")
+    def onLayersChanged(self, changes: ChangeSet):
+        kinds = changes.kinds()
+        if kinds & STRUCTURE_CHANGE_KINDS:
+            self._isLayoutDirty = True
+        if kinds & (ChangeKind.ADDED | ChangeKind.DELETED):
+            self._updateScheduler.schedule()
+        else:
+            self.update()
+
+    def iterRows(self):
+        for layer, depth in self.project.iterLayerTreeFrontToBack(skipCollapsed=True):
+            yield TreeRow(layer, depth, THUMBNAIL_SIZE.height())
+
+    def layout(self):
+        if self._isLayoutDirty:
+            self._layout.rebuild(self.iterRows())
+            self._isLayoutDirty = False
+        return self._layout
+
+    def createItem(self, index: int):
+        layout = self.layout()
+        row = layout.row(index)
+        x = row.depth * INDENT_WIDTH
+        y = layout.rowY(index) - self._scrollPos
+        return TreeViewItem(x, y, row.layer, self.width() - x, row.height, self.palette(), self._thumbnailCache)
+
+    def iterItems(self, indices: Optional[range] = None):
+        if indices is None:
+            indices = range(len(self.layout()))
+        for index in indices:
+            yield self.createItem(index)
 
     def iterVisibleItems(self):
-        for item in self.iterItems():
-            if (item.y + item.height) < 0:
-                continue
-            elif item.y > self.height():
-                break
-            else:
-                yield item
+        return self.iterItems(self.layout().rowsInRange(self._scrollPos, self._scrollPos + self.height()))
 
     @property
     def project(self):
@@ -169,10 +223,15 @@ class TreeView(QWidget):
 
         event.accept()
 
+    def scrollPos(self):
+        return self._scrollPos
+
+    def hasPendingThumbnails(self):
+        """Whether thumbnails of layers are still being generated"""
+        return self._thumbnailCache.hasPendingRequests()
+
     def calcItemsScreenHeight(self):
-        # TODO: change this logic when we have groups (layers is not a list anymore but a tree),
-        #       or when items have different height
-        return sum(item.height for item in self.iterItems())
+        return self.layout().totalHeight()
 
     def calcMaxScrollPos(self):
         """Calculate the scroll position needed to make the very bottom item visible without excess,
@@ -205,29 +264,26 @@ class TreeView(QWidget):
         event.accept()
 
     def findItemUnderPosition(self, pos: QPoint):
-        for item in self.iterItems():
-            if item.containsYPos(pos.y()):
-                return item
-        return None
+        index = self.layout().rowAt(pos.y() + self._scrollPos)
+        if index is None:
+            return None
+        return self.createItem(index)
 
     def selectRange(self, first: Layer, last: Layer):
         if first == last:
-            first.isSelected = True
+            self.project.setLayersSelected([first], True)
             return
 
-        itemIter = self.iterItems()
-
-        # Skip all item until we hit first or last layer, select that layer before breaking
-        for item in itemIter:
-            if item.layer in (first, last):
-                item.layer.isSelected = True
-                break
+        layout = self.layout()
+        firstIndex = layout.rowIndex(first)
+        lastIndex = layout.rowIndex(last)
+        if firstIndex is None or lastIndex is None:
+            return
+        if firstIndex > lastIndex:
+            firstIndex, lastIndex = lastIndex, firstIndex
 
-        # Continue iteration and select all layers until we hit the other layer
-        for item in itemIter:
-            item.layer.isSelected = True
-            if item.layer in (first, last):
-                break
+        layersInRange = [layout.row(index).layer for index in range(firstIndex, lastIndex + 1)]
+        self.project.setLayersSelected(layersInRange, True)
 
     def mouseSelectionHandler(self, event: QMouseEvent, layerUnderMouse: Layer):
         isLeftMouse = event.buttons() & Qt.MouseButton.LeftButton
@@ -247,10 +303,10 @@ class TreeView(QWidget):
 
         if isCtrl:
             # Toggle selection
-            layerUnderMouse.isSelected = not layerUnderMouse.isSelected
+            self.project.setLayersSelected([layerUnderMouse], not layerUnderMouse.isSelected)
             self.project.activeLayer = layerUnderMouse if layerUnderMouse.isSelected else None
         else:
-            layerUnderMouse.isSelected = True
+            self.project.setLayersSelected([layerUnderMouse], True)
             self.project.activeLayer = layerUnderMouse
 
     def mousePressEvent(self, event: QMouseEvent) -> None:
@@ -262,20 +318,26 @@ class TreeView(QWidget):
 
         if itemUnderMouse.eyeIconRect().contains(event.pos()):
             # Toggle hidden state
-            layerUnderMouse.isHidden = not layerUnderMouse.isHidden
-            self.project.layersVisibilityChanged.emit()
+            self.project.setLayerHidden(layerUnderMouse, not layerUnderMouse.isHidden)
+        elif isinstance(layerUnderMouse, GroupLayer) and itemUnderMouse.thumbnailRect().contains(event.pos()):
+            layerUnderMouse.isExpanded = not layerUnderMouse.isExpanded
+            self._isLayoutDirty = True
+            self.updateScrollPos(0)
         else:
             self.mouseSelectionHandler(event, layerUnderMouse)
-            self.project.layersSelectionChanged.emit()
+            # Active layer may change without any selection change
+            self.update()
 
         event.accept()
 
+    @traced("TreeView.paintEvent", "render")
     def paintEvent(self, event: QPaintEvent) -> None:
         painter = QPainter()
         painter.begin(self)
         painter.setRenderHint(QPainter.RenderHint.TextAntialiasing, True)
         painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform, True)
         painter.fillRect(event.rect(), self.palette().base())
+        self._thumbnailCache.setDevicePixelRatio(self.devicePixelRatioF())
         for item in self.iterVisibleItems():
             item.draw(painter)
 
@@ -0,0 +1,62 @@
+import time
+from typing import Callable
+
+from PyQt6.QtCore import QObject, QRect, QTimer
+from PyQt6.QtWidgets import QWidget
+
+from awesome_image_editor.tracing import TraceSpan
+
+DEFAULT_REFRESH_RATE = 60
+
+
+class UpdateScheduler(QObject):
+    """Coalesces updates requested by model signal handlers of a widget, so a burst of signals (e.g. one per mouse
+    move) costs one update per display frame: damage rectangles are collected and flushed with a single call.
+
+    The first request after an idle period is flushed as soon as control returns to the event loop,
+    later requests wait until a frame has passed since the last flush."""
+
+    def __init__(self, widget: QWidget, flush: Callable[[list[QRect]], None]):
+        super().__init__(widget)
+        self._widget = widget
+        self._flush = flush
+        self._damageRects: list[QRect] = []
+        self._lastFlushTime = float("-inf")
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self.flush)
+
+    def frameInterval(self):
+        """Seconds between frames of the widget's screen"""
+        screen = self._widget.screen()
+        refreshRate = screen.refreshRate() if screen is not None else 0
+        return 1 / (refreshRate if refreshRate > 0 else DEFAULT_REFRESH_RATE)
+
+    def addDamage(self, rect: QRect):
+        # Overlapping damage (e.g. a layer dragged by several mouse moves) is merged into one rectangle,
+        # damage far apart is kept separate instead of flushing everything between it
+        for i, damageRect in enumerate(self._damageRects):
+            if damageRect.intersects(rect):
+                self._damageRects.pop(i)
+                self.addDamage(damageRect.united(rect))
+                return
+        self._damageRects.append(QRect(rect))
+        self.schedule()
+
+    def schedule(self):
+        """Request a flush without adding damage (e.g. when the viewport changed)"""
+        if self._timer.isActive():
+            return
+        remaining = self.frameInterval() - (time.perf_counter() - self._lastFlushTime)
+        self._timer.start(round(remaining * 1000) if remaining > 0 else 0)
+
+    def isPending(self):
+        return self._timer.isActive()
+
+    def flush(self):
+        """Flush now, collected damage is passed to the flush callback (empty if only schedule was called)"""
+        self._timer.stop()
+        damageRects, self._damageRects = self._damageRects, []
+        self._lastFlushTime = time.perf_counter()
+        with TraceSpan("UpdateScheduler.flush", "signal"):
+            self._flush(damageRects)
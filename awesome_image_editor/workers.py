@@ -0,0 +1,18 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+_threadPool: Optional[ThreadPoolExecutor] = None
+
+
+def workerCount():
+    return os.cpu_count() or 1
+
+
+def getThreadPool() -> ThreadPoolExecutor:
+    """Get the shared thread pool used for background work (decoding, compositing, ...),
+    Qt releases the GIL while decoding and painting so this uses all cores"""
+    global _threadPool
+    if _threadPool is None:
+        _threadPool = ThreadPoolExecutor(max_workers=workerCount(), thread_name_prefix="AIEWorker")
+    return _threadPool
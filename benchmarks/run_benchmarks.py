@@ -0,0 +1,268 @@
+"""Benchmarks of canvas compositing, layer panel painting and image import on synthetic projects.
+
+Run from the repository root (the offscreen Qt platform is used unless QT_QPA_PLATFORM is set):
+
+    python -m benchmarks.run_benchmarks --layers 200 --size 512 --output results.json
+    python -m benchmarks.run_benchmarks --output new.json --compare results.json
+
+Every benchmark is run --repeat times, results (in seconds) are written as JSON together with
+the parameters and the git commit, so runs of different commits can be compared."""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt6.QtCore import PYQT_VERSION_STR, QT_VERSION_STR, QPoint, QSize  # noqa
+from PyQt6.QtGui import QColor, QImage, QPainter  # noqa
+from PyQt6.QtWidgets import QWidget  # noqa
+
+from awesome_image_editor.app import Application  # noqa
+
+# Create app before importing widgets, same as the application's entry point
+app = Application(sys.argv[:1])
+
+from awesome_image_editor.change_set import ChangeSet  # noqa
+from awesome_image_editor.layers import ImageLayer  # noqa
+from awesome_image_editor.menubar.file.import_images import ImageImporter  # noqa
+from awesome_image_editor.project_model import ProjectModel  # noqa
+from awesome_image_editor.tiled_canvas import TiledCanvas  # noqa
+from awesome_image_editor.tree_view import TreeView  # noqa
+
+TREE_VIEW_SIZE = QSize(300, 900)
+SCROLL_STEP = 120
+HIT_TEST_COUNT = 10000
+
+
+def createImage(size: int, seed: int):
+    rng = random.Random(seed)
+    image = QImage(size, size, QImage.Format.Format_ARGB32_Premultiplied)
+    image.fill(QColor(rng.randrange(256), rng.randrange(256), rng.randrange(256), 255))
+    painter = QPainter()
+    painter.begin(image)
+    for _ in range(16):
+        color = QColor(rng.randrange(256), rng.randrange(256), rng.randrange(256), rng.randrange(64, 256))
+        painter.fillRect(rng.randrange(size), rng.randrange(size), size // 4, size // 4, color)
+    painter.end()
+    return image
+
+
+def createProject(layerCount: int, layerSize: int, canvasSize: QSize):
+    """Project with layers scattered over the canvas, images are shared between layers to save memory"""
+    rng = random.Random(0)
+    images = [createImage(layerSize, seed) for seed in range(min(layerCount, 16))]
+    project = ProjectModel(None, canvasSize)
+    layers = []
+    for i in range(layerCount):
+        layer = ImageLayer(images[i % len(images)])
+        layer.name = f"Layer {i}"
+        layer.location = QPoint(
+            rng.randrange(max(1, canvasSize.width() - layerSize)),
+            rng.randrange(max(1, canvasSize.height() - layerSize)),
+        )
+        layers.append(layer)
+    project.addLayersToFront(layers)
+    return project
+
+
+def createCanvas(project: ProjectModel):
+    """Synchronous tiled canvas updated from project changes the same way CanvasView does"""
+    canvas = TiledCanvas(None, project)
+
+    def onLayersChanged(changes: ChangeSet):
+        damageRect = changes.damageRect()
+        if not damageRect.isEmpty():
+            canvas.invalidate(damageRect)
+            canvas.repaintDirtyTiles()
+
+    project.layersChanged.connect(onLayersChanged)
+    canvas.repaintDirtyTiles()
+    return canvas
+
+
+def measure(function: Callable[[], None], repeat: int, setup: Optional[Callable[[], None]] = None):
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        startTime = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - startTime)
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.fmean(times),
+        "runs": len(times),
+    }
+
+
+def benchmarkCanvas(args, results: dict):
+    project = createProject(args.layers, args.size, args.canvas)
+    canvas = createCanvas(project)
+    layers = list(project.iterLayersBackToFront())
+    middleLayer = layers[len(layers) // 2]
+
+    results["canvas.full_recomposite"] = measure(canvas.repaintDirtyTiles, args.repeat, canvas.invalidateAll)
+
+    deltas = iter([QPoint(5, 3), QPoint(-5, -3)] * args.repeat)
+    results["canvas.move_layer"] = measure(lambda: project.moveLayers([middleLayer], next(deltas)), args.repeat)
+
+    results["canvas.toggle_visibility"] = measure(
+        lambda: project.setLayerHidden(middleLayer, not middleLayer.isHidden), args.repeat
+    )
+
+    rng = random.Random(0)
+    points = [QPoint(rng.randrange(args.canvas.width()), rng.randrange(args.canvas.height()))
+              for _ in range(HIT_TEST_COUNT)]
+
+    def pickLayers():
+        for point in points:
+            project.layerAt(point, isAlphaAccurate=True)
+
+    results["canvas.pick_10k"] = measure(pickLayers, args.repeat)
+
+
+def benchmarkTreeView(args, results: dict):
+    project = createProject(args.layers, args.size, args.canvas)
+    parent = QWidget()
+    treeView = TreeView(parent, project)
+    treeView.resize(TREE_VIEW_SIZE)
+    target = QImage(TREE_VIEW_SIZE, QImage.Format.Format_ARGB32_Premultiplied)
+
+    # Paint once and let thumbnails generate, so scrolling measures painting rather than thumbnail creation
+    treeView.render(target)
+    waitForThumbnails = time.perf_counter() + 10
+    while time.perf_counter() < waitForThumbnails and treeView.hasPendingThumbnails():
+        app.processEvents()
+
+    maxScrollPos = treeView.calcMaxScrollPos()
+    scrollDelta = [-SCROLL_STEP]
+
+    def scroll():
+        # Scroll down to the bottom, then back up to the top
+        if treeView.scrollPos() >= maxScrollPos:
+            scrollDelta[0] = SCROLL_STEP
+        elif treeView.scrollPos() <= 0:
+            scrollDelta[0] = -SCROLL_STEP
+        treeView.updateScrollPos(scrollDelta[0])
+        treeView.render(target)
+
+    results["tree_view.scroll_paint"] = measure(scroll, args.repeat)
+
+    rng = random.Random(0)
+    positions = [QPoint(10, rng.randrange(TREE_VIEW_SIZE.height())) for _ in range(HIT_TEST_COUNT)]
+
+    def hitTest():
+        for position in positions:
+            treeView.findItemUnderPosition(position)
+
+    results["tree_view.hit_test_10k"] = measure(hitTest, args.repeat)
+    parent.deleteLater()
+
+
+def benchmarkImport(args, results: dict):
+    with tempfile.TemporaryDirectory() as directory:
+        fileNames = []
+        for i in range(args.import_count):
+            fileName = str(Path(directory) / f"image{i:04d}.png")
+            createImage(args.size, i).save(fileName)
+            fileNames.append(fileName)
+
+        parent = QWidget()
+        project = ProjectModel(None, args.canvas)
+
+        def importImages(proxySize: Optional[QSize] = None):
+            importer = ImageImporter(parent, project, fileNames, proxySize)
+            finished = []
+            importer.destroyed.connect(lambda: finished.append(True))
+            importer.start()
+            while len(finished) == 0:
+                app.processEvents()
+
+        def resetProject():
+            project.reset(args.canvas, [])
+
+        results["import.batch"] = measure(importImages, args.repeat, resetProject)
+        # Proxies a quarter of the images' size
+        proxySize = QSize(args.size // 4, args.size // 4)
+        results["import.batch_proxies"] = measure(lambda: importImages(proxySize), args.repeat, resetProject)
+        parent.deleteLater()
+
+
+def gitCommit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def printComparison(results: dict, baseline: dict):
+    for name, result in results.items():
+        baselineResult = baseline.get(name)
+        if baselineResult is None:
+            continue
+        ratio = result["median"] / baselineResult["median"] if baselineResult["median"] > 0 else float("inf")
+        print(f"{name:32} {baselineResult['median'] * 1000:10.3f}ms -> {result['median'] * 1000:10.3f}ms "
+              f"({ratio:.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--layers", type=int, default=200, help="number of layers in synthetic projects")
+    parser.add_argument("--size", type=int, default=512, help="side length of synthetic layers")
+    parser.add_argument("--canvas", type=lambda s: QSize(*map(int, s.split("x"))), default=QSize(4096, 4096),
+                        help="canvas size as WIDTHxHEIGHT")
+    parser.add_argument("--import-count", type=int, default=24, help="number of images imported in a batch")
+    parser.add_argument("--repeat", type=int, default=5, help="number of runs of every benchmark")
+    parser.add_argument("--output", type=Path, help="write results to this JSON file")
+    parser.add_argument("--compare", type=Path, help="print changes relative to results in this JSON file")
+    args = parser.parse_args()
+
+    results = {}
+    benchmarkCanvas(args, results)
+    benchmarkTreeView(args, results)
+    benchmarkImport(args, results)
+
+    report = {
+        "commit": gitCommit(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "qt": QT_VERSION_STR,
+        "pyqt": PYQT_VERSION_STR,
+        "cpuCount": os.cpu_count(),
+        "parameters": {
+            "layers": args.layers,
+            "size": args.size,
+            "canvas": [args.canvas.width(), args.canvas.height()],
+            "importCount": args.import_count,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare is not None:
+        with open(args.compare, encoding="utf-8") as file:
+            printComparison(results, json.load(file)["results"])
+
+
+if __name__ == "__main__":
+    main()